@@ -3,13 +3,14 @@ from discord.ext import commands
 import logging
 import re
 import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator
 import asyncio
 
 from tools.discord_monitor import DiscordMonitor # Pode ser removido ou adaptado se os eventos forem tratados aqui
 from tools.simple_classifier import SimpleClassifier
 from utils.free_tier_orchestrator import FreeTierOrchestrator
-from config import DISCORD_BOT_TOKEN, LOGGING_CONFIG
+from utils.deadline import Deadline
+from config import DISCORD_BOT_TOKEN, LOGGING_CONFIG, DISCORD_STREAMING_ENABLED, DISCORD_STREAM_EDIT_INTERVAL, DISCORD_RESPONSE_DEADLINE
 import logging.config
 
 # Configura o logging
@@ -33,6 +34,10 @@ class DiscordAITutorFree(commands.Bot):
 
         logger.info("DiscordAITutorFree inicializado.")
 
+    async def setup_hook(self):
+        """Chamado pelo discord.py antes de conectar: inicia as tarefas periódicas no loop do bot."""
+        self.orchestrator.start_background_tasks()
+
     async def on_ready(self):
         """Evento chamado quando o bot está pronto e conectado ao Discord."""
         logger.info(f'Bot conectado como {self.user} (ID: {self.user.id})')
@@ -87,12 +92,21 @@ class DiscordAITutorFree(commands.Bot):
             if is_ai_question or classification_result['confidence_score'] > 0.3: # Responde se for IA ou tiver confiança razoável
                 self.last_response_time[message.author.id] = time.time() # Atualiza timestamp do anti-spam
 
-                # Processa a mensagem com o orquestrador de IA
+                # Processa a mensagem com o orquestrador de IA, dentro do prazo de resposta: o que passar
+                # dele é cancelado e o usuário recebe a resposta do cache ou uma mensagem degradada
+                deadline = Deadline(DISCORD_RESPONSE_DEADLINE)
                 async with message.channel.typing(): # Mostra que o bot está digitando
-                    response = await self.orchestrator.generate_response(clean_message_content, classification_result)
-                    if response:
-                        await self._send_long_message(message.channel, response)
+                    if DISCORD_STREAMING_ENABLED:
+                        # Envia a resposta assim que o primeiro trecho chega e a completa por edições
+                        response = await self._send_streamed_message(
+                            message.channel,
+                            self.orchestrator.generate_response_stream(clean_message_content, classification_result, deadline=deadline)
+                        )
                     else:
+                        response = await self.orchestrator.generate_response(clean_message_content, classification_result, deadline=deadline)
+                        if response:
+                            await self._send_long_message(message.channel, response)
+                    if not response:
                         await message.channel.send("Desculpe, não consegui gerar uma resposta no momento. Tente novamente mais tarde.")
             else:
                 logger.debug(f"Mensagem não classificada como pergunta de IA ou com baixa confiança: '{clean_message_content}'")
@@ -102,6 +116,11 @@ class DiscordAITutorFree(commands.Bot):
         else:
             logger.debug(f"Mensagem não direcionada ao bot: '{message.content}'")
 
+    async def close(self):
+        """Encerra o bot, garantindo o flush do cache antes de desconectar."""
+        await self.orchestrator.ashutdown()
+        await super().close()
+
     def _clean_mention(self, text: str) -> str:
         """Remove a menção do bot do início da mensagem."""
         if self.user:
@@ -120,6 +139,49 @@ class DiscordAITutorFree(commands.Bot):
             await channel.send(chunk)
             await asyncio.sleep(0.5) # Pequeno delay para evitar rate limit do Discord
 
+    async def _send_streamed_message(self, channel: discord.TextChannel, chunks: AsyncIterator[str],
+                                     edit_interval: float = DISCORD_STREAM_EDIT_INTERVAL) -> str:
+        """
+        Envia uma resposta em streaming: a primeira mensagem sai com o primeiro trecho e é editada
+        no máximo a cada `edit_interval` segundos. Ao passar de 2000 caracteres, a mensagem é
+        finalizada e a resposta continua em uma nova. Retorna o texto completo enviado.
+        """
+        text = ""
+        message_start = 0 # Posição no texto onde começa a mensagem atual
+        current_message = None
+        shown = "" # Conteúdo visível da mensagem atual
+        last_edit = 0.0
+
+        async for chunk in chunks:
+            text += chunk
+            while len(text) - message_start > 2000:
+                # Finaliza a mensagem atual com exatamente 2000 caracteres e continua em uma nova
+                content = text[message_start:message_start + 2000]
+                if current_message is None:
+                    await channel.send(content)
+                elif content != shown:
+                    await current_message.edit(content=content)
+                message_start += 2000
+                current_message, shown = None, ""
+            content = text[message_start:]
+            if not content.strip():
+                continue
+            now = time.monotonic()
+            if current_message is None:
+                current_message = await channel.send(content)
+                shown, last_edit = content, now
+            elif now - last_edit >= edit_interval and content != shown:
+                await current_message.edit(content=content)
+                shown, last_edit = content, now
+
+        content = text[message_start:]
+        if content.strip() and content != shown:
+            if current_message is None:
+                await channel.send(content)
+            else:
+                await current_message.edit(content=content)
+        return text
+
     def _add_commands(self):
         """Adiciona os comandos administrativos ao bot."""
 
@@ -137,6 +199,7 @@ class DiscordAITutorFree(commands.Bot):
                 f"Total de Requisições Processadas: {orchestrator_stats['total_requests_processed']}\n"
                 f"Chamadas à API (Gemini): {orchestrator_stats['api_calls_total']}\n"
                 f"Hits de Cache Salvos: {orchestrator_stats['cache_hits_total']}\n"
+                f"Chamadas Deduplicadas (perguntas idênticas simultâneas): {orchestrator_stats['deduplicated_calls_total']}\n"
                 f"```\n"
                 "**Métricas por Agente:**\n"
                 "```\n"
@@ -145,6 +208,23 @@ class DiscordAITutorFree(commands.Bot):
                 status_message += f"- {agent_name}:\n"
                 status_message += f"  API Calls: {metrics['api_calls']}\n"
                 status_message += f"  Cache Hits: {metrics['cache_hits']}\n"
+                for model_name, model_metrics in metrics['models'].items():
+                    status_message += f"  {model_name}: {model_metrics['api_calls']} chamadas, {model_metrics['avg_response_time']:.2f}s em média\n"
+                status_message += f"  Escaladas para o modelo do agente: {metrics['escalations']}\n"
+            status_message += "```\n**Fila da API por Prioridade:**\n```\n"
+            for priority_class, queue in orchestrator_stats['request_queue'].items():
+                status_message += f"- {priority_class}: {queue['queued']} na fila (máx. {queue['max_queued']}), {queue['dispatched']} atendidas, espera média {queue['avg_wait_seconds']}s (máx. {queue['max_wait_seconds']}s)\n"
+            deadlines = orchestrator_stats['deadlines']
+            status_message += "```\n**Prazo das Respostas:**\n```\n"
+            status_message += f"Prazos Esgotados: {deadlines['exceeded_total']} de {deadlines['requests']} requisições\n"
+            for stage, count in deadlines['exceeded_by_stage'].items():
+                status_message += f"  Esgotados em {stage}: {count}\n"
+            for stage, seconds in deadlines['avg_stage_seconds'].items():
+                status_message += f"- {stage}: {seconds}s em média\n"
+            status_message += "```\n**Chaves da API:**\n```\n"
+            for label, key in orchestrator_stats['api_keys'].items():
+                state = "disponível" if key['available'] else f"fora do rodízio por {key['disabled_seconds']}s"
+                status_message += f"- {label}: {state}, {key['granted']} chamadas, {key['rate_limited']} respostas 429\n"
             status_message += "```"
             
             await self._send_long_message(ctx.channel, status_message)
@@ -153,6 +233,10 @@ class DiscordAITutorFree(commands.Bot):
         async def cache_info(ctx: commands.Context):
             logger.info(f"Comando !ia cache executado por {ctx.author.name}")
             cache_stats = self.orchestrator.cache.get_stats()
+            policy_lines = "".join(
+                f"  {category}: TTL {policy.ttl_seconds / 3600:.1f}h{'' if policy.cacheable else ' (não cacheável)'}\n"
+                for category, policy in self.orchestrator.cache.policies.items()
+            )
             cache_message = (
                 "**Informações do Cache:**\n"
                 f"```\n"
@@ -161,8 +245,16 @@ class DiscordAITutorFree(commands.Bot):
                 f"Misses de Cache: {cache_stats['misses']}\n"
                 f"Total de Requisições de Cache: {cache_stats['total_requests']}\n"
                 f"Taxa de Acerto do Cache: {cache_stats['hit_rate_percent']}%\n"
+                f"Hits Exatos / Similares: {cache_stats['exact_hits']} / {cache_stats['similar_hits']}\n"
+                f"Hits Frescos / Obsoletos: {cache_stats['fresh_hits']} / {cache_stats['stale_hits']} (revalidações: {cache_stats['refreshes']})\n"
+                f"Hits de Versões Anteriores do Template: {cache_stats['fallback_hits']} (re-aquecidas: {self.orchestrator.rewarmed_entries})\n"
+                f"Remoções ({cache_stats['admission']}): {cache_stats['evictions']} (rejeições na admissão: {cache_stats['admission_rejections']})\n"
+                f"Entradas Expiradas: {cache_stats['expired_entries']}\n"
+                f"Escritas Pendentes: {cache_stats['pending_writes']}\n"
+                f"Último Flush: {cache_stats['last_flush_ms']}ms (média {cache_stats['avg_flush_ms']}ms)\n"
                 f"Arquivo de Cache: {self.orchestrator.cache.cache_file}\n"
-                f"Tempo de Expiração (TTL): {self.orchestrator.cache.ttl_seconds / 3600:.1f} horas\n"
+                f"Tempo de Expiração (TTL padrão): {self.orchestrator.cache.ttl_seconds / 3600:.1f} horas\n"
+                f"{policy_lines}"
                 f"```"
             )
             await ctx.send(cache_message)
@@ -171,9 +263,7 @@ class DiscordAITutorFree(commands.Bot):
         @commands.has_permissions(administrator=True) # Requer permissão de administrador
         async def reset(ctx: commands.Context):
             logger.warning(f"Comando !ia reset executado por {ctx.author.name} (Admin).")
-            self.orchestrator.cache.cleanup_expired() # Garante que o cache está limpo
-            self.orchestrator.cache.cache = {} # Limpa o cache em memória
-            self.orchestrator.cache._save_cache() # Salva o cache vazio
+            await self.orchestrator.cache.aclear() # Limpa o cache em memória e persiste o cache vazio, fora do loop
             self.orchestrator.reset_stats()
             self.last_response_time = {} # Reseta o anti-spam também
             await ctx.send("Cache limpo e estatísticas resetadas com sucesso!")
@@ -0,0 +1,104 @@
+import os
+import re
+import sys
+import random
+import tempfile
+import time
+from typing import List, Dict, Any, Optional, Sequence
+
+# Permite executar o script diretamente (python benchmarks/admission_benchmark.py) a partir da raiz do projeto
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tools.response_cache import ResponseCache
+
+# Linha registrada pelo bot para cada pergunta recebida (agents/discord_tutor.py)
+_LOG_QUESTION_PATTERN = re.compile(r"Mensagem limpa para processamento: '(.*)'$")
+_LOG_LINE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+def load_trace(trace_file: str) -> List[str]:
+    """
+    Carrega um trace de perguntas: uma pergunta por linha, ou o log do bot
+    (discord_ai_tutor.log), do qual são extraídas as perguntas processadas.
+    """
+    trace = []
+    with open(trace_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            match = _LOG_QUESTION_PATTERN.search(line)
+            if match:
+                trace.append(match.group(1))
+            elif line.strip() and not _LOG_LINE_PATTERN.match(line): # Demais linhas de log são ignoradas
+                trace.append(line.strip())
+    return trace
+
+def synthetic_trace(length: int = 20000, catalog_size: int = 2000, zipf_s: float = 0.9,
+                    one_hit_fraction: float = 0.3, seed: int = 42) -> List[str]:
+    """
+    Gera um trace com perguntas recorrentes de popularidade Zipf, intercaladas
+    com perguntas únicas (feitas uma só vez), como no uso real do bot.
+    """
+    rng = random.Random(seed)
+    weights = [1 / (rank ** zipf_s) for rank in range(1, catalog_size + 1)]
+    trace = []
+    for i in range(length):
+        if rng.random() < one_hit_fraction:
+            trace.append(f"pergunta unica {i}")
+        else:
+            trace.append(f"pergunta recorrente {rng.choices(range(catalog_size), weights)[0]}")
+    return trace
+
+def replay(trace: Sequence[str], admission: str, max_entries: int) -> Dict[str, Any]:
+    """
+    Reproduz o trace como o orquestrador faz: consulta o cache e, em um miss,
+    armazena a resposta. Retorna a taxa de acerto e as remoções da política.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        cache_manager = ResponseCache(
+            cache_file=os.path.join(workdir, "benchmark_cache.json"), ttl_hours=24 * 365,
+            max_entries=max_entries, admission=admission,
+            write_behind=True, flush_interval=3600, flush_threshold=len(trace) + 1
+        )
+        start = time.perf_counter()
+        for question in trace:
+            if cache_manager.get_cached_response(question) is None:
+                cache_manager.cache_response(question, f"Resposta para: {question}")
+        elapsed = time.perf_counter() - start
+        stats = cache_manager.get_stats()
+        cache_manager.close()
+    return {
+        "admission": admission,
+        "max_entries": max_entries,
+        "hit_rate_percent": stats['hit_rate_percent'],
+        "evictions": stats['evictions'],
+        "admission_rejections": stats['admission_rejections'],
+        "replay_us": round(elapsed / len(trace) * 1e6, 1) if trace else 0.0,
+    }
+
+def run_benchmark(trace: Sequence[str], capacities: Sequence[int]) -> List[Dict[str, Any]]:
+    """Compara LRU e TinyLFU para cada capacidade do cache."""
+    return [replay(trace, admission, capacity) for capacity in capacities for admission in ("lru", "tinylfu")]
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = [f"{'Política':<10}{'Entradas':>10}{'Acerto (%)':>12}{'Remoções':>10}{'Rejeições':>11}{'µs/req':>9}"]
+    for row in results:
+        lines.append(
+            f"{row['admission']:<10}{row['max_entries']:>10}{row['hit_rate_percent']:>12}"
+            f"{row['evictions']:>10}{row['admission_rejections']:>11}{row['replay_us']:>9}"
+        )
+    return "\n".join(lines)
+
+def main(trace_file: Optional[str] = None, capacities: Sequence[int] = (100, 500, 1000)):
+    if trace_file:
+        trace = load_trace(trace_file)
+        source = trace_file
+    else:
+        trace = synthetic_trace()
+        source = "trace sintético (Zipf + perguntas únicas)"
+    if not trace:
+        print(f"Nenhuma pergunta encontrada em {trace_file}.")
+        return
+    print(f"Benchmark de admissão com {len(trace)} perguntas ({len(set(trace))} distintas) de {source}:")
+    print(format_results(run_benchmark(trace, capacities)))
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
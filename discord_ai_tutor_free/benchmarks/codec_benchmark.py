@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+from typing import List, Dict, Any, Sequence
+
+# Permite executar o script diretamente (python benchmarks/codec_benchmark.py) a partir da raiz do projeto
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tools.response_cache import Codec, ZlibCodec, ZlibDictCodec, train_zlib_dictionary
+
+def benchmark_codecs(samples: Sequence[str], codecs: Sequence[Codec], repeats: int = 5) -> List[Dict[str, Any]]:
+    """
+    Mede, para cada codec, a taxa de compressão do corpus e as latências médias
+    de compressão e descompressão por resposta.
+    """
+    raw = [sample.encode('utf-8') for sample in samples]
+    raw_bytes = sum(len(data) for data in raw)
+    results = []
+    for codec in codecs:
+        start = time.perf_counter()
+        compressed = [codec.compress(data) for data in raw]
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for data in compressed:
+                codec.decompress(data)
+        decode_time = (time.perf_counter() - start) / repeats
+
+        compressed_bytes = sum(len(data) for data in compressed)
+        results.append({
+            "codec": codec.label,
+            "raw_bytes": raw_bytes,
+            "compressed_bytes": compressed_bytes,
+            "ratio": round(raw_bytes / compressed_bytes, 2) if compressed_bytes else 0.0,
+            "encode_us": round(encode_time / len(raw) * 1e6, 1) if raw else 0.0,
+            "decode_us": round(decode_time / len(raw) * 1e6, 1) if raw else 0.0,
+        })
+    return results
+
+def run_benchmark(samples: Sequence[str], holdout_fraction: float = 0.3) -> List[Dict[str, Any]]:
+    """
+    Treina um dicionário com parte do corpus e compara zlib e zlib-dict nas respostas
+    restantes, para que a taxa reflita respostas que o dicionário não viu.
+    """
+    split = max(1, int(len(samples) * (1 - holdout_fraction)))
+    training, holdout = samples[:split], samples[split:] or samples
+    dictionary = train_zlib_dictionary(training)
+    return benchmark_codecs(holdout, [ZlibCodec(), ZlibDictCodec(dictionary, dict_version=0)])
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = [f"{'Codec':<14}{'Bytes':>12}{'Comprimido':>12}{'Taxa':>8}{'Enc (µs)':>10}{'Dec (µs)':>10}"]
+    for row in results:
+        lines.append(
+            f"{row['codec']:<14}{row['raw_bytes']:>12}{row['compressed_bytes']:>12}"
+            f"{row['ratio']:>8}{row['encode_us']:>10}{row['decode_us']:>10}"
+        )
+    return "\n".join(lines)
+
+def main():
+    from utils.cache_factory import create_response_cache
+
+    cache_manager = create_response_cache(write_behind=False)
+    samples = list(cache_manager.iter_responses(limit=2000))
+    cache_manager.close()
+    if len(samples) < 10:
+        print(f"Corpus insuficiente para o benchmark: {len(samples)} respostas no cache.")
+        return
+    print(f"Benchmark de codecs com {len(samples)} respostas de {cache_manager.cache_file}:")
+    print(format_results(run_benchmark(samples)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+from typing import List, Dict, Any, Sequence
+
+# Permite executar o script diretamente (python benchmarks/model_registry_benchmark.py) a partir da raiz do projeto
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import google.generativeai as genai
+
+from utils.free_tier_orchestrator import FreeTierOrchestrator, Agent
+
+def load_agents() -> List[Agent]:
+    """Agentes do orquestrador, com as mesmas configurações usadas pelo bot."""
+    return [
+        Agent(name=config["name"], model=config["model"], instruction=config["instruction"],
+              generation_config=config.get("generation_config"))
+        for config in FreeTierOrchestrator._define_agent_configs().values()
+    ]
+
+def _build(agent: Agent) -> Any:
+    return genai.GenerativeModel(agent.model, generation_config=agent.generation_config)
+
+def benchmark_model_reuse(agents: Sequence[Agent], attempts: int = 5000,
+                          prompt: str = "Explique o que é uma rede neural.") -> List[Dict[str, Any]]:
+    """
+    Compara, por tentativa de chamada à API, criar um GenerativeModel novo (como antes)
+    com reutilizar o modelo do registro por agente. Mede só a obtenção do modelo e também
+    a preparação da requisição que generate_content_async faz antes de ir à rede.
+    """
+    results = []
+    registry = {}
+    start = time.perf_counter()
+    for agent in agents:
+        registry[agent.name] = _build(agent)
+    setup_time = time.perf_counter() - start
+
+    strategies = {
+        "por tentativa": _build,
+        "registro": lambda agent: registry[agent.name],
+    }
+    for label, get_model in strategies.items():
+        start = time.perf_counter()
+        for attempt in range(attempts):
+            get_model(agents[attempt % len(agents)])
+        obtain_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for attempt in range(attempts):
+            get_model(agents[attempt % len(agents)])._prepare_request(contents=prompt)
+        request_time = time.perf_counter() - start
+
+        results.append({
+            "strategy": label,
+            "obtain_us": round(obtain_time / attempts * 1e6, 2),
+            "request_us": round(request_time / attempts * 1e6, 2),
+            "setup_us": round(setup_time * 1e6, 1) if label == "registro" else 0.0,
+        })
+    return results
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = [f"{'Estratégia':<16}{'Modelo (µs)':>13}{'Modelo + requisição (µs)':>26}{'Criação única (µs)':>20}"]
+    for row in results:
+        lines.append(f"{row['strategy']:<16}{row['obtain_us']:>13}{row['request_us']:>26}{row['setup_us']:>20}")
+    return "\n".join(lines)
+
+def main(attempts: int = 5000):
+    agents = load_agents()
+    results = benchmark_model_reuse(agents, attempts)
+    print(f"Benchmark de {attempts} tentativas de chamada distribuídas entre {len(agents)} agentes (sem rede):")
+    print(format_results(results))
+    per_attempt, registry = results
+    if registry['obtain_us'] > 0:
+        print(f"Obtenção do modelo {per_attempt['obtain_us'] / registry['obtain_us']:.0f}x mais rápida com o registro.")
+
+if __name__ == "__main__":
+    main()
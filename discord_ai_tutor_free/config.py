@@ -5,6 +5,15 @@ load_dotenv()
 
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# Chaves adicionais (separadas por vírgula): cada uma tem a própria cota gratuita, e as chamadas são distribuídas entre elas
+GOOGLE_API_KEYS = list(dict.fromkeys(
+    key.strip() for key in [GOOGLE_API_KEY or ""] + os.getenv("GOOGLE_API_KEYS", "").split(",") if key.strip()
+))
+
+# Respostas em streaming no Discord: a mensagem é enviada no primeiro trecho e editada conforme a resposta chega
+DISCORD_STREAMING_ENABLED = True
+DISCORD_STREAM_EDIT_INTERVAL = 1.0  # Segundos mínimos entre edições da mesma mensagem (limite de edições do Discord)
+DISCORD_RESPONSE_DEADLINE = 30  # Prazo, em segundos, para responder uma pergunta (fila, API e retries); depois disso, resposta do cache ou degradada
 
 # Configurações de Logging
 LOGGING_CONFIG = {
@@ -45,5 +54,65 @@ LOGGING_CONFIG = {
 }
 
 # Configurações de Cache
-CACHE_FILE = "response_cache.json"
+# Os arquivos ficam na raiz do projeto (e não no diretório atual), para que o bot, a CLI e o dashboard usem o mesmo cache
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.dirname(os.path.abspath(__file__)))
+CACHE_FILE = os.path.join(CACHE_DIR, "response_cache.json")
 CACHE_EXPIRATION_TIME = 3600  # Tempo em segundos (1 hora)
+CACHE_STALE_GRACE_PERIOD = 1800  # Segundos após a expiração em que a resposta ainda é servida enquanto é revalidada em background (0 desativa)
+# Política de cache por categoria do classificador: TTL (segundos), limiar de compressão (bytes) e se a resposta é cacheável.
+# Conceitos e recomendações de recursos mudam pouco e ficam mais tempo em cache; conversa geral expira rápido.
+CACHE_POLICIES = {
+    "concept": {"ttl": 7 * 24 * 3600, "compression_threshold": 1024, "cacheable": True},
+    "code": {"ttl": 24 * 3600, "compression_threshold": 512, "cacheable": True},
+    "resource": {"ttl": 14 * 24 * 3600, "compression_threshold": 1024, "cacheable": True},
+    "general": {"ttl": CACHE_EXPIRATION_TIME, "compression_threshold": 1024, "cacheable": True},
+}
+CACHE_STORAGE = "sqlite"  # 'json' (arquivo único reescrito), 'log' (log append-only) ou 'sqlite' (WAL, consulta sob demanda)
+CACHE_LOG_FILE = os.path.join(CACHE_DIR, "response_cache.aof")  # Arquivo do log append-only quando CACHE_STORAGE = 'log'
+CACHE_SQLITE_FILE = os.path.join(CACHE_DIR, "response_cache.db")  # Banco SQLite quando CACHE_STORAGE = 'sqlite' (compartilhado entre processos)
+CACHE_PATHS = {"json": CACHE_FILE, "log": CACHE_LOG_FILE, "sqlite": CACHE_SQLITE_FILE}
+CACHE_SYNC_INTERVAL = 1.0  # Segundos entre consultas aos avisos de invalidação de outros processos (apenas 'sqlite')
+CACHE_COMPACTION_RATIO = 0.5  # Fração de registros mortos que dispara a compactação do log
+CACHE_CODEC = "zlib-dict"  # 'zlib' ou 'zlib-dict' (dicionário treinado com `python main.py train-cache-dict`; usa zlib até o primeiro treino)
+CACHE_MAX_ENTRIES = 5000  # Máximo de entradas mantidas em memória (política definida por CACHE_ADMISSION_POLICY)
+CACHE_MAX_BYTES = 20 * 1024 * 1024  # Orçamento de memória das respostas (tamanho comprimido), em bytes
+CACHE_ADMISSION_POLICY = "tinylfu"  # 'lru' ou 'tinylfu' (perguntas únicas não expulsam as frequentes; compare com `python main.py benchmark-admission`)
+CACHE_WINDOW_RATIO = 0.01  # Fração de CACHE_MAX_ENTRIES reservada à janela de admissão do TinyLFU
+CACHE_WRITE_BEHIND = True  # Persiste o cache em lote, fora do caminho das respostas
+CACHE_FLUSH_INTERVAL = 5  # Segundos entre flushes em background
+CACHE_FLUSH_THRESHOLD = 50  # Número de entradas alteradas que antecipa o flush
+CACHE_EXPIRY_INTERVAL = 30  # Segundos entre drenagens do heap de expiração (tarefa assíncrona do bot)
+CACHE_SIMILARITY_CATEGORIES = ["concept", "resource"]  # Categorias em que perguntas quase idênticas reutilizam a resposta em cache
+CACHE_SIMILARITY_THRESHOLD = 0.75  # Similaridade de Jaccard mínima (MinHash, palavras de conteúdo) para um hit por similaridade; ajustada com os pares de paráfrases de tests/test_cache.py
+CACHE_REWARM_LIMIT = 50  # Chaves mais acessadas regeneradas sob a nova versão do template após uma troca de versão
+CACHE_REWARM_INTERVAL = 10  # Segundos entre as regenerações do re-aquecimento (preserva a cota da API)
+
+# Cotas da API do Google AI Studio por modelo (plano gratuito): requisições/minuto, tokens/minuto e requisições/dia.
+# 'burst' (opcional) limita a rajada de requisições; sem ele, até 'rpm' requisições podem sair de uma vez.
+# 'default' vale para modelos não listados.
+API_RATE_LIMITS = {
+    "default": {"rpm": 10, "tpm": 32000, "rpd": 1500},
+    "gemini-pro": {"rpm": 10, "tpm": 32000, "rpd": 1500},
+    "gemini-1.5-flash": {"rpm": 15, "tpm": 1000000, "rpd": 1500},
+}
+API_OUTPUT_TOKENS_ESTIMATE = 500  # Tokens de resposta reservados na cota de TPM antes da chamada (corrigidos pelo consumo real)
+API_PRIORITY_AGING_SECONDS = 60  # Segundos de espera na fila que promovem uma requisição em uma classe de prioridade (evita inanição do background)
+API_BATCHING_ENABLED = False  # Agrupa perguntas simultâneas do mesmo agente em uma única chamada à API (opt-in)
+API_BATCH_WINDOW = 0.5  # Segundos em que um lote aberto aguarda outras perguntas do mesmo agente
+API_BATCH_MAX_SIZE = 4  # Máximo de perguntas por chamada em lote (lotes cheios saem antes do fim da janela)
+API_CIRCUIT_FAILURE_THRESHOLD = 5  # Falhas consecutivas da API que abrem o circuito do modelo (chamadas passam a falhar na hora)
+API_CIRCUIT_RECOVERY_TIMEOUT = 30  # Segundos com o circuito aberto antes de uma chamada de teste (half-open)
+API_RETRY_MAX_BACKOFF = 8  # Limite, em segundos, do backoff com jitter entre tentativas de uma chamada
+API_KEY_COOLDOWN = 60  # Segundos fora do rodízio para uma chave que recebeu 429 (dobra a cada 429 seguido da mesma chave)
+API_KEY_MAX_COOLDOWN = 3600  # Limite, em segundos, do tempo fora do rodízio
+
+# Roteamento em cascata: perguntas simples vão primeiro para um modelo leve (mais rápido, com cota própria em
+# API_RATE_LIMITS) e só sobem para o modelo do agente se a resposta do leve vier vazia ou bloqueada.
+API_CASCADE_ENABLED = True
+API_CASCADE_LIGHT_MODEL = "gemini-1.5-flash"
+API_CASCADE_LIGHT_CATEGORIES = {  # Categorias que podem usar o modelo leve -> confiança mínima do classificador ('code' sempre usa o modelo do agente)
+    "general": 0.0,
+    "resource": 0.2,
+    "concept": 0.5,
+}
+API_CASCADE_LIGHT_MAX_WORDS = 25  # Perguntas mais longas vão direto para o modelo do agente
@@ -6,10 +6,13 @@ import os
 import sys
 from typing import Optional # Importa Optional
 
-from config import LOGGING_CONFIG, DISCORD_BOT_TOKEN, CACHE_FILE
+from config import LOGGING_CONFIG, DISCORD_BOT_TOKEN, CACHE_FILE, CACHE_STORAGE
 from agents.discord_tutor import DiscordAITutorFree
 from utils.free_tier_orchestrator import FreeTierOrchestrator
+from utils.request_scheduler import Priority
 from tools.response_cache import ResponseCache
+from utils.cache_factory import create_response_cache
+from tools.cache_backends import iter_json_cache_file
 
 # Configura o logging usando o dicionário do config.py
 logging.config.dictConfig(LOGGING_CONFIG)
@@ -29,7 +32,8 @@ def get_orchestrator() -> FreeTierOrchestrator:
 def get_cache_manager() -> ResponseCache:
     global _cache_manager
     if _cache_manager is None:
-        _cache_manager = ResponseCache(cache_file=CACHE_FILE)
+        # Mesmos TTLs e políticas do bot (o armazenamento é compartilhado); sem flusher em background nos comandos
+        _cache_manager = create_response_cache(write_behind=False)
     return _cache_manager
 
 async def start_bot():
@@ -57,6 +61,7 @@ async def show_status():
         f"Total de Requisições Processadas: {stats['total_requests_processed']}\n"
         f"Chamadas à API (Gemini): {stats['api_calls_total']}\n"
         f"Hits de Cache Salvos: {stats['cache_hits_total']}\n"
+        f"Chamadas Deduplicadas (perguntas idênticas simultâneas): {stats['deduplicated_calls_total']}\n"
         f"```\n"
         "**Métricas por Agente:**\n"
         "```\n"
@@ -65,6 +70,12 @@ async def show_status():
         status_message += f"- {agent_name}:\n"
         status_message += f"  API Calls: {metrics['api_calls']}\n"
         status_message += f"  Cache Hits: {metrics['cache_hits']}\n"
+        for model_name, model_metrics in metrics['models'].items():
+            status_message += f"  {model_name}: {model_metrics['api_calls']} chamadas, {model_metrics['avg_response_time']:.2f}s em média\n"
+        status_message += f"  Escaladas para o modelo do agente: {metrics['escalations']}\n"
+    status_message += "```\n**Fila da API por Prioridade:**\n```\n"
+    for priority_class, queue in stats['request_queue'].items():
+        status_message += f"- {priority_class}: {queue['queued']} na fila (máx. {queue['max_queued']}), {queue['dispatched']} atendidas, espera média {queue['avg_wait_seconds']}s (máx. {queue['max_wait_seconds']}s)\n"
     status_message += "```"
     
     print(status_message)
@@ -90,7 +101,7 @@ async def test_apis():
     print(f"\nTestando conexão com Google AI Studio (modelo: {orchestrator.default_model_name})...")
     try:
         # Usar um prompt simples e desativar cache para forçar chamada à API
-        response = await orchestrator.generate_response(test_prompt, {"categories": ["general"]}, use_cache=False)
+        response = await orchestrator.generate_response(test_prompt, {"categories": ["general"]}, use_cache=False, priority=Priority.ADMIN)
         if response:
             print("Conexão com Google AI Studio: SUCESSO!")
             print(f"Exemplo de resposta: {response[:100]}...")
@@ -104,7 +115,7 @@ async def test_apis():
     print(f"\nVerificando integridade do cache ({cache_manager.cache_file})...")
     try:
         cache_manager._load_cache() # Tenta recarregar para verificar integridade
-        print(f"Integridade do Cache: OK. Entradas: {len(cache_manager.cache)}")
+        print(f"Integridade do Cache: OK. Entradas: {cache_manager.get_stats()['current_entries']}")
     except Exception as e:
         print(f"Integridade do Cache: FALHA - {e}")
 
@@ -115,12 +126,67 @@ async def clear_cache_cli():
     Limpa o cache de respostas.
     """
     cache_manager = get_cache_manager()
-    initial_entries = len(cache_manager.cache)
-    cache_manager.cache = {} # Limpa o cache em memória
-    cache_manager._save_cache() # Salva o cache vazio no arquivo
+    initial_entries = cache_manager.clear() # Limpa o cache em memória e salva o cache vazio no arquivo
     print(f"Cache limpo. {initial_entries} entradas removidas.")
     logger.info("Comando 'clear-cache' executado.")
 
+async def migrate_cache_cli(source: str = CACHE_FILE):
+    """
+    Migra um response_cache.json para o armazenamento configurado em CACHE_STORAGE.
+    O arquivo é lido entrada por entrada, sem carregar o documento inteiro em memória.
+    """
+    if CACHE_STORAGE == "json":
+        print("O armazenamento configurado já é JSON. Nada a migrar.")
+        return
+    if not os.path.exists(source):
+        print(f"Arquivo de origem não encontrado: {source}")
+        return
+
+    cache_manager = get_cache_manager()
+    print(f"Migrando {source} para o cache '{CACHE_STORAGE}' em {cache_manager.cache_file}...")
+    migrated = cache_manager.import_entries(iter_json_cache_file(source))
+    cache_manager.close()
+    print(f"Migração concluída. {migrated} entradas migradas.")
+    logger.info(f"Comando 'migrate-cache' executado. {migrated} entradas migradas de {source}.")
+
+async def train_cache_dict_cli():
+    """
+    Treina uma nova versão do dicionário de compressão com as respostas do cache.
+    Entradas já gravadas continuam usando o codec/dicionário com que foram comprimidas.
+    """
+    cache_manager = get_cache_manager()
+    version = cache_manager.train_dictionary()
+    cache_manager.close()
+    if version is None:
+        print("Corpus insuficiente para treinar o dicionário. Use o bot por mais tempo e tente novamente.")
+        return
+    print(f"Dicionário de compressão v{version} salvo em {cache_manager._dictionary_path(version)}.")
+    logger.info(f"Comando 'train-cache-dict' executado. Dicionário v{version} criado.")
+
+async def benchmark_codecs_cli():
+    """
+    Compara os codecs de compressão (taxa e latência) sobre as respostas do cache.
+    """
+    from benchmarks.codec_benchmark import main as run_codec_benchmark
+    run_codec_benchmark()
+    logger.info("Comando 'benchmark-codecs' executado.")
+
+async def benchmark_admission_cli(trace: Optional[str] = None):
+    """
+    Compara as políticas de admissão do cache (LRU e TinyLFU) reproduzindo um trace de perguntas.
+    """
+    from benchmarks.admission_benchmark import main as run_admission_benchmark
+    run_admission_benchmark(trace)
+    logger.info("Comando 'benchmark-admission' executado.")
+
+async def benchmark_models_cli():
+    """
+    Mede o custo de criar um GenerativeModel por tentativa em comparação com o registro de modelos por agente.
+    """
+    from benchmarks.model_registry_benchmark import main as run_model_registry_benchmark
+    run_model_registry_benchmark()
+    logger.info("Comando 'benchmark-models' executado.")
+
 async def show_stats():
     """
     Mostra estatísticas de uso detalhadas (API calls, cache hits, etc.).
@@ -134,6 +200,7 @@ async def show_stats():
         f"Total de Requisições Processadas: {stats['total_requests_processed']}\n"
         f"Chamadas à API (Gemini): {stats['api_calls_total']}\n"
         f"Hits de Cache Salvos: {stats['cache_hits_total']}\n"
+        f"Chamadas Deduplicadas (perguntas idênticas simultâneas): {stats['deduplicated_calls_total']}\n"
         f"```\n"
         "**Estatísticas Detalhadas do Cache:**\n"
         f"```\n"
@@ -141,12 +208,16 @@ async def show_stats():
         f"Hits de Cache: {stats['cache_stats']['hits']}\n"
         f"Misses de Cache: {stats['cache_stats']['misses']}\n"
         f"Taxa de Acerto do Cache: {stats['cache_stats']['hit_rate_percent']}%\n"
+        f"Hits Exatos / Similares: {stats['cache_stats']['exact_hits']} / {stats['cache_stats']['similar_hits']}\n"
+        f"Remoções ({stats['cache_stats']['admission']}): {stats['cache_stats']['evictions']} (rejeições na admissão: {stats['cache_stats']['admission_rejections']})\n"
         f"```\n"
         "**Métricas de API por Agente:**\n"
         "```\n"
     )
     for agent_name, metrics in stats['agent_metrics'].items():
-        stats_message += f"- {agent_name}: API Calls: {metrics['api_calls']}, Cache Hits: {metrics['cache_hits']}\n"
+        stats_message += f"- {agent_name}: API Calls: {metrics['api_calls']}, Cache Hits: {metrics['cache_hits']}, Escaladas: {metrics['escalations']}\n"
+        for model_name, model_metrics in metrics['models'].items():
+            stats_message += f"  {model_name}: {model_metrics['api_calls']} chamadas, {model_metrics['avg_response_time']:.2f}s em média\n"
     stats_message += "```"
 
     print(stats_message)
@@ -172,6 +243,28 @@ def main():
     clear_cache_parser = subparsers.add_parser("clear-cache", help="Limpa o cache de respostas do bot.")
     clear_cache_parser.set_defaults(func=clear_cache_cli)
 
+    # Comando 'migrate-cache'
+    migrate_cache_parser = subparsers.add_parser("migrate-cache", help="Migra um response_cache.json para o armazenamento configurado.")
+    migrate_cache_parser.add_argument("--source", default=CACHE_FILE, help="Arquivo JSON de origem (padrão: %(default)s).")
+    migrate_cache_parser.set_defaults(func=migrate_cache_cli)
+
+    # Comando 'train-cache-dict'
+    train_dict_parser = subparsers.add_parser("train-cache-dict", help="Treina o dicionário de compressão do cache com as respostas armazenadas.")
+    train_dict_parser.set_defaults(func=train_cache_dict_cli)
+
+    # Comando 'benchmark-codecs'
+    benchmark_codecs_parser = subparsers.add_parser("benchmark-codecs", help="Compara taxa de compressão e latência dos codecs do cache.")
+    benchmark_codecs_parser.set_defaults(func=benchmark_codecs_cli)
+
+    # Comando 'benchmark-admission'
+    benchmark_admission_parser = subparsers.add_parser("benchmark-admission", help="Compara a taxa de acerto das políticas LRU e TinyLFU do cache.")
+    benchmark_admission_parser.add_argument("--trace", default=None, help="Arquivo com uma pergunta por linha ou o log do bot (padrão: trace sintético).")
+    benchmark_admission_parser.set_defaults(func=benchmark_admission_cli)
+
+    # Comando 'benchmark-models'
+    benchmark_models_parser = subparsers.add_parser("benchmark-models", help="Compara criar um GenerativeModel por tentativa com o registro de modelos por agente.")
+    benchmark_models_parser.set_defaults(func=benchmark_models_cli)
+
     # Comando 'stats'
     stats_parser = subparsers.add_parser("stats", help="Mostra estatísticas de uso detalhadas (API calls, cache hits, etc.).")
     stats_parser.set_defaults(func=show_stats)
@@ -181,7 +274,8 @@ def main():
     if hasattr(args, 'func'):
         # Executa a função assíncrona no loop de eventos
         try:
-            asyncio.run(args.func())
+            func_kwargs = {key: value for key, value in vars(args).items() if key not in ("command", "func")}
+            asyncio.run(args.func(**func_kwargs))
         except Exception as e:
             logger.critical(f"Erro ao executar comando CLI: {e}")
             print(f"ERRO: {e}")
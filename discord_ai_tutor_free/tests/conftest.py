@@ -27,6 +27,18 @@ def mock_google_api_key():
     with patch('config.GOOGLE_API_KEY', 'TEST_API_KEY'):
         yield
 
+# Redireciona os arquivos do cache (config.CACHE_DIR) para um diretório temporário, para que os
+# testes nunca leiam ou gravem o response_cache.db real do pacote
+@pytest.fixture(autouse=True)
+def isolated_cache_paths(tmp_path):
+    cache_paths = {
+        "json": str(tmp_path / "response_cache.json"),
+        "log": str(tmp_path / "response_cache.aof"),
+        "sqlite": str(tmp_path / "response_cache.db")
+    }
+    with patch.dict('config.CACHE_PATHS', cache_paths):
+        yield cache_paths
+
 # Mock para o cliente Discord
 @pytest.fixture
 def mock_discord_client():
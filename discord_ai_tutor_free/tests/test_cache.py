@@ -2,8 +2,13 @@ import pytest
 import os
 import json
 import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 import logging # Adicionado para o teste de erro de JSON
-from tools.response_cache import ResponseCache
+from tools.response_cache import ResponseCache, ZlibCodec, ZlibDictCodec, train_zlib_dictionary
+from tools.frequency_sketch import FrequencySketch
 
 @pytest.fixture
 def temp_cache_file(tmp_path):
@@ -12,8 +17,8 @@ def temp_cache_file(tmp_path):
     yield str(file)
     if os.path.exists(str(file)):
         os.remove(str(file))
-    if os.path.exists(str(file) + ".bak"):
-        os.remove(str(file) + ".bak")
+    if os.path.exists(str(file) + ".lock"):
+        os.remove(str(file) + ".lock")
 
 @pytest.fixture
 def cache_manager(temp_cache_file):
@@ -107,26 +112,61 @@ def test_cache_compression(cache_manager):
     
     cache_manager.cache_response(long_question, long_response)
     
-    # Verifica se a resposta foi marcada como comprimida e armazenada como hex
+    # Verifica se a resposta foi marcada como comprimida e armazenada no arquivo de blobs
     normalized_q = cache_manager._normalize_question(long_question)
     q_hash = cache_manager._generate_hash(normalized_q)
     entry = cache_manager.cache[q_hash]
     assert entry['compressed'] is True
-    assert isinstance(entry['response'], str) # Deve ser uma string hex
+    assert 'response' not in entry # Os bytes comprimidos ficam no arquivo de blobs
+    assert len(entry['blob']) == 3 # [offset, tamanho, crc32]
     
     retrieved_response = cache_manager.get_cached_response(long_question)
     assert retrieved_response == long_response
     assert cache_manager.hits == 1
 
 def test_cache_backup(temp_cache_file):
-    """Testa se um arquivo .bak é criado."""
+    """Testa se a escrita é atômica: sem cópia .bak e sem arquivo temporário deixado para trás."""
     cache_manager = ResponseCache(cache_file=temp_cache_file)
     question = "Backup test"
     response = "Backup response"
     cache_manager.cache_response(question, response)
-    
+    cache_manager.cache_response("Segunda pergunta", "Segunda resposta")
+
     assert os.path.exists(temp_cache_file)
-    assert os.path.exists(temp_cache_file + ".bak")
+    assert not os.path.exists(temp_cache_file + ".bak")
+    assert not os.path.exists(temp_cache_file + ".tmp")
+    with open(temp_cache_file, 'r', encoding='utf-8') as f:
+        assert len(json.load(f)) == 2
+
+def test_cache_json_crash_during_write_keeps_file(temp_cache_file):
+    """Testa se uma falha no meio da escrita preserva o arquivo anterior intacto."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file)
+    cache_manager.cache_response("Q1", "R1")
+
+    with patch('tools.cache_backends.json.dump', side_effect=OSError("disco cheio")):
+        with pytest.raises(OSError):
+            cache_manager.backend.write_batch([("chave", {"response": "R2", "timestamp": time.time()})])
+    with open(temp_cache_file, 'r', encoding='utf-8') as f:
+        assert len(json.load(f)) == 1
+    assert ResponseCache(cache_file=temp_cache_file).get_cached_response("Q1") == "R1"
+
+def test_cache_json_concurrent_writers_do_not_clobber(temp_cache_file):
+    """Testa se dois processos gravando o mesmo JSON preservam as alterações um do outro."""
+    bot = ResponseCache(cache_file=temp_cache_file)
+    cli = ResponseCache(cache_file=temp_cache_file)
+    bot.cache_response("Pergunta do bot", "Resposta do bot")
+    cli.cache_response("Pergunta da CLI", "Resposta da CLI")
+    bot.cache_response("Outra pergunta do bot", "Outra resposta")
+
+    reopened = ResponseCache(cache_file=temp_cache_file)
+    assert reopened.get_cached_response("Pergunta do bot") == "Resposta do bot"
+    assert reopened.get_cached_response("Pergunta da CLI") == "Resposta da CLI"
+    assert reopened.get_cached_response("Outra pergunta do bot") == "Outra resposta"
+
+    cli.clear() # Ex: `python main.py clear-cache` enquanto o bot está no ar
+    bot.cache_response("Pergunta nova", "Resposta nova")
+    with open(temp_cache_file, 'r', encoding='utf-8') as f:
+        assert len(json.load(f)) == 1
 
 def test_cache_json_decode_error(temp_cache_file, caplog):
     """Testa o tratamento de erro de JSON malformado."""
@@ -154,3 +194,863 @@ def test_cache_stats_reset(cache_manager):
     assert stats_after_reset['hits'] == 0
     assert stats_after_reset['misses'] == 0
     assert stats_after_reset['total_requests'] == 0
+
+def test_cache_write_behind_defers_persistence(temp_cache_file):
+    """Testa se o modo write-behind acumula mutações até o flush."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, write_behind=True, flush_interval=60, flush_threshold=100)
+    cache_manager.cache_response("Pergunta adiada", "Resposta adiada")
+
+    assert not os.path.exists(temp_cache_file) # Nada foi escrito ainda
+    assert cache_manager.get_stats()['pending_writes'] == 1
+
+    cache_manager.flush()
+    with open(temp_cache_file, 'r', encoding='utf-8') as f:
+        assert len(json.load(f)) == 1
+    stats = cache_manager.get_stats()
+    assert stats['pending_writes'] == 0
+    assert stats['flush_count'] == 1
+    cache_manager.close()
+
+def test_cache_write_behind_flush_threshold(temp_cache_file):
+    """Testa se atingir o limite de chaves sujas dispara o flush em background."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, write_behind=True, flush_interval=60, flush_threshold=3)
+    for i in range(3):
+        cache_manager.cache_response(f"Pergunta {i}", f"Resposta {i}")
+
+    deadline = time.time() + 2
+    while cache_manager.get_stats()['flush_count'] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert cache_manager.get_stats()['flush_count'] >= 1
+    assert cache_manager.get_stats()['pending_writes'] == 0
+    cache_manager.close()
+
+def test_cache_write_behind_close_flushes(temp_cache_file):
+    """Testa se o encerramento persiste as escritas pendentes."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, write_behind=True, flush_interval=60)
+    cache_manager.cache_response("Pergunta no shutdown", "Resposta no shutdown")
+    cache_manager.close()
+
+    reloaded = ResponseCache(cache_file=temp_cache_file)
+    assert reloaded.get_cached_response("Pergunta no shutdown") == "Resposta no shutdown"
+
+@pytest.fixture
+def temp_log_file(tmp_path):
+    """Fixture para um arquivo de log append-only temporário."""
+    return str(tmp_path / "test_cache.aof")
+
+def test_cache_log_persistence(temp_log_file):
+    """Testa se o log append-only é reproduzido após reinicialização."""
+    cache_manager1 = ResponseCache(cache_file=temp_log_file, ttl_hours=1, storage="log")
+    cache_manager1.cache_response("Pergunta no log", "Resposta no log")
+    cache_manager1.cache_response("Outra pergunta", "Outra resposta")
+    cache_manager1.close()
+
+    cache_manager2 = ResponseCache(cache_file=temp_log_file, ttl_hours=1, storage="log")
+    assert len(cache_manager2.cache) == 2
+    assert cache_manager2.get_cached_response("Pergunta no log") == "Resposta no log"
+    cache_manager2.close()
+
+def test_cache_log_appends_only_changed_entries(temp_log_file):
+    """Testa se cada escrita anexa um único registro em vez de reescrever o arquivo."""
+    cache_manager = ResponseCache(cache_file=temp_log_file, ttl_hours=1, storage="log")
+    cache_manager.cache_response("Q1", "R1" * 100)
+    size_after_first = os.path.getsize(temp_log_file)
+    cache_manager.cache_response("Q2", "R2")
+    size_after_second = os.path.getsize(temp_log_file)
+
+    assert size_after_second - size_after_first < size_after_first # Só o novo registro foi escrito
+    assert cache_manager.get_stats()['log_records'] == 2
+    cache_manager.close()
+
+def test_cache_log_compaction(temp_log_file):
+    """Testa se a compactação remove registros mortos e preserva as entradas vivas."""
+    from tools.cache_log import CacheLog
+    log = CacheLog(temp_log_file, compaction_ratio=0.5, min_compaction_records=1000)
+    for i in range(10):
+        log.append_set("chave", {"response": f"versao {i}", "timestamp": time.time(), "compressed": False})
+    log.append_set("outra", {"response": "viva", "timestamp": time.time(), "compressed": False})
+    log.append_delete("outra")
+    assert log.dead_ratio > 0.5
+
+    size_before = os.path.getsize(temp_log_file)
+    log.compact()
+    assert os.path.getsize(temp_log_file) < size_before
+    assert log.total_records == 1
+    assert log.read("chave")["response"] == "versao 9"
+    assert log.read("outra") is None
+    log.close()
+
+def test_cache_log_truncates_torn_tail(temp_log_file):
+    """Testa se um registro incompleto no final do log é descartado na inicialização."""
+    cache_manager = ResponseCache(cache_file=temp_log_file, ttl_hours=1, storage="log")
+    cache_manager.cache_response("Pergunta íntegra", "Resposta íntegra")
+    cache_manager.close()
+    with open(temp_log_file, 'ab') as f:
+        f.write(b'\x01\x00\x05') # Simula um crash no meio de uma escrita
+
+    reloaded = ResponseCache(cache_file=temp_log_file, ttl_hours=1, storage="log")
+    assert reloaded.get_cached_response("Pergunta íntegra") == "Resposta íntegra"
+    reloaded.cache_response("Nova pergunta", "Nova resposta")
+    reloaded.close()
+
+    again = ResponseCache(cache_file=temp_log_file, ttl_hours=1, storage="log")
+    assert len(again.cache) == 2
+    again.close()
+
+@pytest.fixture
+def temp_db_file(tmp_path):
+    """Fixture para um banco SQLite temporário."""
+    return str(tmp_path / "test_cache.db")
+
+def test_cache_sqlite_lookup_without_preload(temp_db_file):
+    """Testa se o backend SQLite é consultado sob demanda após reinicialização."""
+    cache_manager1 = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    cache_manager1.cache_response("Pergunta SQLite", "Resposta SQLite")
+    cache_manager1.close()
+
+    cache_manager2 = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    assert cache_manager2.cache == {} # Nada é carregado na inicialização
+    assert cache_manager2.get_stats()['current_entries'] == 1
+    assert cache_manager2.get_cached_response("Pergunta SQLite") == "Resposta SQLite"
+    cache_manager2.close()
+
+def test_cache_sqlite_cleanup_expired(temp_db_file):
+    """Testa a remoção por faixa de timestamp no backend SQLite."""
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=0.0001, storage="sqlite", write_behind=True, flush_interval=60)
+    cache_manager.cache_response("Q1", "R1")
+    cache_manager.cache_response("Q2", "R2")
+    time.sleep(0.5) # Espera expirar
+
+    cache_manager.cleanup_expired()
+    assert cache_manager.get_stats()['current_entries'] == 0
+    assert cache_manager.cache == {}
+    cache_manager.close()
+
+def test_cache_sqlite_write_does_not_hold_lock_while_flushing(temp_db_file):
+    """Testa se a gravação com flush síncrono não segura self._lock enquanto espera o _flush_lock (deadlock com flush())."""
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", write_behind=False, compression_threshold=10)
+    writer = threading.Thread(target=cache_manager.cache_response, args=("Pergunta", "Resposta longa. " * 5), daemon=True)
+    with cache_manager._flush_lock: # Como um flush() em andamento em outra thread
+        writer.start()
+        time.sleep(0.2) # A gravação chega ao flush síncrono e espera o _flush_lock
+        acquired = cache_manager._lock.acquire(timeout=2) # O flush() em andamento precisa de self._lock
+        if acquired:
+            cache_manager._lock.release()
+    writer.join(timeout=5)
+    assert acquired
+    assert cache_manager.backend.count() == 1
+    cache_manager.close()
+
+def test_cache_migrate_json_to_sqlite(temp_cache_file, temp_db_file):
+    """Testa a migração em streaming de um response_cache.json para o SQLite."""
+    from tools.cache_backends import iter_json_cache_file
+    json_cache = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    for i in range(20):
+        json_cache.cache_response(f"Pergunta {i}", f"Resposta {i} " * 50)
+
+    entries = list(iter_json_cache_file(temp_cache_file, chunk_size=64)) # Blocos pequenos forçam leituras parciais
+    assert len(entries) == 20
+
+    sqlite_cache = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    assert sqlite_cache.import_entries(iter_json_cache_file(temp_cache_file)) == 20
+    assert sqlite_cache.get_cached_response("Pergunta 7") == "Resposta 7 " * 50
+    sqlite_cache.close()
+
+def test_cache_lru_max_entries(temp_cache_file):
+    """Testa se o limite de entradas remove a entrada menos recentemente usada."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, max_entries=2)
+    cache_manager.cache_response("Q1", "R1")
+    cache_manager.cache_response("Q2", "R2")
+    assert cache_manager.get_cached_response("Q1") == "R1" # Q1 passa a ser a mais recente
+    cache_manager.cache_response("Q3", "R3")
+
+    assert len(cache_manager.cache) == 2
+    assert cache_manager.get_cached_response("Q2") is None
+    assert cache_manager.get_cached_response("Q1") == "R1"
+    assert cache_manager.get_stats()['evictions'] == 1
+
+    # A remoção é persistida para backends pré-carregados
+    reloaded = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    assert reloaded.get_cached_response("Q2") is None
+
+def test_cache_lru_max_bytes_uses_compressed_size(temp_cache_file):
+    """Testa se o orçamento de bytes considera o tamanho comprimido das respostas."""
+    long_response = "Resposta longa e repetitiva para compressão. " * 200
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, max_bytes=1000)
+    cache_manager.cache_response("Longa 1", long_response)
+    cache_manager.cache_response("Longa 2", long_response)
+
+    compressed_size = len(cache_manager._compress_response(long_response))
+    assert 2 * compressed_size < 1000 < len(long_response)
+    assert cache_manager.get_stats()['current_bytes'] == 2 * compressed_size
+    assert cache_manager.get_stats()['evictions'] == 0
+
+    cache_manager.cache_response("Curta", "x" * 1000) # Abaixo do limiar de compressão: excede o orçamento
+    assert cache_manager.get_stats()['current_bytes'] <= 1000
+    assert cache_manager.get_stats()['evictions'] >= 1
+
+def test_cache_lru_sqlite_keeps_evicted_entries_on_disk(temp_db_file):
+    """Testa se, com backend sob demanda, a evicção só libera a memória."""
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", max_entries=1)
+    cache_manager.cache_response("Q1", "R1")
+    cache_manager.cache_response("Q2", "R2")
+    assert len(cache_manager.cache) == 1
+    assert cache_manager.get_cached_response("Q1") == "R1" # Relido do SQLite
+    cache_manager.close()
+
+def test_cache_similar_hit_for_enabled_category(temp_cache_file):
+    """Testa se uma pergunta quase idêntica reutiliza a resposta em uma categoria habilitada."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, similarity_categories=["concept"])
+    cache_manager.cache_response("O que é aprendizado de máquina?", "Resposta sobre ML", category="concept")
+
+    assert cache_manager.get_cached_response("O que é o aprendizado de máquina?", category="concept") == "Resposta sobre ML"
+    assert cache_manager.get_cached_response("O que é aprendizado de máquina?", category="concept") == "Resposta sobre ML"
+
+    stats = cache_manager.get_stats()
+    assert stats['similar_hits'] == 1
+    assert stats['exact_hits'] == 1
+    assert stats['hits'] == 2
+
+def test_cache_similarity_respects_category_opt_in(temp_cache_file):
+    """Testa se categorias não habilitadas (ex: código) continuam exigindo a pergunta exata."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, similarity_categories=["concept"])
+    cache_manager.cache_response("Como faço um loop for em Python?", "for i in range(10): ...", category="code")
+
+    assert cache_manager.get_cached_response("Como faço um loop for em Python 3?", category="code") is None
+    assert cache_manager.get_stats()['similar_hits'] == 0
+
+def test_cache_similarity_threshold(temp_cache_file):
+    """Testa se perguntas diferentes demais não geram hit por similaridade."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, similarity_categories=["concept"], similarity_threshold=0.9)
+    cache_manager.cache_response("O que é aprendizado de máquina?", "Resposta sobre ML", category="concept")
+
+    assert cache_manager.get_cached_response("O que é uma rede neural convolucional?", category="concept") is None
+    assert cache_manager.get_stats()['misses'] == 1
+
+# Pares rotulados usados para ajustar CACHE_SIMILARITY_THRESHOLD: paráfrases da mesma pergunta de iniciante
+# devem gerar hit; perguntas parecidas sobre outro assunto, não
+PARAPHRASE_PAIRS = [
+    ("O que é deep learning?", "me explica deep learning"),
+    ("o que é deep learning?", "o que é deep learning ?? por favor"),
+    ("O que é machine learning?", "o que seria machine learning"),
+    ("O que é aprendizado de máquina?", "O que é o aprendizado de maquina?"),
+    ("O que é overfitting?", "explique overfitting"),
+    ("Como funciona uma rede neural?", "me explica como funciona uma rede neural"),
+    ("O que é uma rede neural?", "o que significa rede neural"),
+    ("What is deep learning?", "explain deep learning"),
+    ("Qual a diferença entre IA e machine learning?", "diferença entre IA e machine learning"),
+    ("O que são transformers?", "me fala sobre transformers"),
+    ("Pode me explicar o que é regressão linear?", "o que é regressão linear"),
+]
+DISTINCT_PAIRS = [
+    ("O que é deep learning?", "O que é machine learning?"),
+    ("O que é overfitting?", "O que é underfitting?"),
+    ("Como funciona uma rede neural?", "Como treinar uma rede neural?"),
+    ("O que é regressão linear?", "O que é regressão logística?"),
+    ("What is deep learning?", "What is reinforcement learning?"),
+    ("O que é Python?", "O que é PyTorch?"),
+    ("Quais livros sobre deep learning?", "Quais cursos sobre deep learning?"),
+    ("O que é aprendizado supervisionado?", "O que é aprendizado não supervisionado?"),
+    ("Diferença entre IA e machine learning", "Diferença entre machine learning e deep learning"),
+]
+
+@pytest.mark.parametrize("cached, asked, expected_hit",
+                         [(a, b, True) for a, b in PARAPHRASE_PAIRS] + [(a, b, False) for a, b in DISTINCT_PAIRS])
+def test_cache_similarity_paraphrase_pairs(temp_cache_file, cached, asked, expected_hit):
+    """Testa o limiar configurado contra pares rotulados: paráfrases geram hit, perguntas distintas não."""
+    from config import CACHE_SIMILARITY_THRESHOLD
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, similarity_categories=["concept"],
+                                  similarity_threshold=CACHE_SIMILARITY_THRESHOLD)
+    cache_manager.cache_response(cached, "Resposta em cache", category="concept")
+    response = cache_manager.get_cached_response(asked, category="concept")
+    assert (response == "Resposta em cache") is expected_hit
+    assert cache_manager.get_stats()['similar_hits'] == (1 if expected_hit and cache_manager.key_for(cached) != cache_manager.key_for(asked) else 0)
+
+def test_cache_normalization_folds_accents(cache_manager):
+    """Testa se os acentos são removidos sem apagar as letras ("é" vira "e", não some)."""
+    assert cache_manager._normalize_question("O que é Regressão?  ") == "o que e regressao"
+    assert cache_manager.key_for("o que é deep learning?") == cache_manager.key_for("O QUE E DEEP LEARNING")
+    assert cache_manager.key_for("o que é deep learning?") != cache_manager.key_for("o que deep learning")
+
+def test_cache_similarity_index_rebuilt_from_sqlite(temp_db_file):
+    """Testa se o índice de similaridade é reconstruído a partir do backend sob demanda."""
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", similarity_categories=["concept"])
+    cache_manager.cache_response("O que é aprendizado de máquina?", "Resposta sobre ML", category="concept")
+    cache_manager.close()
+
+    reopened = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", similarity_categories=["concept"])
+    assert reopened.get_stats()['similarity_index_size'] == 1
+    assert reopened.get_cached_response("O que é o aprendizado de máquina?", category="concept") == "Resposta sobre ML"
+    reopened.close()
+
+def test_cache_expire_due_only_touches_expiring_entries(temp_cache_file):
+    """Testa se a drenagem do heap remove apenas as entradas vencidas, em uma única persistência."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    cache_manager.cache_response("Q1", "R1")
+    cache_manager.cache_response("Q2", "R2")
+    cache_manager.cache[cache_manager._generate_hash("q1")]['timestamp'] -= 7200 # Força a expiração de Q1
+    cache_manager._rebuild_expiry_heap()
+
+    with patch.object(cache_manager.backend, 'write_batch', wraps=cache_manager.backend.write_batch) as write_batch:
+        assert cache_manager.expire_due() == 1
+    write_batch.assert_called_once()
+    assert cache_manager.get_cached_response("Q2") == "R2"
+    assert cache_manager.get_stats()['expired_entries'] == 1
+
+def test_cache_lazy_expiry_does_not_persist(temp_cache_file):
+    """Testa se encontrar uma entrada expirada no get não dispara uma reescrita do cache."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=0.0001)
+    cache_manager.cache_response("Q1", "R1")
+    time.sleep(0.5) # Espera expirar
+
+    with patch.object(cache_manager.backend, 'write_batch') as write_batch:
+        assert cache_manager.get_cached_response("Q1") is None
+    write_batch.assert_not_called()
+    assert cache_manager.expire_due() == 1
+    assert len(cache_manager.cache) == 0
+
+def test_cache_rewritten_entry_not_expired_by_stale_heap_item(temp_cache_file):
+    """Testa se regravar uma entrada invalida o item antigo do heap de expiração."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    cache_manager.cache_response("Q1", "R1")
+    first_expiry = cache_manager._expiry_heap[0][0]
+    time.sleep(0.01)
+    cache_manager.cache_response("Q1", "R1 atualizada")
+
+    assert cache_manager.expire_due(now=first_expiry) == 0
+    assert cache_manager.get_cached_response("Q1") == "R1 atualizada"
+
+@pytest.mark.asyncio
+async def test_cache_expiry_loop(temp_cache_file):
+    """Testa se a tarefa assíncrona periódica drena as entradas expiradas."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=0.00001) # ~36ms
+    cache_manager.cache_response("Q1", "R1")
+    task = asyncio.create_task(cache_manager.run_expiry_loop(interval=0.05))
+    await asyncio.sleep(0.2)
+    task.cancel()
+    assert len(cache_manager.cache) == 0
+    assert cache_manager.get_stats()['expired_entries'] == 1
+
+def test_cache_blob_store_persistence(temp_db_file):
+    """Testa se respostas comprimidas são relidas do arquivo de blobs após reabrir o cache."""
+    long_response = "Resposta longa armazenada como blob binário. " * 100
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    cache_manager.cache_response("Pergunta longa", long_response)
+    cache_manager.close()
+
+    assert os.path.getsize(temp_db_file + ".blobs") < len(long_response)
+    reopened = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    assert reopened.get_cached_response("Pergunta longa") == long_response
+    reopened.close()
+
+def test_cache_blob_legacy_hex_entries(temp_cache_file, temp_db_file):
+    """Testa se entradas antigas (hex no JSON) continuam legíveis e são convertidas na migração."""
+    long_response = "Resposta antiga comprimida em hex. " * 100
+    legacy = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    key = legacy._generate_hash(legacy._normalize_question("Pergunta antiga"))
+    entry = {'response': legacy._compress_response(long_response).hex(), 'timestamp': time.time(), 'compressed': True}
+    assert legacy._decode_entry(entry) == long_response
+
+    sqlite_cache = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    sqlite_cache.import_entries([(key, entry)])
+    assert 'blob' in sqlite_cache.backend.get(key)
+    assert sqlite_cache.get_cached_response("Pergunta antiga") == long_response
+    sqlite_cache.close()
+
+def test_cache_blob_compaction(temp_cache_file):
+    """Testa se a compactação descarta blobs mortos e preserva as respostas vivas."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    cache_manager.blob_store.min_compaction_bytes = 0
+    responses = {f"Pergunta {i}": f"Resposta {i} " * 300 for i in range(4)}
+    for question, response in responses.items():
+        cache_manager.cache_response(question, response)
+    cache_manager._delete_entries(*[cache_manager._generate_hash(f"pergunta {i}") for i in range(3)])
+    size_before = cache_manager.blob_store.size
+    assert cache_manager.blob_store.needs_compaction()
+
+    cache_manager.maybe_compact_blobs()
+    assert cache_manager.blob_store.size < size_before
+    assert cache_manager.get_stats()['blob_compactions'] == 1
+    assert cache_manager.get_cached_response("Pergunta 3") == responses["Pergunta 3"]
+
+    reloaded = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    assert reloaded.get_cached_response("Pergunta 3") == responses["Pergunta 3"]
+
+def test_shared_blob_compaction_waits_for_pending_blobs(temp_db_file):
+    """Testa se a compactação é adiada enquanto outro processo tem blobs fora do índice SQLite."""
+    compactor = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0)
+    writer = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0,
+                           write_behind=True, flush_interval=3600)
+    compactor.blob_store.min_compaction_bytes = 0
+    compactor.cache_response("Pergunta morta", "Resposta morta. " * 300)
+    compactor._delete_entries(compactor._generate_hash("pergunta morta"))
+    pending = "Resposta ainda não persistida. " * 300
+    writer.cache_response("Pergunta pendente", pending)
+
+    compactor.compact_blobs()
+    assert compactor.blob_store.skipped_compactions == 1
+    assert compactor.get_stats()['blob_compactions'] == 0
+
+    writer.flush()
+    size_before = os.path.getsize(temp_db_file + ".blobs")
+    compactor.compact_blobs()
+    assert compactor.get_stats()['blob_compactions'] == 1
+    assert os.path.getsize(temp_db_file + ".blobs") < size_before
+    assert compactor.get_cached_response("Pergunta pendente") == pending
+    writer.cache.clear()
+    assert writer.get_cached_response("Pergunta pendente") == pending
+    writer.close()
+    compactor.close()
+
+def test_cache_blob_corruption_is_a_miss(temp_cache_file):
+    """Testa se um blob corrompido é tratado como miss, sem exceção."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    cache_manager.cache_response("Pergunta longa", "Resposta longa. " * 200)
+    cache_manager.blob_store.truncate()
+
+    assert cache_manager.get_cached_response("Pergunta longa") is None
+    assert cache_manager.misses == 1
+
+@pytest.mark.asyncio
+async def test_cache_async_api_roundtrip(temp_db_file):
+    """Testa aget/aset sobre o backend SQLite."""
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    assert await cache_manager.aget("Pergunta assíncrona") is None
+    await cache_manager.aset("Pergunta assíncrona", "Resposta assíncrona", category="concept")
+    assert await cache_manager.aget("Pergunta assíncrona") == "Resposta assíncrona"
+    assert cache_manager.get_stats()['hits'] == 1
+    cache_manager.close()
+
+@pytest.mark.asyncio
+async def test_cache_async_io_runs_off_event_loop(temp_cache_file):
+    """Testa se a persistência disparada por aset roda no executor de I/O, não na thread do loop."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    threads = []
+    original_write_batch = cache_manager.backend.write_batch
+
+    def recording_write_batch(records):
+        threads.append(threading.current_thread().name)
+        original_write_batch(records)
+
+    cache_manager.backend.write_batch = recording_write_batch
+    await asyncio.gather(*(cache_manager.aset(f"Q{i}", f"R{i}") for i in range(5)))
+
+    assert len(threads) == 5
+    assert all(name.startswith("response-cache-io") for name in threads)
+    assert all(cache_manager.get_cached_response(f"Q{i}") == f"R{i}" for i in range(5))
+    cache_manager.close()
+
+@pytest.mark.asyncio
+async def test_cache_aclose_runs_off_event_loop(temp_cache_file):
+    """Testa se aclose faz o flush final fora da thread do loop, persistindo as escritas pendentes."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, write_behind=True, flush_interval=3600)
+    threads = []
+    original_write_batch = cache_manager.backend.write_batch
+
+    def recording_write_batch(records):
+        threads.append(threading.current_thread())
+        original_write_batch(records)
+
+    cache_manager.backend.write_batch = recording_write_batch
+    await cache_manager.aset("Pergunta pendente", "Resposta pendente")
+    await cache_manager.aclose()
+
+    assert threads and threading.main_thread() not in threads
+    assert ResponseCache(cache_file=temp_cache_file, ttl_hours=1).get_cached_response("Pergunta pendente") == "Resposta pendente"
+
+def test_cache_counters_from_concurrent_workers(temp_cache_file):
+    """Testa se os contadores de hit/miss não perdem incrementos com vários workers lendo ao mesmo tempo."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1)
+    cache_manager.cache_response("Pergunta", "Resposta")
+    questions = ["Pergunta", "Outra pergunta"] * 500
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(cache_manager.get_cached_response, questions))
+
+    stats = cache_manager.get_stats()
+    assert (stats['hits'], stats['misses']) == (500, 500)
+
+def test_cache_stale_within_grace(temp_cache_file):
+    """Testa se uma entrada além do TTL, dentro da janela de tolerância, é servida como obsoleta."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, stale_grace_hours=1)
+    cache_manager.cache_response("Q1", "R1")
+    cache_manager.cache[cache_manager._generate_hash("q1")]['timestamp'] -= 3600 + 60 # 1 minuto além do TTL
+
+    result = cache_manager.lookup("Q1")
+    assert result.response == "R1"
+    assert result.stale is True
+    assert cache_manager.expire_due() == 0 # Ainda dentro da janela: não é removida
+
+    cache_manager.cache_response("Q1", "R1 nova", refresh=True)
+    assert cache_manager.lookup("Q1") == ("R1 nova", False, False)
+    stats = cache_manager.get_stats()
+    assert (stats['fresh_hits'], stats['stale_hits'], stats['refreshes']) == (1, 1, 1)
+
+def test_cache_stale_past_grace_is_miss(temp_cache_file):
+    """Testa se uma entrada além do TTL e da janela de tolerância é um miss e é removida."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, stale_grace_hours=1)
+    cache_manager.cache_response("Q1", "R1")
+    cache_manager.cache[cache_manager._generate_hash("q1")]['timestamp'] -= 2 * 3600 + 60
+    cache_manager._rebuild_expiry_heap()
+
+    assert cache_manager.lookup("Q1") is None
+    assert cache_manager.expire_due() == 1
+
+def test_cache_policy_ttl_per_category(temp_cache_file):
+    """Testa se cada categoria expira de acordo com o TTL da sua política."""
+    policies = {"resource": {"ttl": 7 * 24 * 3600}, "general": {"ttl": 60}}
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, policies=policies)
+    cache_manager.cache_response("Recomende um livro", "Livro X", category="resource")
+    cache_manager.cache_response("Olá", "Oi!", category="general")
+    for key in list(cache_manager.cache):
+        cache_manager.cache[key]['timestamp'] -= 3600 # Uma hora atrás
+    cache_manager._rebuild_expiry_heap()
+
+    assert cache_manager.get_cached_response("Recomende um livro", category="resource") == "Livro X"
+    assert cache_manager.get_cached_response("Olá", category="general") is None
+    assert cache_manager.expire_due() == 1
+
+def test_cache_policy_not_cacheable(temp_cache_file):
+    """Testa se categorias marcadas como não cacheáveis não são armazenadas nem contadas como miss."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, policies={"general": {"cacheable": False}})
+    cache_manager.cache_response("Olá", "Oi!", category="general")
+
+    assert len(cache_manager.cache) == 0
+    assert cache_manager.get_cached_response("Olá", category="general") is None
+    stats = cache_manager.get_stats()
+    assert stats['misses'] == 0
+    assert stats['uncacheable_skips'] == 1
+
+def test_cache_policy_compression_threshold(temp_cache_file):
+    """Testa se o limiar de compressão da categoria é aplicado."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, policies={"code": {"compression_threshold": 100}})
+    response = "print('olá mundo')\n" * 10 # ~200 bytes: abaixo do limiar global, acima do da categoria
+    cache_manager.cache_response("Código", response, category="code")
+    cache_manager.cache_response("Conceito", response, category="concept")
+
+    assert cache_manager.cache[cache_manager._generate_hash("codigo")]['compressed'] is True
+    assert cache_manager.cache[cache_manager._generate_hash("conceito")]['compressed'] is False
+    assert cache_manager.get_cached_response("Código", category="code") == response
+
+def test_cache_policy_sqlite_expires_short_ttl_keys(temp_db_file):
+    """Testa se, no SQLite, entradas de TTL curto saem mesmo fora da faixa do maior TTL."""
+    policies = {"resource": {"ttl": 7 * 24 * 3600}, "general": {"ttl": 60}}
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", policies=policies)
+    cache_manager.cache_response("Olá", "Oi!", category="general")
+    assert cache_manager.expire_due(now=time.time() + 120) == 1
+    assert cache_manager.backend.count() == 0
+    cache_manager.close()
+
+def test_cache_sqlite_range_delete_removes_short_ttl_after_restart(temp_db_file):
+    """Testa se a remoção por faixa alcança entradas de TTL curto que não estão no heap desta instância."""
+    policies = {"resource": {"ttl": 14 * 24 * 3600}, "general": {"ttl": 3600}}
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", policies=policies, stale_grace_hours=0.5)
+    cache_manager.cache_response("Olá", "Oi!", category="general")
+    cache_manager.cache_response("Links de PyTorch", "pytorch.org", category="resource")
+    cache_manager.close()
+
+    restarted = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", policies=policies, stale_grace_hours=0.5)
+    assert restarted.cache == {} # Nada em memória: a remoção depende só da faixa no backend
+    assert restarted.expire_due(now=time.time() + 2 * 3600) == 1
+    assert restarted.backend.get(restarted.key_for("Olá")) is None
+    assert restarted.get_cached_response("Links de PyTorch") == "pytorch.org"
+    restarted.close()
+
+def test_cache_sqlite_delete_expired_includes_now(temp_db_file):
+    """Testa se a remoção por faixa inclui a entrada cujo instante de remoção é exatamente `now`."""
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    cache_manager.cache_response("Q1", "R1")
+    removal_time = cache_manager._removal_time(cache_manager.backend.get(cache_manager.key_for("Q1")))
+    cache_manager.close()
+
+    restarted = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    assert restarted.expire_due(now=removal_time) == 1
+    assert restarted.backend.count() == 0
+    restarted.close()
+
+def test_shared_cache_expiry_keeps_rewritten_key(temp_db_file):
+    """Testa se a remoção de expiradas não apaga uma chave que outro processo regravou depois da expiração vista."""
+    first = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0)
+    second = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0)
+    first.cache_response("Q1", "R1")
+    key = first.key_for("Q1")
+    expired_at = first._removal_time(first.cache[key])
+    time.sleep(0.01)
+    second.cache_response("Q1", "R1 regravada")
+
+    # Chamada direta ao backend: simula a regravação entre o sync de expire_due e a remoção
+    assert first.backend.delete_expired(expired_at, keys=[key]) == 0
+    assert first.get_cached_response("Q1") == "R1 regravada"
+    first.close()
+    second.close()
+
+def test_shared_cache_expiry_publishes_invalidations(temp_db_file):
+    """Testa se as entradas removidas pela expiração de um processo saem do L1 dos demais."""
+    policies = {"general": {"ttl": 60}}
+    first = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0, policies=policies)
+    second = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0, policies=policies)
+    first.cache_response("Olá", "Oi!", category="general")
+    first.cache_response("O que é IA?", "Resposta")
+    assert second.get_cached_response("Olá", category="general") == "Oi!" # Mantida no L1
+
+    assert first.expire_due(now=time.time() + 120) == 1
+    assert second.get_cached_response("Olá", category="general") is None
+    assert second.get_cached_response("O que é IA?") == "Resposta"
+    first.close()
+    second.close()
+
+def test_cache_sqlite_migrates_expires_at_column(temp_db_file):
+    """Testa se um banco sem a coluna expires_at é migrado, preenchendo-a a partir das entradas existentes."""
+    import sqlite3
+    conn = sqlite3.connect(temp_db_file)
+    conn.execute("CREATE TABLE cache_entries (key TEXT PRIMARY KEY, timestamp REAL NOT NULL, entry TEXT NOT NULL)")
+    conn.execute("CREATE INDEX idx_cache_entries_timestamp ON cache_entries (timestamp)")
+    now = time.time()
+    for key, ttl in (("curta", 60), ("longa", 7 * 24 * 3600)):
+        entry = {"response": f"Resposta {key}", "timestamp": now, "compressed": False, "question": key, "ttl": ttl}
+        conn.execute("INSERT INTO cache_entries VALUES (?, ?, ?)", (key, now, json.dumps(entry)))
+    conn.commit()
+    conn.close()
+
+    cache_manager = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite")
+    assert cache_manager.expire_due(now=now + 120) == 1
+    assert cache_manager.backend.get("curta") is None
+    assert cache_manager.backend.get("longa") is not None
+    cache_manager.close()
+
+def _boilerplate_responses(count: int):
+    """Respostas curtas com o mesmo template, como as geradas pelos agentes."""
+    topics = ["redes neurais", "regressão linear", "árvores de decisão", "transformers", "overfitting", "gradiente descendente"]
+    return [
+        f"Ótima pergunta! Vou explicar {topics[i % len(topics)]} de forma simples, com uma analogia do dia a dia. "
+        f"Pense em {topics[i % len(topics)]} como uma receita que melhora a cada tentativa (exemplo {i}). "
+        "Em resumo, o modelo aprende padrões a partir dos dados de treino. "
+        "Você conseguiu entender a ideia principal? Quer que eu dê mais um exemplo prático?"
+        for i in range(count)
+    ]
+
+def test_zlib_dict_codec_improves_ratio():
+    """Testa se o dicionário treinado comprime melhor respostas com boilerplate do que o zlib simples."""
+    samples = _boilerplate_responses(60)
+    dictionary = train_zlib_dictionary(samples[:40])
+    assert 0 < len(dictionary) <= 32 * 1024
+
+    plain, with_dict = ZlibCodec(), ZlibDictCodec(dictionary, dict_version=1)
+    holdout = [sample.encode('utf-8') for sample in samples[40:]]
+    assert all(with_dict.decompress(with_dict.compress(data)) == data for data in holdout)
+    assert sum(len(with_dict.compress(data)) for data in holdout) < sum(len(plain.compress(data)) for data in holdout)
+
+def test_cache_train_dictionary_versions(temp_cache_file):
+    """Testa se o dicionário é versionado no armazenamento e registrado em cada entrada."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, codec="zlib-dict", compression_threshold=100)
+    for i, response in enumerate(_boilerplate_responses(20)):
+        cache_manager.cache_response(f"Pergunta {i}", response)
+    assert cache_manager.active_codec.name == "zlib"
+
+    assert cache_manager.train_dictionary() == 1
+    assert os.path.exists(temp_cache_file + ".zdict.1")
+    cache_manager.cache_response("Pergunta nova", _boilerplate_responses(21)[-1])
+    entry = cache_manager.cache[cache_manager._generate_hash("pergunta nova")]
+    assert (entry['codec'], entry['dict_version']) == ("zlib-dict", 1)
+    assert cache_manager.cache[cache_manager._generate_hash("pergunta 0")]['codec'] == "zlib"
+    assert cache_manager.train_dictionary() == 2
+
+    reopened = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, codec="zlib-dict")
+    assert reopened.active_codec.dict_version == 2
+    assert reopened.get_cached_response("Pergunta nova") == _boilerplate_responses(21)[-1]
+    assert reopened.get_cached_response("Pergunta 0") == _boilerplate_responses(20)[0]
+
+def test_cache_missing_dictionary_is_a_miss(temp_cache_file):
+    """Testa se uma entrada cujo dicionário foi removido vira miss, sem exceção."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, codec="zlib-dict", compression_threshold=100)
+    for i, response in enumerate(_boilerplate_responses(20)):
+        cache_manager.cache_response(f"Pergunta {i}", response)
+    cache_manager.train_dictionary()
+    cache_manager.cache_response("Pergunta nova", _boilerplate_responses(21)[-1])
+    os.remove(temp_cache_file + ".zdict.1")
+
+    reopened = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, codec="zlib-dict")
+    assert reopened.get_cached_response("Pergunta nova") is None
+
+def test_shared_cache_dictionary_trained_by_another_process(temp_db_file):
+    """Testa se uma instância iniciada antes do treino do dicionário lê as entradas novas sem removê-las do L2."""
+    dashboard = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", codec="zlib-dict",
+                              compression_threshold=100, sync_interval=0)
+    bot = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", codec="zlib-dict",
+                        compression_threshold=100, sync_interval=0)
+    for i, response in enumerate(_boilerplate_responses(20)):
+        bot.cache_response(f"Pergunta {i}", response)
+    assert bot.train_dictionary() == 1
+    new_response = _boilerplate_responses(21)[-1]
+    bot.cache_response("Pergunta nova", new_response)
+    key = bot._generate_hash("pergunta nova")
+
+    assert dashboard.get_cached_response("Pergunta nova") == new_response # Recarrega os dicionários do disco
+    assert dashboard.active_codec.dict_version == 1
+    assert dashboard.backend.get(key) is not None
+
+    # Sem o arquivo do dicionário, a leitura é um miss, mas a entrada continua no L2 para quem o tem
+    os.remove(temp_db_file + ".zdict.1")
+    late = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", codec="zlib-dict", sync_interval=0)
+    assert late.get_cached_response("Pergunta nova") is None
+    assert late.backend.get(key) is not None
+    assert bot.get_cached_response("Pergunta nova") == new_response
+    for cache_manager in (dashboard, bot, late):
+        cache_manager.close()
+
+def test_cache_namespaces_are_isolated(temp_cache_file):
+    """Testa se a mesma pergunta em namespaces diferentes (agente + versão do template) usa chaves distintas."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file, similarity_categories=["concept"])
+    cache_manager.cache_response("O que é IA?", "Resposta v1.0", category="concept", namespace="concept@v1.0")
+    cache_manager.cache_response("O que é IA?", "Resposta v1.1", category="concept", namespace="concept@v1.1")
+
+    assert cache_manager.get_cached_response("O que é IA?", category="concept", namespace="concept@v1.0") == "Resposta v1.0"
+    assert cache_manager.get_cached_response("O que é IA?", category="concept", namespace="concept@v1.1") == "Resposta v1.1"
+    assert cache_manager.get_cached_response("O que é IA?", category="concept") is None # Sem namespace: chave legada
+    # A busca por similaridade também respeita o namespace
+    assert cache_manager.get_cached_response("O que é IA??", category="concept", namespace="code@v1.0") is None
+
+def test_cache_namespace_fallback_is_stale(temp_cache_file):
+    """Testa se um miss no namespace atual é atendido, como obsoleto, pelos namespaces anteriores."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file)
+    cache_manager.cache_response("O que é IA?", "Resposta legada")
+    cache_manager.cache_response("O que é ML?", "Resposta v1.0", namespace="concept@v1.0")
+
+    result = cache_manager.lookup("O que é IA?", namespace="concept@v1.1", fallback_namespaces=["concept@v1.0", None])
+    assert result == ("Resposta legada", True, True)
+    result = cache_manager.lookup("O que é ML?", namespace="concept@v1.1", fallback_namespaces=["concept@v1.0", None])
+    assert result == ("Resposta v1.0", True, True)
+    assert cache_manager.lookup("O que é ML?", namespace="concept@v1.1") is None
+    stats = cache_manager.get_stats()
+    assert (stats['fallback_hits'], stats['stale_hits'], stats['misses']) == (2, 2, 1)
+
+def test_cache_hottest_entries(temp_cache_file):
+    """Testa se as entradas mais acessadas de um namespace são listadas em ordem, com a pergunta original."""
+    cache_manager = ResponseCache(cache_file=temp_cache_file)
+    for question, accesses in (("Pergunta A", 1), ("Pergunta B", 3), ("Pergunta C", 2)):
+        cache_manager.cache_response(question, f"Resposta {question}", category="concept", namespace="concept@v1.0")
+        for _ in range(accesses):
+            cache_manager.get_cached_response(question, namespace="concept@v1.0")
+    cache_manager.cache_response("Pergunta D", "Resposta D", namespace="code@v1.0")
+    cache_manager.get_cached_response("Pergunta D", namespace="code@v1.0")
+
+    hottest = cache_manager.hottest_entries(["concept@v1.0"], limit=2)
+    assert [item['prompt'] for item in hottest] == ["Pergunta B", "Pergunta C"]
+    assert hottest[0]['category'] == "concept"
+    assert hottest[0]['accesses'] == 3
+    assert cache_manager.contains("Pergunta A", namespace="concept@v1.0")
+    assert not cache_manager.contains("Pergunta A", namespace="concept@v1.1")
+
+def test_shared_cache_invalidation_between_processes(temp_db_file):
+    """Testa se duas instâncias sobre o mesmo SQLite (L2) mantêm o L1 coerente pelos avisos de invalidação."""
+    bot = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0)
+    cli = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0)
+
+    bot.cache_response("O que é IA?", "Resposta 1")
+    assert cli.get_cached_response("O que é IA?") == "Resposta 1" # Lida do L2 e mantida no L1
+    bot.cache_response("O que é IA?", "Resposta 2")
+    assert cli.get_cached_response("O que é IA?") == "Resposta 2"
+    assert cli.get_stats()['invalidations_received'] == 1
+    assert bot.get_stats()['invalidations_received'] == 0 # Os próprios avisos são ignorados
+
+    cli.clear()
+    assert bot.get_cached_response("O que é IA?") is None
+    assert len(bot.cache) == 0
+    bot.close()
+    cli.close()
+
+def test_shared_cache_blobs_from_two_processes(temp_db_file):
+    """Testa se blobs anexados por instâncias diferentes ao mesmo arquivo mantêm offsets corretos."""
+    first = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", compression_threshold=10, sync_interval=0)
+    second = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", compression_threshold=10, sync_interval=0)
+    for i in range(5):
+        first.cache_response(f"Pergunta A{i}", f"Resposta longa do primeiro processo {i}. " * 20)
+        second.cache_response(f"Pergunta B{i}", f"Resposta longa do segundo processo {i}. " * 20)
+
+    for cache_manager in (first, second):
+        for i in range(5):
+            assert cache_manager.get_cached_response(f"Pergunta A{i}") == f"Resposta longa do primeiro processo {i}. " * 20
+            assert cache_manager.get_cached_response(f"Pergunta B{i}") == f"Resposta longa do segundo processo {i}. " * 20
+
+    first.blob_store.min_compaction_bytes = 0
+    first.compact_blobs() # Relocaliza os blobs e publica a invalidação das entradas regravadas
+    assert second.get_cached_response("Pergunta B3") == "Resposta longa do segundo processo 3. " * 20
+    second.cache_response("Pergunta C", "Resposta gravada após a compactação. " * 20)
+    assert first.get_cached_response("Pergunta C") == "Resposta gravada após a compactação. " * 20
+    first.close()
+    second.close()
+
+def test_shared_cache_lost_invalidations_drop_l1(temp_db_file):
+    """Testa se avisos removidos antes de serem lidos descartam todo o L1, em vez de servir dados antigos."""
+    reader = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0)
+    writer = ResponseCache(cache_file=temp_db_file, ttl_hours=1, storage="sqlite", sync_interval=0)
+    writer.cache_response("Q1", "R1")
+    assert reader.get_cached_response("Q1") == "R1"
+
+    writer.backend.invalidation_retention = -1 # Cada escrita remove todos os avisos anteriores
+    writer.cache_response("Q1", "R1 nova")
+    writer.cache_response("Q2", "R2")
+    assert reader.get_cached_response("Q1") == "R1 nova"
+    reader.close()
+    writer.close()
+
+def test_frequency_sketch_estimates_and_ages():
+    """Testa as estimativas do count-min sketch, a saturação dos contadores e o envelhecimento."""
+    sketch = FrequencySketch(capacity=64, sample_multiplier=1000)
+    for _ in range(5):
+        sketch.increment("popular")
+    sketch.increment("raro")
+    assert sketch.estimate("popular") >= 5
+    assert sketch.estimate("raro") >= 1
+    assert sketch.estimate("nunca visto") <= 1 # Colisões são raras com poucas chaves
+    for _ in range(40):
+        sketch.increment("popular")
+    assert sketch.estimate("popular") == FrequencySketch.MAX_COUNT
+
+    sketch._age()
+    assert sketch.estimate("popular") == FrequencySketch.MAX_COUNT // 2
+    assert sketch.resets == 1
+
+def test_cache_tinylfu_rejects_one_hit_wonders(temp_cache_file):
+    """Testa se, com TinyLFU, perguntas únicas não expulsam as populares (ao contrário do LRU)."""
+    def replay(admission):
+        cache_manager = ResponseCache(cache_file=temp_cache_file, ttl_hours=1, max_entries=10,
+                                      admission=admission, window_ratio=0.1, write_behind=True, flush_interval=3600)
+        popular = [f"Pergunta popular {i}" for i in range(5)]
+        for _ in range(3):
+            for question in popular:
+                if cache_manager.get_cached_response(question) is None:
+                    cache_manager.cache_response(question, f"Resposta de {question}")
+        for i in range(50):
+            question = f"Pergunta única {i}"
+            if cache_manager.get_cached_response(question) is None:
+                cache_manager.cache_response(question, "Resposta única")
+        kept = sum(cache_manager.get_cached_response(question) is not None for question in popular)
+        stats = cache_manager.get_stats()
+        cache_manager.clear()
+        cache_manager.close()
+        return kept, stats
+
+    kept_lru, _ = replay("lru")
+    kept_tinylfu, stats = replay("tinylfu")
+    assert kept_lru == 0
+    assert kept_tinylfu == 5
+    assert stats['admission'] == "tinylfu"
+    assert stats['admission_rejections'] > 0
+    assert stats['current_entries'] <= 10
+
+def test_cache_rejects_unknown_admission_policy(temp_cache_file):
+    """Testa se uma política de admissão desconhecida é rejeitada."""
+    with pytest.raises(ValueError):
+        ResponseCache(cache_file=temp_cache_file, admission="lfu")
+
+def test_create_response_cache_uses_config_policies(tmp_path):
+    """Testa se o cache da CLI é criado com os mesmos TTLs, políticas e janela de tolerância do bot."""
+    from config import CACHE_POLICIES, CACHE_STALE_GRACE_PERIOD, CACHE_STORAGE
+    from utils.cache_factory import create_response_cache
+    cache_manager = create_response_cache(cache_file=str(tmp_path / "cli_cache.db"), write_behind=False)
+    assert cache_manager.storage == CACHE_STORAGE
+    assert cache_manager.write_behind is False
+    assert cache_manager.stale_grace_seconds == CACHE_STALE_GRACE_PERIOD
+    for category, policy in CACHE_POLICIES.items():
+        assert cache_manager.get_policy(category).ttl_seconds == policy['ttl']
+    cache_manager.close()
@@ -0,0 +1,90 @@
+import pytest
+import random
+
+from utils.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN, decorrelated_jitter
+
+class FakeClock:
+    """Relógio controlado pelo teste."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def transitions():
+    return []
+
+@pytest.fixture
+def breaker(clock, transitions):
+    return CircuitBreaker("gemini-pro", failure_threshold=3, recovery_timeout=30,
+                          on_state_change=lambda model, old, new: transitions.append((old, new)), clock=clock)
+
+def test_breaker_opens_after_consecutive_failures(breaker, transitions):
+    """Testa se o circuito abre só após `failure_threshold` falhas consecutivas."""
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success() # Sucesso zera a sequência
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert transitions == [(CLOSED, OPEN)]
+
+def test_open_breaker_fails_fast_until_recovery_timeout(breaker, clock):
+    """Testa se o circuito aberto recusa chamadas até o fim do tempo de recuperação."""
+    for _ in range(3):
+        breaker.record_failure()
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == pytest.approx(30)
+    clock.now += 29
+    assert not breaker.allow_request()
+    assert breaker.get_stats()["rejected"] == 2
+
+def test_half_open_allows_single_probe(breaker, clock, transitions):
+    """Testa se o half-open deixa passar uma chamada de teste e fecha o circuito no sucesso."""
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request() # Chamada de teste
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request() # Só uma por vez
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert transitions == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+
+def test_half_open_failure_reopens(breaker, clock):
+    """Testa se uma falha na chamada de teste reabre o circuito por mais um tempo de recuperação."""
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == pytest.approx(30)
+    assert breaker.get_stats()["times_opened"] == 2
+
+def test_half_open_probe_that_never_finishes_is_replaced(breaker, clock):
+    """Testa se uma chamada de teste sem resultado (ex: cancelada) não trava o circuito em half-open."""
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    clock.now += 30
+    assert breaker.allow_request()
+
+def test_decorrelated_jitter_bounds():
+    """Testa se o backoff fica entre a base e três vezes o anterior, sem passar do limite."""
+    rng = random.Random(7)
+    previous = 1.0
+    for _ in range(100):
+        delay = decorrelated_jitter(previous, base=1.0, cap=8.0, rng=rng)
+        assert 1.0 <= delay <= min(8.0, previous * 3)
+        previous = delay
+    delays = {round(decorrelated_jitter(2.0, 1.0, 8.0, rng), 3) for _ in range(20)}
+    assert len(delays) > 1 # Não é determinístico como o backoff exponencial puro
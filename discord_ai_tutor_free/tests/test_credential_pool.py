@@ -0,0 +1,71 @@
+import pytest
+from unittest.mock import MagicMock
+from google.api_core import exceptions as google_exceptions
+
+from utils.credential_pool import CredentialPool, is_quota_error
+
+QUOTAS = {"default": {"rpm": 2, "tpm": 10**6, "rpd": 100}}
+
+@pytest.fixture
+def clock():
+    return MagicMock(return_value=1000.0)
+
+def test_pool_routes_to_key_with_most_headroom(clock):
+    """Testa se cada reserva vai para a chave com mais folga, somando as cotas das chaves."""
+    pool = CredentialPool(["chave-a", "chave-b"], QUOTAS, clock=clock)
+    used = []
+    for _ in range(4):
+        assert pool.try_acquire("gemini-pro") == 0.0
+        used.append(pool.granted().key)
+    assert used == ["chave-a", "chave-b", "chave-a", "chave-b"]
+    assert pool.try_acquire("gemini-pro") > 0 # As duas chaves sem cota
+    stats = pool.get_stats()["gemini-pro"]
+    assert stats["granted"] == 4
+    assert stats["rpm_available"] == 0
+
+def test_pool_takes_rate_limited_key_out_of_rotation(clock):
+    """Testa se uma chave com 429 sai do rodízio por um tempo que dobra a cada 429 seguido."""
+    pool = CredentialPool(["chave-a", "chave-b"], QUOTAS, cooldown=60, clock=clock)
+    key_a = pool.credentials[0]
+    pool.report_rate_limited(key_a)
+    assert pool.available() == [pool.credentials[1]]
+    for _ in range(2):
+        pool.try_acquire("gemini-pro")
+        assert pool.granted().key == "chave-b"
+    assert pool.try_acquire("gemini-pro") == pytest.approx(30) # Reposição do RPM da chave b, antes da volta da chave a
+
+    clock.return_value += 60
+    assert key_a in pool.available()
+    pool.report_rate_limited(key_a)
+    assert pool.get_key_stats()["chave-1"]["disabled_seconds"] == 120
+    pool.report_success(key_a)
+    assert key_a.consecutive_rate_limits == 0
+
+def test_pool_waits_for_a_key_when_all_are_out_of_rotation(clock):
+    """Testa se, com todas as chaves fora do rodízio, a espera vai até a primeira voltar."""
+    pool = CredentialPool(["chave-a", "chave-b"], QUOTAS, cooldown=60, clock=clock)
+    pool.report_rate_limited(pool.credentials[0])
+    clock.return_value += 10
+    pool.report_rate_limited(pool.credentials[1])
+    assert pool.try_acquire("gemini-pro") == pytest.approx(50)
+    assert pool.get_stats() == {}
+
+def test_pool_clients_per_key():
+    """Testa se cada chave tem um único cliente e se a chave padrão usa o cliente global."""
+    pool = CredentialPool(["chave-a", "chave-b"], QUOTAS)
+    with pytest.raises(ValueError):
+        CredentialPool([], QUOTAS)
+    assert pool.client_for(pool.default) is None
+    factory = MagicMock(side_effect=lambda key: f"cliente de {key}")
+    pool = CredentialPool(["chave-a", "chave-b"], QUOTAS, client_factory=factory)
+    assert pool.client_for(pool.credentials[1]) == "cliente de chave-b"
+    assert pool.client_for(pool.credentials[1]) == "cliente de chave-b"
+    assert pool.client_for(pool.default) == "cliente de chave-a"
+    assert factory.call_count == 2
+
+def test_is_quota_error():
+    """Testa a identificação das respostas 429 da API."""
+    assert is_quota_error(google_exceptions.ResourceExhausted("Quota exceeded"))
+    assert is_quota_error(google_exceptions.TooManyRequests("Too many requests"))
+    assert not is_quota_error(google_exceptions.ServiceUnavailable("503"))
+    assert not is_quota_error(Exception("erro"))
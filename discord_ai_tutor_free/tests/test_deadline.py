@@ -0,0 +1,61 @@
+import pytest
+import asyncio
+from unittest.mock import MagicMock
+
+from utils.deadline import Deadline, DeadlineExceeded, timed, within
+
+def test_deadline_remaining_and_stages():
+    """Testa o tempo restante e a contabilização do tempo por etapa."""
+    clock = MagicMock(return_value=100.0)
+    deadline = Deadline(10, clock=clock)
+    with deadline.stage("queue"):
+        clock.return_value += 2
+    with deadline.stage("api"):
+        clock.return_value += 3
+    with deadline.stage("queue"):
+        clock.return_value += 1
+    assert deadline.stages == {"queue": 3.0, "api": 3.0}
+    assert deadline.remaining() == 4.0
+    assert not deadline.expired()
+    assert deadline.format_stages() == "queue=3.00s, api=3.00s"
+
+    clock.return_value += 4
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded) as exc_info:
+        deadline.check("api")
+    assert exc_info.value.stage == "api"
+    assert deadline.exceeded_stage == "api"
+
+@pytest.mark.asyncio
+async def test_deadline_run_cancels_slow_stage():
+    """Testa se a etapa que passa do prazo é cancelada e vira DeadlineExceeded."""
+    deadline = Deadline(0.05)
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(DeadlineExceeded):
+        await deadline.run(slow(), "api")
+    assert cancelled.is_set()
+    assert deadline.exceeded_stage == "api"
+    assert deadline.stages["api"] == pytest.approx(0.05, abs=0.05)
+
+@pytest.mark.asyncio
+async def test_helpers_without_deadline():
+    """Testa se, sem prazo, as etapas rodam sem limite e sem medição."""
+    async def answer():
+        return 42
+
+    assert await within(None, answer(), "api") == 42
+    with timed(None, "cache"):
+        pass
+    deadline = Deadline(1)
+    assert await within(deadline, answer(), "api") == 42
+    with timed(deadline, "cache"):
+        pass
+    assert set(deadline.stages) == {"api", "cache"}
@@ -38,10 +38,18 @@ def mock_orchestrator():
     with patch('agents.discord_tutor.FreeTierOrchestrator') as MockOrchestrator:
         mock_instance = MockOrchestrator.return_value
         mock_instance.generate_response = AsyncMock(return_value="Mocked AI response from orchestrator.")
+
+        async def fake_stream(prompt, classification_result, **kwargs):
+            # O stream entrega a mesma resposta de generate_response em um único trecho
+            yield await mock_instance.generate_response(prompt, classification_result)
+        mock_instance.generate_response_stream = MagicMock(side_effect=fake_stream)
         mock_instance.get_usage_stats = MagicMock(return_value={
-            "api_calls_total": 10, "cache_hits_total": 5, "total_requests_processed": 15,
+            "api_calls_total": 10, "cache_hits_total": 5, "deduplicated_calls_total": 0, "total_requests_processed": 15,
             "cache_stats": {"hits": 5, "misses": 10, "total_requests": 15, "hit_rate_percent": 33.33, "current_entries": 10},
-            "agent_metrics": {"ConceptExplainer": {"api_calls": 2, "cache_hits": 1}}
+            "agent_metrics": {"ConceptExplainer": {"api_calls": 2, "cache_hits": 1, "escalations": 0, "models": {"gemini-pro": {"api_calls": 2, "avg_response_time": 1.2}}}},
+            "request_queue": {"interactive": {"queued": 0, "max_queued": 2, "dispatched": 10, "rejected": 0, "avg_wait_seconds": 0.5, "max_wait_seconds": 3.0}},
+            "deadlines": {"requests": 10, "exceeded_total": 1, "exceeded_by_stage": {"api": 1}, "avg_stage_seconds": {"cache": 0.002, "queue": 0.5, "api": 2.1}},
+            "api_keys": {"chave-1": {"available": True, "disabled_seconds": 0.0, "rate_limited": 0, "granted": 10}}
         })
         mock_instance.reset_stats = MagicMock()
         yield MockOrchestrator
@@ -202,8 +210,7 @@ async def test_command_reset_admin(bot, mock_orchestrator):
     # Usa ctx.invoke para simular a chamada de comando corretamente
     await ctx.invoke(bot.get_command('reset'))
     
-    mock_orchestrator.return_value.cache.cleanup_expired.assert_called_once()
-    mock_orchestrator.return_value.cache._save_cache.assert_called_once()
+    mock_orchestrator.return_value.cache.aclear.assert_awaited_once()
     mock_orchestrator.return_value.reset_stats.assert_called_once()
     assert bot.last_response_time == {}
     ctx.channel.send.assert_called_once_with("Cache limpo e estatísticas resetadas com sucesso!")
@@ -227,3 +234,67 @@ async def test_command_reset_non_admin(bot, mock_orchestrator):
     # Podemos verificar a chamada a ctx.send.
     ctx.channel.send.assert_called_once_with("Você não tem permissão para usar este comando.")
     mock_orchestrator.return_value.reset_stats.assert_not_called() # Não deve resetar
+
+@pytest.fixture
+def streaming_bot(mock_intents, mock_classifier, mock_orchestrator):
+    """Bot sem usuário conectado, suficiente para testar o envio de mensagens."""
+    return DiscordAITutorFree(intents=mock_intents)
+
+def _streaming_channel():
+    """Canal mockado que registra o conteúdo final de cada mensagem enviada (após as edições)."""
+    channel = AsyncMock(spec=discord.TextChannel)
+    channel.messages = []
+
+    async def send(content):
+        message = MagicMock()
+        message.content = content
+
+        async def edit(content):
+            message.content = content
+        message.edit = AsyncMock(side_effect=edit)
+        channel.messages.append(message)
+        return message
+    channel.send = AsyncMock(side_effect=send)
+    return channel
+
+async def _chunks(*parts, delay: float = 0):
+    for part in parts:
+        await asyncio.sleep(delay)
+        yield part
+
+@pytest.mark.asyncio
+async def test_streamed_message_sends_first_chunk_and_throttles_edits(streaming_bot):
+    """Testa se a mensagem sai no primeiro trecho e as edições respeitam o intervalo mínimo."""
+    channel = _streaming_channel()
+    text = await streaming_bot._send_streamed_message(channel, _chunks("Olá", ", isto", " é", " um", " teste."), edit_interval=60)
+    assert text == "Olá, isto é um teste."
+    assert channel.send.call_count == 1
+    channel.send.assert_called_once_with("Olá") # Primeiro trecho visível imediatamente
+    assert channel.messages[0].edit.call_count == 1 # Só a edição final, dentro do intervalo
+    assert channel.messages[0].content == text
+
+@pytest.mark.asyncio
+async def test_streamed_message_edits_at_cadence(streaming_bot):
+    """Testa se, passado o intervalo, cada trecho novo atualiza a mensagem."""
+    channel = _streaming_channel()
+    await streaming_bot._send_streamed_message(channel, _chunks("a", "b", "c", delay=0.02), edit_interval=0.01)
+    assert channel.send.call_count == 1
+    assert channel.messages[0].edit.call_count == 2
+    assert channel.messages[0].content == "abc"
+
+@pytest.mark.asyncio
+async def test_streamed_message_rolls_over_at_2000_chars(streaming_bot):
+    """Testa se a resposta continua em uma nova mensagem ao passar de 2000 caracteres."""
+    channel = _streaming_channel()
+    parts = ["x" * 900, "y" * 900, "z" * 900, "w" * 1800]
+    text = await streaming_bot._send_streamed_message(channel, _chunks(*parts), edit_interval=0)
+    assert text == "".join(parts)
+    assert [message.content for message in channel.messages] == [text[:2000], text[2000:4000], text[4000:]]
+    assert all(len(message.content) <= 2000 for message in channel.messages)
+
+@pytest.mark.asyncio
+async def test_streamed_message_empty_stream_sends_nothing(streaming_bot):
+    """Testa se um stream vazio não envia mensagens (o chamador envia a mensagem de erro)."""
+    channel = _streaming_channel()
+    assert await streaming_bot._send_streamed_message(channel, _chunks()) == ""
+    channel.send.assert_not_called()
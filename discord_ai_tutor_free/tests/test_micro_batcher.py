@@ -0,0 +1,63 @@
+import pytest
+import asyncio
+
+from utils.micro_batcher import MicroBatcher, build_batch_prompt, split_batch_response
+
+def test_build_batch_prompt_numbers_each_request():
+    """Testa se o prompt em lote numera as solicitações e explica o formato das respostas."""
+    prompt = build_batch_prompt(["Explique redes neurais.", "Explique dropout."])
+    assert "=== SOLICITAÇÃO 1 ===\nExplique redes neurais." in prompt
+    assert "=== SOLICITAÇÃO 2 ===\nExplique dropout." in prompt
+    assert "[[RESPOSTA N]]" in prompt and "[[FIM]]" in prompt
+
+def test_split_batch_response():
+    """Testa a separação das respostas delimitadas, em qualquer ordem."""
+    text = "Claro!\n[[RESPOSTA 2]]\nSegunda.\n\n[[RESPOSTA 1]]\nPrimeira,\nem duas linhas.\n[[FIM]]\n"
+    assert split_batch_response(text, 2) == ["Primeira,\nem duas linhas.", "Segunda."]
+
+def test_split_batch_response_marks_unparseable_parts():
+    """Testa se respostas ausentes, vazias, repetidas ou truncadas viram None."""
+    assert split_batch_response("Sem delimitadores.", 2) == [None, None]
+    assert split_batch_response(None, 1) == [None]
+    # Sem o marcador de fim, a última resposta pode ter sido truncada
+    assert split_batch_response("[[RESPOSTA 1]]\nUm.\n[[RESPOSTA 2]]\nDo", 2) == ["Um.", None]
+    text = "[[RESPOSTA 1]]\nUm.\n[[RESPOSTA 1]]\nDe novo.\n[[RESPOSTA 2]]\n\n[[RESPOSTA 3]]\nTrês.\n[[FIM]]"
+    assert split_batch_response(text, 3) == [None, None, "Três."]
+
+@pytest.mark.asyncio
+async def test_micro_batcher_groups_items_by_key_within_window():
+    """Testa se itens da mesma chave enviados dentro da janela são processados juntos."""
+    flushed = []
+
+    async def flush(key, items):
+        flushed.append((key, items))
+        return [f"{key}:{item}" for item in items]
+
+    batcher = MicroBatcher(flush, window=0.05, max_size=10)
+    results = await asyncio.gather(
+        batcher.submit("concept", "a"), batcher.submit("concept", "b"), batcher.submit("code", "c")
+    )
+    assert results == ["concept:a", "concept:b", "code:c"]
+    assert sorted(flushed) == [("code", ["c"]), ("concept", ["a", "b"])]
+    assert batcher.batches_flushed == 2
+    assert batcher.items_batched == 3
+
+@pytest.mark.asyncio
+async def test_micro_batcher_flushes_full_batch_immediately():
+    """Testa se um lote cheio sai sem esperar o fim da janela."""
+    async def flush(key, items):
+        return items
+
+    batcher = MicroBatcher(flush, window=10, max_size=2)
+    results = await asyncio.wait_for(asyncio.gather(batcher.submit("k", 1), batcher.submit("k", 2)), timeout=1)
+    assert results == [1, 2]
+
+@pytest.mark.asyncio
+async def test_micro_batcher_propagates_flush_errors():
+    """Testa se uma falha no processamento do lote chega a todos os itens."""
+    async def flush(key, items):
+        raise RuntimeError("falha no lote")
+
+    batcher = MicroBatcher(flush, window=0.01)
+    results = await asyncio.gather(batcher.submit("k", 1), batcher.submit("k", 2), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
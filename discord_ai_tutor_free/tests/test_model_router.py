@@ -0,0 +1,20 @@
+import pytest
+
+from utils.model_router import ModelRouter
+
+@pytest.fixture
+def router():
+    return ModelRouter("modelo-leve", {"general": 0.0, "resource": 0.2, "concept": 0.5}, light_max_words=10)
+
+@pytest.mark.parametrize("agent_key, confidence, question, expected", [
+    ("general", 0.1, "Tudo bem com você?", "modelo-leve"),
+    ("resource", 0.4, "Indique cursos gratuitos de IA", "modelo-leve"),
+    ("concept", 0.8, "O que é overfitting?", "modelo-leve"),
+    ("concept", 0.3, "O que é overfitting?", "gemini-pro"), # Classificador pouco confiante
+    ("code", 0.9, "Como usar o PyTorch?", "gemini-pro"), # Código sempre no modelo do agente
+    ("general", 0.9, " ".join(["palavra"] * 11), "gemini-pro"), # Pergunta longa
+])
+def test_router_chooses_model_from_classification(router, agent_key, confidence, question, expected):
+    """Testa a escolha do modelo pela categoria, confiança do classificador e tamanho da pergunta."""
+    classification = {"categories": [agent_key], "confidence_score": confidence, "language": "pt"}
+    assert router.choose_model(agent_key, "gemini-pro", classification, question) == expected
@@ -3,10 +3,20 @@ import asyncio
 import time
 import logging
 from unittest.mock import AsyncMock, MagicMock, patch
+import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.generativeai import generative_models
+from google.api_core import exceptions as google_exceptions
 
 from utils.free_tier_orchestrator import FreeTierOrchestrator, Agent
 from tools.response_cache import ResponseCache
 from utils.prompt_builder import PromptBuilder
+from utils.rate_limiter import RateLimiter
+from utils.request_scheduler import RequestScheduler, Priority
+from utils.micro_batcher import MicroBatcher
+from utils.circuit_breaker import CircuitBreaker
+from utils.deadline import Deadline
+from utils.credential_pool import CredentialPool
 from config import GOOGLE_API_KEY
 
 # Configura o logging para os testes
@@ -31,9 +41,14 @@ def mock_google_api():
 
 @pytest.fixture
 def mock_response_cache():
-    """Mocka a classe ResponseCache."""
-    with patch('tools.response_cache.ResponseCache') as MockCache:
-        mock_instance = MockCache.return_value
+    """Mocka o ResponseCache criado pelo orquestrador (a referência usada em utils.free_tier_orchestrator)."""
+    with patch('utils.free_tier_orchestrator.create_response_cache') as MockCache:
+        mock_instance = MagicMock(spec=ResponseCache) # Métodos assíncronos (alookup, aset...) viram AsyncMock
+        MockCache.return_value = mock_instance
+        mock_instance.alookup.return_value = None
+        mock_instance.aget.return_value = None
+        mock_instance.acontains.return_value = False
+        mock_instance.key_for.side_effect = lambda question, namespace=None: (question, namespace)
         mock_instance.get_cached_response = MagicMock(return_value=None)
         mock_instance.cache_response = MagicMock()
         mock_instance.get_stats = MagicMock(return_value={"hits": 0, "misses": 0, "total_requests": 0, "hit_rate_percent": 0, "current_entries": 0})
@@ -152,8 +167,9 @@ async def test_rate_limiting(orchestrator, mock_google_api, mock_response_cache)
     """Testa se o rate limiting está funcionando."""
     mock_response_cache.return_value.get_cached_response.return_value = None
     
-    # Reduz o intervalo para testar mais rápido
-    orchestrator.rate_limit_interval = 0.1 # 100ms entre requests
+    # Cota de 600 requests/minuto sem rajada: uma requisição a cada 100ms
+    orchestrator.rate_limiter = RateLimiter({"default": {"rpm": 600, "tpm": 10**6, "rpd": 10**4, "burst": 1}})
+    orchestrator.scheduler = RequestScheduler(orchestrator.rate_limiter)
     
     start_time = time.time()
     for i in range(3): # Faz 3 requests
@@ -162,11 +178,78 @@ async def test_rate_limiting(orchestrator, mock_google_api, mock_response_cache)
         await orchestrator.generate_response(prompt, classification)
     end_time = time.time()
     
-    # Espera-se que o tempo total seja pelo menos (número de requests - 1) * rate_limit_interval
-    expected_min_time = (3 - 1) * orchestrator.rate_limit_interval
-    assert (end_time - start_time) >= expected_min_time
+    # Espera-se que o tempo total seja pelo menos (número de requests - 1) * 100ms
+    expected_min_time = (3 - 1) * 0.1
+    assert (end_time - start_time) >= expected_min_time * 0.95
     assert mock_google_api.return_value.generate_content_async.call_count == 3
 
+@pytest.mark.asyncio
+async def test_rate_limiting_allows_burst_within_quota(orchestrator, mock_google_api, tmp_path):
+    """Testa se requisições dentro da cota saem imediatamente, sem espaçamento fixo."""
+    orchestrator.router = None # Sem cascata: as perguntas usam o modelo do agente (gemini-pro)
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "burst_cache.json"), ttl_hours=1)
+    orchestrator.rate_limiter = RateLimiter({"default": {"rpm": 10, "tpm": 10**6, "rpd": 1500}})
+    orchestrator.scheduler = RequestScheduler(orchestrator.rate_limiter)
+    classification = {"categories": ["general"], "confidence_score": 0.5, "language": "pt"}
+
+    start_time = time.time()
+    await asyncio.gather(*(orchestrator.generate_response(f"Pergunta de rajada {i}", classification) for i in range(5)))
+    assert time.time() - start_time < 1.0 # Antes: 4 x 6s de espaçamento
+    assert mock_google_api.return_value.generate_content_async.call_count == 5
+    stats = orchestrator.get_usage_stats()['rate_limits']['gemini-pro']
+    assert stats['granted'] == 5
+    assert stats['rpm_available'] < 6
+
+@pytest.mark.asyncio
+async def test_user_questions_beat_background_calls(orchestrator, mock_google_api, tmp_path):
+    """Testa se, com a cota esgotada, a pergunta do usuário é atendida antes da revalidação em background."""
+    orchestrator.router = None # Sem cascata: as perguntas usam o modelo do agente (gemini-pro)
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "priority_cache.json"), ttl_hours=1)
+    orchestrator.rate_limiter = RateLimiter({"default": {"rpm": 1200, "tpm": 10**6, "rpd": 10**4, "burst": 1}})
+    orchestrator.scheduler = RequestScheduler(orchestrator.rate_limiter)
+    await orchestrator.rate_limiter.acquire("gemini-pro") # Esgota a rajada
+    api_mock = mock_google_api.return_value.generate_content_async
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+
+    background = asyncio.create_task(orchestrator._refresh_cached_response("Pergunta em background", classification, "concept"))
+    await asyncio.sleep(0)
+    await orchestrator.generate_response("Pergunta do usuário", classification)
+    await background
+
+    prompts = [call.args[0] for call in api_mock.call_args_list]
+    assert "Pergunta do usuário" in prompts[0]
+    assert "Pergunta em background" in prompts[1]
+    queue_stats = orchestrator.get_usage_stats()['request_queue']
+    assert queue_stats['interactive']['dispatched'] == 1
+    assert queue_stats['background']['dispatched'] == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("supports_system_instruction", [True, False])
+async def test_generative_model_built_once_per_agent(orchestrator, mock_google_api, tmp_path, supports_system_instruction):
+    """Testa se cada agente cria seu GenerativeModel uma única vez, com instrução e generation config próprias."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "models_cache.json"), ttl_hours=1)
+    api_mock = mock_google_api.return_value.generate_content_async
+    concept = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+    code = {"categories": ["code"], "confidence_score": 0.9, "language": "pt"}
+
+    with patch('utils.free_tier_orchestrator._SUPPORTS_SYSTEM_INSTRUCTION', supports_system_instruction):
+        await orchestrator.generate_response("O que é uma rede neural?", concept)
+        await orchestrator.generate_response("O que é overfitting?", concept)
+        await orchestrator.generate_response("Como usar o PyTorch?", code)
+
+    assert api_mock.call_count == 3
+    assert mock_google_api.call_count == 2 # Um modelo por agente, reutilizado entre as requisições
+    concept_call = mock_google_api.call_args_list[0]
+    assert concept_call.kwargs['generation_config'] == {"temperature": 0.7, "max_output_tokens": 600}
+    instruction = "Você é um tutor especialista em IA"
+    sent_prompt = api_mock.call_args_list[0].args[0]
+    if supports_system_instruction:
+        assert concept_call.kwargs['system_instruction'].startswith(instruction)
+        assert instruction not in sent_prompt
+    else:
+        assert 'system_instruction' not in concept_call.kwargs
+        assert sent_prompt.startswith(instruction) # Instrução no início do prompt
+
 @pytest.mark.asyncio
 async def test_retry_mechanism(orchestrator, mock_google_api, mock_response_cache):
     """Testa o mecanismo de retry com backoff exponencial."""
@@ -216,3 +299,478 @@ def test_reset_stats(orchestrator):
     assert stats['total_requests_processed'] == 0
     assert stats['agent_metrics']['ConceptExplainer']['api_calls'] == 0
     assert orchestrator.cache.hits == 0 # Verifica se o cache manager também foi resetado
+
+@pytest.mark.asyncio
+async def test_stale_hit_schedules_background_refresh(orchestrator, mock_google_api, tmp_path):
+    """Testa se um hit obsoleto responde na hora e revalida a entrada em background."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "swr_cache.json"), ttl_hours=1, stale_grace_hours=1)
+    prompt = "O que é uma rede neural?"
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+    namespace = orchestrator._cache_namespace("concept")
+    orchestrator.cache.cache_response(prompt, "Resposta antiga.", category="concept", namespace=namespace)
+    key = orchestrator.cache._make_key(orchestrator.cache._normalize_question(prompt), namespace)
+    orchestrator.cache.cache[key]['timestamp'] -= 3600 + 60 # Obsoleta, mas dentro da janela
+
+    response = await orchestrator.generate_response(prompt, classification)
+    assert response == "Resposta antiga."
+    assert len(orchestrator._refresh_tasks) == 1
+
+    await asyncio.gather(*orchestrator._refresh_tasks)
+    assert orchestrator.cache.get_cached_response(prompt, namespace=namespace) == "Mocked AI response."
+    assert orchestrator.cache.get_stats()['refreshes'] == 1
+    assert mock_google_api.return_value.generate_content_async.call_count == 1
+
+@pytest.mark.asyncio
+async def test_prompt_version_change_falls_back_and_rewarms(orchestrator, mock_google_api, tmp_path):
+    """Testa o fallback para a versão anterior do template e o re-aquecimento das chaves mais acessadas."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "versioned_cache.json"), ttl_hours=1)
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+    hot, cold = "O que é uma rede neural?", "O que é overfitting?"
+    old_namespace = orchestrator._cache_namespace("concept")
+    orchestrator.cache.cache_response(hot, "Resposta v1.0 quente.", category="concept", namespace=old_namespace)
+    orchestrator.cache.cache_response(cold, "Resposta v1.0 fria.", category="concept", namespace=old_namespace)
+    for _ in range(3):
+        assert await orchestrator.generate_response(hot, classification) == "Resposta v1.0 quente."
+    assert await orchestrator.generate_response(cold, classification) == "Resposta v1.0 fria."
+
+    with patch('utils.free_tier_orchestrator.CACHE_REWARM_LIMIT', 1), \
+         patch('utils.free_tier_orchestrator.CACHE_REWARM_INTERVAL', 0):
+        assert orchestrator.set_prompt_version("v1.1")
+        assert not orchestrator.set_prompt_version("v9.9")
+        rewarm_tasks = list(orchestrator._refresh_tasks)
+        await asyncio.gather(*rewarm_tasks)
+
+    new_namespace = orchestrator._cache_namespace("concept")
+    assert new_namespace != old_namespace
+    assert orchestrator.rewarmed_entries == 1
+    assert orchestrator.cache.get_cached_response(hot, namespace=new_namespace) == "Mocked AI response."
+    # A chave fria não foi re-aquecida, mas ainda é servida (obsoleta) a partir do namespace anterior
+    assert await orchestrator.generate_response(cold, classification) == "Resposta v1.0 fria."
+    assert orchestrator.cache.get_stats()['fallback_hits'] == 1
+    await asyncio.gather(*orchestrator._refresh_tasks) # Revalidação da chave fria na nova versão
+    assert orchestrator.cache.get_cached_response(cold, namespace=new_namespace) == "Mocked AI response."
+
+@pytest.mark.asyncio
+async def test_identical_inflight_prompts_are_coalesced(orchestrator, mock_google_api, tmp_path):
+    """Testa se perguntas idênticas simultâneas compartilham uma única chamada à API (singleflight)."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "singleflight_cache.json"), ttl_hours=1)
+    api_mock = mock_google_api.return_value.generate_content_async
+    mocked_response = api_mock.return_value
+
+    async def slow_api(prompt):
+        await asyncio.sleep(0.05)
+        return mocked_response
+    api_mock.side_effect = slow_api
+
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+    prompts = ["O que é backpropagation?"] * 10 + ["o que é Backpropagation"] * 5 + ["O que é dropout?"]
+    responses = await asyncio.gather(*(orchestrator.generate_response(p, classification) for p in prompts))
+
+    assert all(response == "Mocked AI response." for response in responses)
+    assert api_mock.call_count == 2 # Uma chamada por pergunta normalizada distinta
+    assert orchestrator.deduplicated_calls == 14
+    assert orchestrator.get_usage_stats()['deduplicated_calls_total'] == 14
+    assert orchestrator._inflight == {}
+    assert orchestrator.cache.get_cached_response("O que é backpropagation?", namespace=orchestrator._cache_namespace("concept")) == "Mocked AI response."
+
+@pytest.mark.asyncio
+async def test_micro_batching_splits_answers_and_falls_back(orchestrator, mock_google_api, tmp_path):
+    """Testa se perguntas simultâneas do mesmo agente viram uma chamada, com cache por pergunta e fallback individual."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "batch_cache.json"), ttl_hours=1)
+    orchestrator.batcher = MicroBatcher(orchestrator._call_gemini_batch, window=0.05, max_size=4)
+    api_mock = mock_google_api.return_value.generate_content_async
+    questions = ["O que é uma rede neural?", "O que é overfitting?", "O que é dropout?"]
+
+    def answer_for(prompt):
+        return next(question for question in questions if question in prompt)
+
+    async def fake_api(prompt, **kwargs):
+        response = MagicMock()
+        if "=== SOLICITAÇÃO" in prompt:
+            sections = prompt.split("=== SOLICITAÇÃO ")[1:]
+            # O modelo "esquece" a resposta sobre dropout: ela deve ser refeita individualmente
+            text = "".join(
+                f"[[RESPOSTA {section.split(' ')[0]}]]\nLote: {answer_for(section)}\n"
+                for section in sections if "dropout" not in section
+            ) + "[[FIM]]"
+        else:
+            text = f"Individual: {answer_for(prompt)}"
+        response.candidates[0].content.parts[0].text = text
+        return response
+    api_mock.side_effect = fake_api
+
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+    responses = await asyncio.gather(*(orchestrator.generate_response(q, classification) for q in questions))
+
+    assert responses == [
+        "Lote: O que é uma rede neural?", "Lote: O que é overfitting?", "Individual: O que é dropout?"
+    ]
+    assert api_mock.call_count == 2 # Uma chamada em lote + uma individual, em vez de três
+    batching = orchestrator.get_usage_stats()['batching']
+    assert batching == {"enabled": True, "batched_api_calls": 1, "batched_questions": 2, "batch_fallbacks": 1}
+    namespace = orchestrator._cache_namespace("concept")
+    for question, response in zip(questions, responses):
+        assert orchestrator.cache.get_cached_response(question, namespace=namespace) == response
+
+def _stream_response(*texts, error: Exception = None):
+    """Resposta em streaming mockada: produz um trecho por texto e, opcionalmente, falha no fim."""
+    class FakeStream:
+        async def __aiter__(self):
+            for text in texts:
+                chunk = MagicMock()
+                chunk.candidates[0].content.parts[0].text = text
+                yield chunk
+            if error:
+                raise error
+    return FakeStream()
+
+@pytest.mark.asyncio
+async def test_generate_response_stream_yields_chunks_and_caches(orchestrator, mock_google_api, tmp_path):
+    """Testa se o streaming entrega os trechos conforme chegam e armazena a resposta completa no cache."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "stream_cache.json"), ttl_hours=1)
+    api_mock = mock_google_api.return_value.generate_content_async
+    api_mock.return_value = _stream_response("Uma rede neural ", "é um modelo ", "inspirado no cérebro.")
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+    prompt = "O que é uma rede neural?"
+
+    chunks = [chunk async for chunk in orchestrator.generate_response_stream(prompt, classification)]
+    assert chunks == ["Uma rede neural ", "é um modelo ", "inspirado no cérebro."]
+    assert api_mock.call_args.kwargs['stream'] is True
+    namespace = orchestrator._cache_namespace("concept")
+    assert orchestrator.cache.get_cached_response(prompt, namespace=namespace) == "".join(chunks)
+    stats = orchestrator.get_usage_stats()
+    assert stats['streaming']['streamed_responses'] == 1
+    assert stats['api_calls_total'] == 1
+
+    # A segunda vez vem do cache, em um único trecho
+    assert [chunk async for chunk in orchestrator.generate_response_stream(prompt, classification)] == ["".join(chunks)]
+    assert api_mock.call_count == 1
+
+@pytest.mark.asyncio
+async def test_generate_response_stream_yields_chunk_before_next_arrives(orchestrator, mock_google_api, tmp_path):
+    """Testa se cada trecho da resposta real da biblioteca é entregue antes de o seguinte chegar da API."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "stream_lookahead_cache.json"), ttl_hours=1)
+    second_sent = asyncio.Event()
+
+    def proto_chunk(text):
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(content=glm.Content(parts=[glm.Part(text=text)]))])
+
+    async def api_stream():
+        yield proto_chunk("Primeiro trecho. ")
+        await second_sent.wait() # A API só envia o segundo trecho depois que o primeiro chegou ao usuário
+        yield proto_chunk("Segundo trecho.")
+
+    async def fake_api(prompt, stream=False, **kwargs):
+        return await genai.types.AsyncGenerateContentResponse.from_aiterator(api_stream())
+
+    mock_google_api.return_value.generate_content_async.side_effect = fake_api
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+    stream = orchestrator.generate_response_stream("O que é atenção?", classification).__aiter__()
+
+    assert await asyncio.wait_for(stream.__anext__(), timeout=2) == "Primeiro trecho. "
+    second_sent.set()
+    assert [chunk async for chunk in stream] == ["Segundo trecho."]
+
+def test_fallback_namespaces_order_versions_numerically(orchestrator):
+    """Testa se, com mais de 9 versões do template, as anteriores são consultadas da mais recente para a mais antiga."""
+    orchestrator.prompt_builder.templates = {f"v{i}": {} for i in range(1, 13)}
+    orchestrator.prompt_builder.current_version = "v12"
+    expected = [f"concept@v{i}" for i in range(11, 0, -1)] + [None]
+    assert orchestrator._fallback_namespaces("concept") == expected
+
+    orchestrator.prompt_builder.templates = {f"v1.{i}": {} for i in range(12)}
+    orchestrator.prompt_builder.current_version = "v1.11"
+    assert orchestrator._fallback_namespaces("concept")[:3] == ["concept@v1.10", "concept@v1.9", "concept@v1.8"]
+
+@pytest.mark.asyncio
+async def test_generate_response_stream_falls_back_before_first_chunk(orchestrator, mock_google_api, tmp_path):
+    """Testa se uma falha antes do primeiro trecho refaz a chamada sem streaming."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "stream_fallback_cache.json"), ttl_hours=1)
+    api_mock = mock_google_api.return_value.generate_content_async
+    complete_response = api_mock.return_value
+
+    async def fake_api(prompt, stream=False, **kwargs):
+        if stream:
+            raise Exception("Streaming indisponível")
+        return complete_response
+    api_mock.side_effect = fake_api
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+
+    chunks = [chunk async for chunk in orchestrator.generate_response_stream("O que é dropout?", classification)]
+    assert chunks == ["Mocked AI response."]
+    assert api_mock.call_count == 2
+    assert orchestrator._inflight == {}
+
+@pytest.mark.asyncio
+async def test_generate_response_stream_interrupted_is_not_cached(orchestrator, mock_google_api, tmp_path):
+    """Testa se uma falha no meio do stream encerra a resposta com um aviso e não a armazena no cache."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "stream_interrupted_cache.json"), ttl_hours=1)
+    api_mock = mock_google_api.return_value.generate_content_async
+    api_mock.return_value = _stream_response("Começo da resposta", error=Exception("Conexão perdida"))
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+    prompt = "O que é backpropagation?"
+
+    chunks = [chunk async for chunk in orchestrator.generate_response_stream(prompt, classification)]
+    assert chunks[0] == "Começo da resposta"
+    assert "Resposta interrompida" in chunks[-1]
+    assert orchestrator.cache.get_cached_response(prompt, namespace=orchestrator._cache_namespace("concept")) is None
+    assert orchestrator._inflight == {}
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_during_outage(orchestrator, mock_google_api, tmp_path):
+    """Testa se, com a API fora do ar, o circuito abre, as chamadas falham na hora e o alerta segue as transições."""
+    orchestrator.router = None # Sem cascata: as perguntas usam o modelo do agente (gemini-pro)
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "breaker_cache.json"), ttl_hours=1)
+    clock = MagicMock(return_value=1000.0)
+    orchestrator.circuit_breakers["gemini-pro"] = CircuitBreaker(
+        "gemini-pro", failure_threshold=2, recovery_timeout=30,
+        on_state_change=orchestrator._on_circuit_state_change, clock=clock
+    )
+    api_mock = mock_google_api.return_value.generate_content_async
+    healthy_response = api_mock.return_value
+    api_mock.side_effect = Exception("503 Service Unavailable")
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+
+    with patch('utils.free_tier_orchestrator.API_RETRY_MAX_BACKOFF', 0):
+        first = await orchestrator.generate_response("O que é uma rede neural?", classification)
+        assert api_mock.call_count == 2 # A segunda falha abre o circuito: a terceira tentativa nem é feita
+        assert "instável" in first
+        assert orchestrator.alert_system.consecutive_api_failures == 1 # Um alerta por abertura, não por tentativa
+
+        second = await orchestrator.generate_response("O que é dropout?", classification)
+        assert api_mock.call_count == 2 # Falha rápida, sem chamar a API
+        assert "instável" in second
+
+        # Passado o tempo de recuperação, a chamada de teste passa e fecha o circuito
+        clock.return_value += 30
+        api_mock.side_effect = None
+        api_mock.return_value = healthy_response
+        assert await orchestrator.generate_response("O que é overfitting?", classification) == "Mocked AI response."
+    breaker_stats = orchestrator.get_usage_stats()['circuit_breakers']['gemini-pro']
+    assert breaker_stats['state'] == "closed"
+    assert breaker_stats['times_opened'] == 1
+    assert orchestrator.alert_system.consecutive_api_failures == 0
+
+@pytest.mark.asyncio
+async def test_deadline_cancels_hung_api_call(orchestrator, mock_google_api, tmp_path):
+    """Testa se uma chamada travada é cancelada no fim do prazo e o usuário recebe o cache ou uma resposta degradada."""
+    orchestrator.router = None # Sem cascata: as perguntas usam o modelo do agente (gemini-pro)
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "deadline_cache.json"), ttl_hours=1)
+    cancelled = []
+
+    async def hung_api(prompt, **kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(prompt)
+            raise
+    mock_google_api.return_value.generate_content_async.side_effect = hung_api
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+
+    start_time = time.monotonic()
+    response = await orchestrator.generate_response("O que é uma rede neural?", classification, deadline=Deadline(0.1))
+    assert time.monotonic() - start_time < 1.0
+    assert "demorando mais que o esperado" in response
+    assert len(cancelled) == 1
+    assert orchestrator.circuit_breakers["gemini-pro"].consecutive_failures == 0 # O prazo não é falha da API
+    assert orchestrator._inflight == {}
+
+    # Com uma resposta no cache, o fallback a entrega
+    prompt = "O que é dropout?"
+    orchestrator.cache.cache_response(prompt, "Resposta do cache.", category="concept", namespace=orchestrator._cache_namespace("concept"))
+    assert await orchestrator.generate_response(prompt, classification, use_cache=False, deadline=Deadline(0.1)) == "Resposta do cache."
+
+    deadlines = orchestrator.get_usage_stats()['deadlines']
+    assert deadlines['requests'] == 2
+    assert deadlines['exceeded_by_stage'] == {"api": 2}
+    assert 0.05 < deadlines['avg_stage_seconds']['api'] < 0.5
+    assert "queue" in deadlines['avg_stage_seconds']
+
+@pytest.mark.asyncio
+async def test_deadline_gives_up_in_queue_without_spending_quota(orchestrator, mock_google_api, tmp_path):
+    """Testa se, com a cota esgotada além do prazo, a requisição desiste na fila sem chamar a API."""
+    orchestrator.router = None # Sem cascata: as perguntas usam o modelo do agente (gemini-pro)
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "deadline_queue_cache.json"), ttl_hours=1)
+    orchestrator.rate_limiter = RateLimiter({"default": {"rpm": 1, "tpm": 10**6, "rpd": 10**4, "burst": 1}})
+    orchestrator.scheduler = RequestScheduler(orchestrator.rate_limiter)
+    await orchestrator.rate_limiter.acquire("gemini-pro") # Esgota a cota: a próxima só em 60s
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+
+    start_time = time.monotonic()
+    response = await orchestrator.generate_response("O que é overfitting?", classification, deadline=Deadline(5))
+    assert time.monotonic() - start_time < 1.0 # O escalonador sabe que a cota não chega a tempo
+    assert "demorando mais que o esperado" in response
+    assert mock_google_api.return_value.generate_content_async.call_count == 0
+    assert orchestrator.get_usage_stats()['deadlines']['exceeded_by_stage'] == {"queue": 1}
+    assert orchestrator.get_usage_stats()['request_queue']['interactive']['rejected'] == 1
+
+@pytest.mark.asyncio
+async def test_generate_response_stream_respects_deadline(orchestrator, mock_google_api, tmp_path):
+    """Testa se o streaming travado antes do primeiro trecho vira resposta degradada e, no meio, é interrompido."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "stream_deadline_cache.json"), ttl_hours=1)
+    api_mock = mock_google_api.return_value.generate_content_async
+
+    def hung_stream(*texts):
+        class FakeStream:
+            async def __aiter__(self):
+                for text in texts:
+                    chunk = MagicMock()
+                    chunk.candidates[0].content.parts[0].text = text
+                    yield chunk
+                await asyncio.sleep(10)
+        return FakeStream()
+    classification = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+
+    api_mock.side_effect = lambda prompt, **kwargs: hung_stream()
+    chunks = [chunk async for chunk in orchestrator.generate_response_stream("O que é uma CNN?", classification, deadline=Deadline(0.1))]
+    assert len(chunks) == 1 and "demorando mais que o esperado" in chunks[0]
+    assert api_mock.call_count == 1 # Sem tempo para a chamada sem streaming
+
+    api_mock.side_effect = lambda prompt, **kwargs: hung_stream("Uma CNN é ")
+    prompt = "O que é uma RNN?"
+    chunks = [chunk async for chunk in orchestrator.generate_response_stream(prompt, classification, deadline=Deadline(0.1))]
+    assert chunks[0] == "Uma CNN é "
+    assert "Resposta interrompida" in chunks[-1]
+    assert orchestrator.cache.get_cached_response(prompt, namespace=orchestrator._cache_namespace("concept")) is None
+    assert orchestrator.get_usage_stats()['deadlines']['exceeded_by_stage'] == {"api": 2}
+
+def _model_responses(mock_google_api, texts: dict):
+    """Um GenerativeModel mockado por nome de modelo, cada um respondendo o texto dado (None: resposta vazia)."""
+    instances = {}
+    for model_name, text in texts.items():
+        response = MagicMock()
+        response.candidates = [MagicMock()]
+        response.candidates[0].content.parts = [MagicMock(text=text)] if text is not None else []
+        instances[model_name] = MagicMock()
+        instances[model_name].generate_content_async = AsyncMock(return_value=response)
+    mock_google_api.side_effect = lambda model_name, **kwargs: instances[model_name]
+    return instances
+
+@pytest.mark.asyncio
+async def test_cascade_routes_simple_questions_to_light_model(orchestrator, mock_google_api, tmp_path):
+    """Testa se perguntas simples vão para o modelo leve, com cota própria, e código vai para o modelo do agente."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "cascade_cache.json"), ttl_hours=1)
+    light_model = orchestrator.router.light_model
+    instances = _model_responses(mock_google_api, {light_model: "Resposta leve.", "gemini-pro": "Resposta completa."})
+
+    general = {"categories": ["general"], "confidence_score": 0.1, "language": "pt"}
+    code = {"categories": ["code"], "confidence_score": 0.9, "language": "pt"}
+    assert await orchestrator.generate_response("Tudo bem com você?", general) == "Resposta leve."
+    assert await orchestrator.generate_response("Como usar o PyTorch?", code) == "Resposta completa."
+    assert instances[light_model].generate_content_async.call_count == 1
+    assert instances["gemini-pro"].generate_content_async.call_count == 1
+
+    rate_limits = orchestrator.get_usage_stats()['rate_limits']
+    assert rate_limits[light_model]['granted'] == 1 # Cada modelo consome a própria cota
+    assert rate_limits['gemini-pro']['granted'] == 1
+    general_metrics = orchestrator.agent_metrics['GeneralResponder']
+    assert list(general_metrics['models']) == [light_model]
+    assert general_metrics['models'][light_model]['api_calls'] == 1
+    assert general_metrics['escalations'] == 0
+    assert list(orchestrator.agent_metrics['CodeHelper']['models']) == ["gemini-pro"]
+
+@pytest.mark.asyncio
+async def test_rewarm_routes_through_cascade(orchestrator, mock_google_api, tmp_path):
+    """Testa se o re-aquecimento usa o mesmo modelo da cascata que uma pergunta nova usaria."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "cascade_rewarm_cache.json"), ttl_hours=1)
+    light_model = orchestrator.router.light_model
+    old_namespaces = {agent_key: orchestrator._cache_namespace(agent_key) for agent_key in ("general", "code")}
+    orchestrator.cache.cache_response("Olá, tudo bem?", "Oi v1.0.", category="general", namespace=old_namespaces["general"])
+    orchestrator.cache.cache_response("Como implementar uma CNN em PyTorch?", "CNN v1.0.", category="code", namespace=old_namespaces["code"])
+    for agent_key, prompt in (("general", "Olá, tudo bem?"), ("code", "Como implementar uma CNN em PyTorch?")):
+        orchestrator.cache.get_cached_response(prompt, namespace=old_namespaces[agent_key])
+    instances = _model_responses(mock_google_api, {light_model: "Resposta leve.", "gemini-pro": "Resposta completa."})
+
+    with patch('utils.free_tier_orchestrator.CACHE_REWARM_INTERVAL', 0):
+        assert orchestrator.set_prompt_version("v1.1")
+        await asyncio.gather(*list(orchestrator._refresh_tasks))
+
+    assert orchestrator.rewarmed_entries == 2
+    assert orchestrator.cache.get_cached_response("Olá, tudo bem?", namespace=orchestrator._cache_namespace("general")) == "Resposta leve."
+    assert orchestrator.cache.get_cached_response("Como implementar uma CNN em PyTorch?", namespace=orchestrator._cache_namespace("code")) == "Resposta completa."
+    assert instances[light_model].generate_content_async.call_count == 1
+    assert instances["gemini-pro"].generate_content_async.call_count == 1
+
+@pytest.mark.asyncio
+async def test_cascade_escalates_empty_or_blocked_answers(orchestrator, mock_google_api, tmp_path):
+    """Testa se respostas vazias ou bloqueadas do modelo leve sobem para o modelo do agente, e falhas não."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "cascade_escalation_cache.json"), ttl_hours=1)
+    light_model = orchestrator.router.light_model
+    instances = _model_responses(mock_google_api, {light_model: None, "gemini-pro": "Resposta completa."})
+    light_api = instances[light_model].generate_content_async
+    concept = {"categories": ["concept"], "confidence_score": 0.9, "language": "pt"}
+
+    assert await orchestrator.generate_response("O que é uma rede neural?", concept) == "Resposta completa."
+    light_api.side_effect = genai.types.BlockedPromptException("bloqueado")
+    assert await orchestrator.generate_response("O que é dropout?", concept) == "Resposta completa."
+    assert instances["gemini-pro"].generate_content_async.call_count == 2
+    metrics = orchestrator.agent_metrics['ConceptExplainer']
+    assert metrics['escalations'] == 2
+    assert metrics['models']['gemini-pro']['api_calls'] == 2
+
+    # Uma falha da API no modelo leve não gasta a cota do modelo maior: a resposta vem do fallback
+    light_api.side_effect = Exception("503 Service Unavailable")
+    with patch('utils.free_tier_orchestrator.API_RETRY_MAX_BACKOFF', 0):
+        response = await orchestrator.generate_response("O que é overfitting?", concept)
+    assert "Desculpe, não consegui processar sua solicitação" in response
+    assert instances["gemini-pro"].generate_content_async.call_count == 2
+
+    # No streaming, o bloqueio antes do primeiro trecho também sobe de modelo
+    light_api.side_effect = genai.types.BlockedPromptException("bloqueado")
+    chunks = [chunk async for chunk in orchestrator.generate_response_stream("O que é uma CNN?", concept)]
+    assert chunks == ["Resposta completa."]
+    assert metrics['escalations'] == 3
+
+class _FakeTransport:
+    """Cliente assíncrono da API falso: registra a chave de cada chamada e responde 429 para as chaves esgotadas."""
+
+    def __init__(self, key: str, calls: list, exhausted: set):
+        self.key, self.calls, self.exhausted = key, calls, exhausted
+
+    async def generate_content(self, request):
+        self.calls.append(self.key)
+        if self.key in self.exhausted:
+            raise google_exceptions.ResourceExhausted("Quota exceeded for quota metric 'Generate Content API requests per minute'")
+        return glm.GenerateContentResponse(candidates=[
+            glm.Candidate(content=glm.Content(parts=[glm.Part(text=f"Resposta via {self.key}.")]))
+        ])
+
+@pytest.mark.asyncio
+async def test_credential_pool_rotates_keys_and_skips_rate_limited(orchestrator, mock_google_api, tmp_path):
+    """Testa se as chamadas se distribuem entre as chaves e se uma chave com 429 sai do rodízio sem abrir o circuito."""
+    orchestrator.cache = ResponseCache(cache_file=str(tmp_path / "credential_pool_cache.json"), ttl_hours=1)
+    mock_google_api.side_effect = generative_models.GenerativeModel # Modelo real, sobre o transporte falso
+    calls, exhausted = [], set()
+    orchestrator.credentials = CredentialPool(
+        ["chave-a", "chave-b"], {"default": {"rpm": 2, "tpm": 10**6, "rpd": 100}},
+        client_factory=lambda key: _FakeTransport(key, calls, exhausted)
+    )
+    orchestrator.rate_limiter = orchestrator.credentials
+    orchestrator.scheduler = RequestScheduler(orchestrator.rate_limiter)
+    code = {"categories": ["code"], "confidence_score": 0.9, "language": "pt"}
+
+    start_time = time.monotonic()
+    responses = [await orchestrator.generate_response(f"Como usar o PyTorch {i}?", code) for i in range(4)]
+    assert time.monotonic() - start_time < 1.0 # Duas cotas de 2 RPM: nenhuma espera
+    assert calls == ["chave-a", "chave-b", "chave-a", "chave-b"]
+    assert responses[1] == "Resposta via chave-b."
+
+    # A chave b recebe 429: a tentativa seguinte vai para a chave a, sem backoff, e a b sai do rodízio
+    orchestrator.credentials = CredentialPool(
+        ["chave-a", "chave-b"], {"default": {"rpm": 10, "tpm": 10**6, "rpd": 100}},
+        client_factory=lambda key: _FakeTransport(key, calls, exhausted)
+    )
+    orchestrator.rate_limiter = orchestrator.credentials
+    orchestrator.scheduler = RequestScheduler(orchestrator.rate_limiter)
+    orchestrator.models.clear()
+    exhausted.add("chave-b")
+    calls.clear()
+    orchestrator.credentials.try_acquire("gemini-pro") # A chave a fica com menos folga: a próxima chamada vai para a b
+    assert await orchestrator.generate_response("Como usar o TensorFlow?", code) == "Resposta via chave-a."
+    assert await orchestrator.generate_response("Como usar o JAX?", code) == "Resposta via chave-a."
+    assert calls == ["chave-b", "chave-a", "chave-a"]
+    key_stats = orchestrator.get_usage_stats()['api_keys']
+    assert key_stats['chave-2']['available'] is False
+    assert key_stats['chave-2']['rate_limited'] == 1
+    assert key_stats['chave-1']['available'] is True
+    assert orchestrator.circuit_breakers["gemini-pro"].consecutive_failures == 0
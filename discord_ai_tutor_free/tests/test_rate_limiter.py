@@ -0,0 +1,96 @@
+import pytest
+import time
+
+from utils.rate_limiter import RateLimiter, RateLimitExceeded, TokenBucket, estimate_tokens
+
+class FakeClock:
+    """Relógio controlado pelo teste."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_token_bucket_burst_and_refill():
+    """Testa se o balde permite rajada até a capacidade e repõe tokens com o tempo."""
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=3, refill_per_second=1, clock=clock)
+    for _ in range(3):
+        assert bucket.wait_time(1) == 0
+        bucket.take(1)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    clock.now += 10
+    bucket.wait_time(1)
+    assert bucket.tokens == 3 # Nunca passa da capacidade
+
+def test_token_bucket_debt_from_usage_correction():
+    """Testa se consumo acima do reservado deixa o balde devendo."""
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=100, refill_per_second=10, clock=clock)
+    bucket.take(150)
+    assert bucket.wait_time(10) == pytest.approx(6.0) # 50 de dívida + 10 pedidos, a 10 por segundo
+
+@pytest.mark.asyncio
+async def test_rate_limiter_burst_goes_out_immediately():
+    """Testa se requisições dentro da cota não esperam."""
+    limiter = RateLimiter({"default": {"rpm": 5, "tpm": 10000, "rpd": 100}})
+    start = time.monotonic()
+    for _ in range(5):
+        assert await limiter.acquire("gemini-pro", tokens=100) == pytest.approx(0, abs=0.01)
+    assert time.monotonic() - start < 0.1
+    assert limiter.get_stats()["gemini-pro"]["granted"] == 5
+
+@pytest.mark.asyncio
+async def test_rate_limiter_waits_for_refill():
+    """Testa se, com a cota de RPM esgotada, a requisição espera apenas a reposição."""
+    limiter = RateLimiter({"default": {"rpm": 600, "tpm": 10000, "rpd": 100, "burst": 1}}) # 1 a cada 100ms
+    await limiter.acquire("gemini-pro")
+    waited = await limiter.acquire("gemini-pro")
+    assert 0.05 < waited < 0.5
+
+@pytest.mark.asyncio
+async def test_rate_limiter_tpm_quota():
+    """Testa se a cota de tokens por minuto limita requisições grandes."""
+    limiter = RateLimiter({"default": {"rpm": 100, "tpm": 1000, "rpd": 100}})
+    await limiter.acquire("gemini-pro", tokens=1000)
+    with pytest.raises(RateLimitExceeded):
+        await limiter.acquire("gemini-pro", tokens=500, deadline=time.monotonic() + 1) # Reposição leva 30s
+
+@pytest.mark.asyncio
+async def test_rate_limiter_deadline_does_not_consume_quota():
+    """Testa se uma requisição recusada pelo prazo não consome a cota."""
+    limiter = RateLimiter({"default": {"rpm": 60, "tpm": 10000, "rpd": 2}})
+    await limiter.acquire("gemini-pro")
+    await limiter.acquire("gemini-pro")
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        await limiter.acquire("gemini-pro", deadline=time.monotonic() + 0.1) # Cota diária esgotada
+    assert excinfo.value.wait_seconds > 0
+    stats = limiter.get_stats()["gemini-pro"]
+    assert stats["granted"] == 2
+    assert stats["rejected"] == 1
+
+@pytest.mark.asyncio
+async def test_rate_limiter_quotas_per_model():
+    """Testa se cada modelo tem sua própria cota e modelos não listados usam a 'default'."""
+    limiter = RateLimiter({
+        "default": {"rpm": 1, "tpm": 10000, "rpd": 100},
+        "gemini-pro": {"rpm": 10, "tpm": 10000, "rpd": 100},
+    })
+    for _ in range(5):
+        await limiter.acquire("gemini-pro")
+    await limiter.acquire("outro-modelo")
+    with pytest.raises(RateLimitExceeded):
+        await limiter.acquire("outro-modelo", deadline=time.monotonic() + 0.1)
+
+def test_rate_limiter_requires_quota():
+    """Testa se um modelo sem cota (e sem 'default') é rejeitado."""
+    limiter = RateLimiter({"gemini-pro": {"rpm": 10, "tpm": 10000, "rpd": 100}})
+    with pytest.raises(ValueError):
+        limiter._get_limiter("outro-modelo")
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("a" * 400) == 100
@@ -0,0 +1,98 @@
+import pytest
+import asyncio
+import time
+
+from utils.rate_limiter import RateLimiter, RateLimitExceeded
+from utils.request_scheduler import RequestScheduler, Priority
+
+def _limiter(rpm: int) -> RateLimiter:
+    """Limitador sem rajada: uma requisição a cada 60/rpm segundos."""
+    return RateLimiter({"default": {"rpm": rpm, "tpm": 10**6, "rpd": 10**4, "burst": 1}})
+
+async def _enqueue(scheduler: RequestScheduler, priorities, order: list, **kwargs) -> list:
+    """Enfileira as requisições na ordem dada e registra a ordem em que recebem a cota."""
+    async def request(name, priority):
+        await scheduler.acquire("gemini-pro", priority=priority, **kwargs)
+        order.append(name)
+    tasks = []
+    for name, priority in priorities:
+        tasks.append(asyncio.create_task(request(name, priority)))
+        await asyncio.sleep(0) # Garante a ordem de chegada na fila
+    return tasks
+
+@pytest.mark.asyncio
+async def test_scheduler_within_quota_does_not_wait():
+    """Testa se, com cota disponível, as requisições saem na hora independentemente da prioridade."""
+    scheduler = RequestScheduler(RateLimiter({"default": {"rpm": 10, "tpm": 10**6, "rpd": 100}}))
+    start = time.monotonic()
+    for priority in (Priority.BACKGROUND, Priority.ADMIN, Priority.INTERACTIVE):
+        assert await scheduler.acquire("gemini-pro", priority=priority) == pytest.approx(0, abs=0.01)
+    assert time.monotonic() - start < 0.1
+    assert scheduler.rate_limiter.get_stats()["gemini-pro"]["granted"] == 3
+
+@pytest.mark.asyncio
+async def test_scheduler_serves_higher_priority_first():
+    """Testa se, com a cota esgotada, usuários passam na frente de comandos administrativos e do background."""
+    scheduler = RequestScheduler(_limiter(rpm=1200)) # Uma requisição a cada 50ms
+    await scheduler.acquire("gemini-pro") # Esgota a rajada
+    order = []
+    tasks = await _enqueue(scheduler, [
+        ("refresh-1", Priority.BACKGROUND), ("refresh-2", Priority.BACKGROUND),
+        ("test-api", Priority.ADMIN), ("usuario", Priority.INTERACTIVE),
+    ], order)
+    await asyncio.gather(*tasks)
+    assert order == ["usuario", "test-api", "refresh-1", "refresh-2"]
+
+    stats = scheduler.get_stats()
+    assert stats["background"]["dispatched"] == 2
+    assert stats["background"]["max_queued"] == 2
+    assert stats["background"]["queued"] == 0
+    assert stats["background"]["avg_wait_seconds"] > stats["interactive"]["avg_wait_seconds"]
+
+@pytest.mark.asyncio
+async def test_scheduler_aging_prevents_starvation():
+    """Testa se uma requisição de background que esperou o bastante passa na frente de um usuário recém-chegado."""
+    scheduler = RequestScheduler(_limiter(rpm=600), aging_seconds=0.02) # Cota a cada 100ms
+    await scheduler.acquire("gemini-pro")
+    order = []
+    tasks = await _enqueue(scheduler, [("refresh", Priority.BACKGROUND)], order)
+    await asyncio.sleep(0.08)
+    tasks += await _enqueue(scheduler, [("usuario", Priority.INTERACTIVE)], order)
+    await asyncio.gather(*tasks)
+    assert order == ["refresh", "usuario"]
+
+@pytest.mark.asyncio
+async def test_scheduler_deadline_rejects_without_blocking_queue():
+    """Testa se uma requisição que perde o prazo é recusada, contabilizada e não trava a fila."""
+    scheduler = RequestScheduler(_limiter(rpm=600))
+    await scheduler.acquire("gemini-pro")
+    order = []
+    tasks = await _enqueue(scheduler, [("usuario", Priority.INTERACTIVE)], order)
+    with pytest.raises(RateLimitExceeded):
+        # Atrás do usuário na fila: a cota só chegaria depois do prazo
+        await scheduler.acquire("gemini-pro", priority=Priority.BACKGROUND, deadline=time.monotonic() + 0.05)
+    await asyncio.gather(*tasks)
+    assert order == ["usuario"]
+
+    stats = scheduler.get_stats()
+    assert stats["background"]["rejected"] == 1
+    assert stats["background"]["dispatched"] == 0
+    assert stats["background"]["queued"] == 0
+    assert scheduler.rate_limiter.get_stats()["gemini-pro"]["granted"] == 2 # A recusa não consumiu a cota
+
+@pytest.mark.asyncio
+async def test_scheduler_queues_are_per_model():
+    """Testa se a fila de um modelo sem cota não atrasa outro modelo."""
+    scheduler = RequestScheduler(RateLimiter({
+        "default": {"rpm": 10, "tpm": 10**6, "rpd": 100},
+        "gemini-pro": {"rpm": 1, "tpm": 10**6, "rpd": 100},
+    }))
+    await scheduler.acquire("gemini-pro")
+    blocked = asyncio.create_task(scheduler.acquire("gemini-pro"))
+    await asyncio.sleep(0)
+    assert await scheduler.acquire("outro-modelo") == pytest.approx(0, abs=0.01)
+    assert scheduler.get_stats()["interactive"]["queued"] == 1
+    blocked.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await blocked
+    assert scheduler.get_stats()["interactive"]["queued"] == 0
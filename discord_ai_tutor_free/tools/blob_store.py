@@ -0,0 +1,223 @@
+import fcntl
+import mmap
+import os
+import threading
+import zlib
+import logging
+from typing import Optional, Dict, Iterable, Tuple, Callable
+
+logger = logging.getLogger(__name__)
+
+class BlobStore:
+    """
+    Arquivo binário append-only com os blobs das respostas comprimidas.
+
+    O índice do cache guarda apenas (offset, tamanho, crc32) de cada blob; os
+    bytes são lidos sob demanda de um mmap do arquivo, sem conversão hex e sem
+    materializar as respostas na inicialização.
+
+    O arquivo pode ser compartilhado entre processos: as escritas usam um lock
+    consultivo (fcntl) e o offset real do fim do arquivo, e um arquivo substituído
+    por outro processo (compactação) é reaberto antes de ler ou escrever.
+
+    Um blob anexado só entra no índice compartilhado quando a entrada é persistida
+    (com write-behind, segundos depois). Por isso cada processo mantém um lock
+    compartilhado em `<arquivo>.pending` do primeiro append até `release_pending()`,
+    chamado quando não há mais entradas pendentes; a compactação exige esse lock em
+    modo exclusivo e é adiada enquanto outro processo tiver blobs ainda fora do índice.
+    """
+
+    def __init__(self, blob_file: str, compaction_ratio: float = 0.5, min_compaction_bytes: int = 1024 * 1024):
+        self.blob_file = blob_file
+        self.compaction_ratio = compaction_ratio # Fração de bytes mortos que dispara a compactação
+        self.min_compaction_bytes = min_compaction_bytes # Evita compactar arquivos pequenos
+        self.dead_bytes = 0 # Bytes de blobs que não pertencem mais a nenhuma entrada
+        self.compactions = 0
+        self._lock = threading.RLock()
+        self._fh = open(blob_file, 'a+b')
+        self._fh.seek(0, os.SEEK_END)
+        self._size = self._fh.tell()
+        self._mmap: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+        self._pending_fh = open(blob_file + ".pending", 'a+b')
+        self._pending_held = False # Lock compartilhado de blobs ainda não persistidos no índice
+        self.skipped_compactions = 0 # Compactações adiadas por escritas pendentes de outros processos
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def dead_ratio(self) -> float:
+        return (self.dead_bytes / self._size) if self._size > 0 else 0.0
+
+    def needs_compaction(self) -> bool:
+        return self._size >= self.min_compaction_bytes and self.dead_ratio >= self.compaction_ratio
+
+    def _reopen_if_replaced(self) -> bool:
+        """Reabre o arquivo se outro processo o substituiu (ex: compactação). Retorna True se reabriu."""
+        try:
+            replaced = os.stat(self.blob_file).st_ino != os.fstat(self._fh.fileno()).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            self._mapped_size = 0
+            self._fh.close()
+            self._fh = open(self.blob_file, 'a+b')
+            self._size = os.fstat(self._fh.fileno()).st_size
+            self.dead_bytes = 0
+            logger.info(f"Arquivo de blobs {self.blob_file} substituído por outro processo. Reaberto.")
+        return replaced
+
+    def append(self, data: bytes) -> Tuple[int, int, int]:
+        """
+        Anexa um blob e retorna (offset, tamanho, crc32). O blob fica protegido da compactação
+        de outros processos até `release_pending()`, depois que a entrada for persistida.
+        """
+        with self._lock:
+            if not self._pending_held:
+                fcntl.flock(self._pending_fh.fileno(), fcntl.LOCK_SH) # Antes do append: aguarda uma compactação em andamento
+                self._pending_held = True
+            while True:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+                if not self._reopen_if_replaced():
+                    break
+            try:
+                # Outros processos podem ter anexado blobs: o offset é o fim real do arquivo
+                offset = self._fh.seek(0, os.SEEK_END)
+                self._fh.write(data)
+                self._fh.flush()
+                self._size = offset + len(data)
+            finally:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        return offset, len(data), zlib.crc32(data)
+
+    def _remap(self):
+        """Remapeia o arquivo depois que ele cresceu além da região mapeada."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._mapped_size = self._size
+        if self._size > 0:
+            self._mmap = mmap.mmap(self._fh.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    def read(self, offset: int, length: int, crc: Optional[int] = None) -> Optional[bytes]:
+        """Lê um blob do mmap. Retorna None se estiver fora do arquivo ou com CRC divergente."""
+        with self._lock:
+            data = self._read_mapped(offset, length)
+            if (data is None or (crc is not None and zlib.crc32(data) != crc)) and self._reopen_if_replaced():
+                data = self._read_mapped(offset, length) # O offset pode ser do arquivo compactado por outro processo
+        if data is None or (crc is not None and zlib.crc32(data) != crc):
+            return None
+        return data
+
+    def _read_mapped(self, offset: int, length: int) -> Optional[bytes]:
+        if offset + length > self._size:
+            self._size = os.fstat(self._fh.fileno()).st_size # Blobs anexados por outros processos
+            if offset + length > self._size:
+                return None
+        if offset + length > self._mapped_size:
+            self._remap()
+        return self._mmap[offset:offset + length] if length > 0 else b''
+
+    def release_pending(self):
+        """Indica que todos os blobs anexados por esta instância já estão no índice persistido."""
+        with self._lock:
+            if self._pending_held:
+                fcntl.flock(self._pending_fh.fileno(), fcntl.LOCK_UN)
+                self._pending_held = False
+
+    def release(self, length: int):
+        """Contabiliza um blob que deixou de ser referenciado."""
+        with self._lock:
+            self.dead_bytes += length
+
+    def rewrite(self, collect_live: Callable[[], Iterable[Tuple[int, int]]]) -> Optional[Dict[int, int]]:
+        """
+        Reescreve o arquivo apenas com os blobs vivos (offset, tamanho). `collect_live` é chamada
+        com os locks do arquivo já obtidos, então nenhum processo anexa blobs entre a leitura do
+        índice e a substituição. Retorna o mapeamento offset antigo -> offset novo, ou None se
+        outro processo tem blobs ainda não persistidos no índice (a compactação é adiada).
+        """
+        with self._lock:
+            pending_fd = self._pending_fh.fileno()
+            try:
+                fcntl.flock(pending_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if self._pending_held:
+                    fcntl.flock(pending_fd, fcntl.LOCK_SH) # A conversão que falhou libera o lock compartilhado
+                self.skipped_compactions += 1
+                logger.debug(f"Compactação de {self.blob_file} adiada: outro processo tem blobs ainda não persistidos.")
+                return None
+            try:
+                return self._rewrite_locked(collect_live)
+            finally:
+                fcntl.flock(pending_fd, fcntl.LOCK_SH if self._pending_held else fcntl.LOCK_UN)
+
+    def _rewrite_locked(self, collect_live: Callable[[], Iterable[Tuple[int, int]]]) -> Dict[int, int]:
+        self._reopen_if_replaced()
+        temp_file = self.blob_file + ".compact"
+        relocations: Dict[int, int] = {}
+        fd = self._fh.fileno()
+        fcntl.flock(fd, fcntl.LOCK_EX) # Bloqueia escritas de outros processos até a substituição
+        try:
+            with open(temp_file, 'wb') as out:
+                new_offset = 0
+                for offset, length in sorted(set(collect_live())):
+                    out.write(os.pread(fd, length, offset))
+                    relocations[offset] = new_offset
+                    new_offset += length
+                out.flush()
+                os.fsync(out.fileno())
+        except Exception:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        before = self._size
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._mapped_size = 0
+        os.replace(temp_file, self.blob_file)
+        self._fh.close() # Libera o lock; quem aguardava detecta a substituição e reabre
+        self._fh = open(self.blob_file, 'a+b')
+        self._size = new_offset
+        self.dead_bytes = 0
+        self.compactions += 1
+        logger.info(f"Arquivo de blobs compactado: {before} -> {new_offset} bytes.")
+        return relocations
+
+    def truncate(self):
+        """
+        Descarta todos os blobs. O arquivo é substituído por um vazio (e não truncado no lugar),
+        para que mmaps de outros processos sobre o arquivo antigo continuem válidos.
+        """
+        with self._lock:
+            self._reopen_if_replaced()
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            self._mapped_size = 0
+            temp_file = self.blob_file + ".compact"
+            open(temp_file, 'wb').close()
+            os.replace(temp_file, self.blob_file)
+            self._fh.close()
+            self._fh = open(self.blob_file, 'a+b')
+            self._size = 0
+            self.dead_bytes = 0
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if not self._fh.closed:
+                self._fh.close()
+            if not self._pending_fh.closed:
+                self._pending_fh.close() # Libera também o lock de blobs pendentes
+            self._pending_held = False
@@ -0,0 +1,486 @@
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import logging
+from typing import Optional, Dict, Any, Callable, Iterable, Iterator, List, Tuple
+
+from tools.cache_log import CacheLog
+
+logger = logging.getLogger(__name__)
+
+# Um registro é (chave, entrada); entrada None representa a remoção da chave
+CacheRecord = Tuple[str, Optional[Dict[str, Any]]]
+# Instante (time.time()) a partir do qual a entrada pode ser removida do armazenamento
+RemovalTime = Callable[[Dict[str, Any]], float]
+
+def _never_removed(entry: Dict[str, Any]) -> float:
+    """Sem função de remoção informada, nenhuma entrada sai pela faixa de expiração (só pela chave)."""
+    return float('inf')
+
+class CacheBackend:
+    """
+    Interface de armazenamento persistente usada pelo ResponseCache.
+
+    Backends com `preload = True` são carregados inteiros em memória na
+    inicialização (o ResponseCache passa a ser a fonte da verdade). Backends
+    com `preload = False` são consultados sob demanda.
+
+    Backends com `shared = True` podem ser usados por vários processos ao mesmo
+    tempo e publicam avisos de invalidação das chaves alteradas por cada um.
+    """
+    name = "base"
+    preload = True
+    shared = False
+
+    def load_all(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Itera sobre todas as entradas persistidas."""
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Retorna a entrada persistida para a chave, ou None."""
+        raise NotImplementedError
+
+    def write_batch(self, records: List[CacheRecord]):
+        """Persiste um lote de escritas e remoções. Levanta exceção em caso de falha."""
+        raise NotImplementedError
+
+    def delete_expired(self, now: float, keys: Iterable[str] = ()) -> int:
+        """
+        Remove, em uma única operação, as entradas cujo instante de remoção (`removal_time`,
+        informado na criação do backend) já chegou (`<= now`) e as chaves em `keys` (já
+        sabidamente expiradas). Retorna o número de entradas removidas.
+        """
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def latest_invalidation(self) -> int:
+        """Posição atual da sequência de avisos de invalidação."""
+        return 0
+
+    def invalidations_since(self, seq: int) -> Tuple[int, Optional[List[str]]]:
+        """
+        Retorna (nova posição, chaves alteradas por outros processos depois de `seq`).
+        Chaves None indicam que todo o cache em memória deve ser descartado (limpeza
+        do cache ou avisos já removidos).
+        """
+        return seq, []
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas específicas do backend, incluídas em ResponseCache.get_stats()."""
+        return {}
+
+    def close(self):
+        pass
+
+class JsonCacheBackend(CacheBackend):
+    """
+    Backend original: um único arquivo JSON reescrito por inteiro a cada persistência.
+
+    Cada escrita vai para um arquivo temporário, recebe fsync e substitui o arquivo
+    com os.replace, então uma queda no meio da escrita nunca deixa um JSON truncado.
+    Escritores de processos diferentes (ex: o bot e `main.py clear-cache`) são
+    serializados por um lock consultivo (fcntl) em `<arquivo>.lock`, e as alterações
+    de cada um são aplicadas sobre a versão mais recente do arquivo.
+    """
+    name = "json"
+    preload = True
+
+    def __init__(self, cache_file: str, removal_time: RemovalTime = _never_removed):
+        self.cache_file = cache_file
+        self.removal_time = removal_time
+        self.lock_file = cache_file + ".lock"
+        self.data: Dict[str, Dict[str, Any]] = {}
+        self._disk_signature: Optional[Tuple[int, int, int]] = None # Versão do arquivo que self.data reflete
+
+    def load_all(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Carrega o cache do arquivo JSON."""
+        self.data = {}
+        if os.path.exists(self.cache_file):
+            try:
+                self.data = self._read_file()
+                logger.info(f"Cache carregado de {self.cache_file}. Total de entradas: {len(self.data)}")
+            except json.JSONDecodeError as e:
+                logger.error(f"Erro ao decodificar JSON do cache: {e}. Iniciando com cache vazio.")
+            except Exception as e:
+                logger.error(f"Erro ao carregar cache: {e}. Iniciando com cache vazio.")
+        else:
+            logger.info(f"Arquivo de cache {self.cache_file} não encontrado. Iniciando com cache vazio.")
+        return iter(list(self.data.items()))
+
+    def _read_file(self) -> Dict[str, Dict[str, Any]]:
+        signature = self._file_signature()
+        with open(self.cache_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self._disk_signature = signature
+        return data
+
+    def _file_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.cache_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _file_lock(self):
+        """Lock consultivo exclusivo entre processos para as escritas no arquivo."""
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _refresh_from_disk(self):
+        """Recarrega o arquivo se outro processo o gravou depois da nossa última leitura ou escrita."""
+        if self._file_signature() in (None, self._disk_signature):
+            return
+        try:
+            self.data = self._read_file()
+            logger.debug(f"Cache {self.cache_file} alterado por outro processo. Alterações aplicadas sobre a versão atual.")
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Erro ao recarregar o cache alterado por outro processo: {e}. Mantendo a versão em memória.")
+
+    def _save(self):
+        """Salva o cache no arquivo JSON de forma atômica (arquivo temporário + fsync + os.replace)."""
+        temp_file = self.cache_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.cache_file)
+        self._disk_signature = self._file_signature()
+        logger.debug(f"Cache salvo em {self.cache_file}. Total de entradas: {len(self.data)}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.data.get(key)
+
+    def write_batch(self, records: List[CacheRecord]):
+        with self._file_lock():
+            self._refresh_from_disk()
+            for key, entry in records:
+                if entry is None:
+                    self.data.pop(key, None)
+                else:
+                    self.data[key] = entry
+            self._save()
+
+    def delete_expired(self, now: float, keys: Iterable[str] = ()) -> int:
+        expired = {key for key, entry in self.data.items() if self.removal_time(entry) <= now}
+        expired.update(key for key in keys if key in self.data)
+        if expired:
+            self.write_batch([(key, None) for key in expired])
+        return len(expired)
+
+    def count(self) -> int:
+        return len(self.data)
+
+    def clear(self):
+        with self._file_lock():
+            self.data = {}
+            self._save()
+
+class LogCacheBackend(CacheBackend):
+    """Backend de log append-only (ver tools/cache_log.py)."""
+    name = "log"
+    preload = True
+
+    def __init__(self, log_file: str, compaction_ratio: float = 0.5, removal_time: RemovalTime = _never_removed):
+        self.log_file = log_file
+        self.compaction_ratio = compaction_ratio
+        self.removal_time = removal_time
+        self.log: Optional[CacheLog] = None
+
+    def load_all(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Reproduz o log append-only, carregando apenas as entradas vivas."""
+        if self.log is None:
+            self.log = CacheLog(self.log_file, compaction_ratio=self.compaction_ratio)
+        else:
+            self.log.reload()
+        return self.log.items()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.log.read(key)
+
+    def write_batch(self, records: List[CacheRecord]):
+        self.log.append_batch(records)
+
+    def delete_expired(self, now: float, keys: Iterable[str] = ()) -> int:
+        expired = {key for key, entry in self.log.items() if self.removal_time(entry) <= now}
+        expired.update(key for key in keys if key in self.log.index)
+        self.log.append_batch([(key, None) for key in expired])
+        return len(expired)
+
+    def count(self) -> int:
+        return len(self.log)
+
+    def clear(self):
+        self.log.truncate()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "log_records": self.log.total_records,
+            "log_dead_ratio": round(self.log.dead_ratio, 2),
+            "log_compactions": self.log.compactions
+        }
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    Backend SQLite em modo WAL. O hash da pergunta é a chave primária e o instante
+    de remoção de cada entrada (`expires_at`: timestamp + TTL da entrada + janela de
+    tolerância, calculado por `removal_time` na escrita) tem índice próprio, então a
+    expiração é uma única remoção por faixa, mesmo para entradas que nenhum processo
+    tem em memória. As entradas são consultadas sob demanda, sem carregar o corpus em memória.
+
+    O arquivo é o cache compartilhado (L2) entre o bot, a CLI e o dashboard: cada
+    escrita registra, na mesma transação, as chaves alteradas na tabela
+    `cache_invalidations`, que os demais processos consultam para descartar as
+    cópias desatualizadas do seu cache em memória (L1).
+    """
+    name = "sqlite"
+    preload = False
+    shared = True
+
+    def __init__(self, db_file: str, invalidation_retention: float = 600.0, removal_time: RemovalTime = _never_removed):
+        self.db_file = db_file
+        self.removal_time = removal_time
+        self.origin = uuid.uuid4().hex # Identifica os avisos publicados por esta instância
+        self.invalidation_retention = invalidation_retention # Segundos que um aviso fica disponível
+        self._lock = threading.Lock() # A conexão é compartilhada com a thread de flush
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "key TEXT PRIMARY KEY, "
+            "timestamp REAL NOT NULL, "
+            "entry TEXT NOT NULL, "
+            "expires_at REAL)"
+        )
+        self._migrate_expires_at()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_expires_at ON cache_entries (expires_at)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_invalidations ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "key TEXT NOT NULL, "
+            "origin TEXT NOT NULL, "
+            "timestamp REAL NOT NULL)"
+        )
+        logger.info(f"Backend SQLite do cache aberto em {db_file}.")
+
+    def _migrate_expires_at(self):
+        """Adiciona a coluna expires_at a bancos criados antes dela, preenchendo-a a partir de cada entrada."""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(cache_entries)")}
+        if "expires_at" in columns:
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("ALTER TABLE cache_entries ADD COLUMN expires_at REAL")
+            rows = self.conn.execute("SELECT key, entry FROM cache_entries").fetchall()
+            self.conn.executemany(
+                "UPDATE cache_entries SET expires_at = ? WHERE key = ?",
+                [(self.removal_time(json.loads(entry)), key) for key, entry in rows]
+            )
+            self.conn.execute("DROP INDEX IF EXISTS idx_cache_entries_timestamp")
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Backend SQLite do cache: coluna expires_at adicionada a {len(rows)} entradas em {self.db_file}.")
+
+    def load_all(self, batch_size: int = 500) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Itera sobre todas as entradas em lotes ordenados pela chave, sem materializar a tabela."""
+        last_key = ""
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT key, entry FROM cache_entries WHERE key > ? ORDER BY key LIMIT ?", (last_key, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for key, entry in rows:
+                yield key, json.loads(entry)
+            last_key = rows[-1][0]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute("SELECT entry FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_batch(self, records: List[CacheRecord]):
+        upserts = [
+            (key, entry['timestamp'], self.removal_time(entry), json.dumps(entry, ensure_ascii=False, separators=(',', ':')))
+            for key, entry in records if entry is not None
+        ]
+        deletes = [(key,) for key, entry in records if entry is None]
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                if upserts:
+                    self.conn.executemany("INSERT OR REPLACE INTO cache_entries (key, timestamp, expires_at, entry) VALUES (?, ?, ?, ?)", upserts)
+                if deletes:
+                    self.conn.executemany("DELETE FROM cache_entries WHERE key = ?", deletes)
+                self._publish_invalidations([key for key, _ in records])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def delete_expired(self, now: float, keys: Iterable[str] = ()) -> int:
+        """
+        Remove só pela coluna expires_at: as chaves em `keys` expiradas estão na faixa, e uma chave
+        que outro processo regravou depois da expiração vista por este processo continua fora dela.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE") # A leitura das chaves e a remoção veem o mesmo estado
+            try:
+                expired = [row[0] for row in self.conn.execute("SELECT key FROM cache_entries WHERE expires_at <= ?", (now,))]
+                if expired:
+                    self.conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+                    self._publish_invalidations(expired) # Outros processos descartam as cópias em memória
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(expired)
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM cache_entries")
+                self._publish_invalidations(["*"]) # Todos os processos descartam o cache em memória
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _publish_invalidations(self, keys: List[str]):
+        """Registra as chaves alteradas (dentro da transação corrente) e remove avisos antigos."""
+        if not keys:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO cache_invalidations (key, origin, timestamp) VALUES (?, ?, ?)",
+            [(key, self.origin, now) for key in keys]
+        )
+        self.conn.execute("DELETE FROM cache_invalidations WHERE timestamp < ?", (now - self.invalidation_retention,))
+
+    def latest_invalidation(self) -> int:
+        with self._lock:
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cache_invalidations'").fetchone()
+        return row[0] if row else 0
+
+    def invalidations_since(self, seq: int) -> Tuple[int, Optional[List[str]]]:
+        with self._lock:
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cache_invalidations'").fetchone()
+            latest = row[0] if row else 0
+            if latest <= seq:
+                return seq, []
+            oldest = self.conn.execute("SELECT MIN(seq) FROM cache_invalidations").fetchone()[0]
+            if oldest is None or oldest > seq + 1:
+                return latest, None # Avisos removidos antes de serem lidos: não há como saber o que mudou
+            rows = self.conn.execute(
+                "SELECT key FROM cache_invalidations WHERE seq > ? AND seq <= ? AND origin != ?",
+                (seq, latest, self.origin)
+            ).fetchall()
+        keys = [key for (key,) in rows]
+        return latest, (None if "*" in keys else keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"invalidation_seq": self.latest_invalidation()}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+def create_backend(storage: str, cache_file: str, compaction_ratio: float = 0.5,
+                   removal_time: RemovalTime = _never_removed) -> CacheBackend:
+    """Instancia o backend de cache pelo nome ('json', 'log' ou 'sqlite')."""
+    if storage == "json":
+        return JsonCacheBackend(cache_file, removal_time=removal_time)
+    if storage == "log":
+        return LogCacheBackend(cache_file, compaction_ratio=compaction_ratio, removal_time=removal_time)
+    if storage == "sqlite":
+        return SqliteCacheBackend(cache_file, removal_time=removal_time)
+    raise ValueError(f"Tipo de armazenamento de cache desconhecido: '{storage}'. Use 'json', 'log' ou 'sqlite'.")
+
+def iter_json_cache_file(cache_file: str, chunk_size: int = 65536) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Lê um response_cache.json entrada por entrada, sem carregar o documento inteiro.
+    Usado pela migração para outros backends.
+    """
+    decoder = json.JSONDecoder()
+    with open(cache_file, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def skip_whitespace():
+            nonlocal buffer, pos, eof
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+
+        def decode_value():
+            nonlocal buffer, pos, eof
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    if end == len(buffer) and not eof:
+                        raise ValueError("valor pode continuar no próximo bloco")
+                    pos = end
+                    return value
+                except ValueError:
+                    if eof:
+                        raise
+                    chunk = f.read(chunk_size)
+                    eof = not chunk
+                    buffer, pos = buffer[pos:] + chunk, 0
+
+        def expect(char: str):
+            nonlocal pos
+            skip_whitespace()
+            if pos >= len(buffer) or buffer[pos] != char:
+                raise ValueError(f"JSON de cache inválido: esperado '{char}' em {cache_file}")
+            pos += 1
+
+        expect('{')
+        skip_whitespace()
+        if pos < len(buffer) and buffer[pos] == '}':
+            return
+        while True:
+            skip_whitespace()
+            key = decode_value()
+            expect(':')
+            skip_whitespace()
+            entry = decode_value()
+            yield key, entry
+            skip_whitespace()
+            if pos < len(buffer) and buffer[pos] == ',':
+                pos += 1
+                continue
+            expect('}')
+            return
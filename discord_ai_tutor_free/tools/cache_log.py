@@ -0,0 +1,203 @@
+import json
+import os
+import struct
+import threading
+import zlib
+import logging
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+OP_SET = 1
+OP_DELETE = 2
+
+class CacheLog:
+    """
+    Log append-only de registros do cache.
+
+    Cada registro é um frame com cabeçalho fixo (operação, tamanho da chave,
+    tamanho do valor, CRC32) seguido da chave e do valor em JSON. Um índice
+    em memória mapeia cada chave viva para o offset do seu último registro,
+    e é reconstruído a partir do log na inicialização.
+    """
+    HEADER = struct.Struct('>BHII') # op, tamanho da chave, tamanho do valor, crc32
+
+    def __init__(self, log_file: str, compaction_ratio: float = 0.5, min_compaction_records: int = 100):
+        self.log_file = log_file
+        self.compaction_ratio = compaction_ratio # Fração de registros mortos que dispara a compactação
+        self.min_compaction_records = min_compaction_records # Evita compactar logs pequenos
+        self.index: Dict[str, Tuple[int, int]] = {} # chave -> (offset do frame, tamanho do frame)
+        self.total_records = 0
+        self.dead_records = 0
+        self.compactions = 0
+        self._lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._fh = None
+        self._open()
+
+    def _open(self):
+        """Abre o log para append e reconstrói o índice de offsets."""
+        self._fh = open(self.log_file, 'a+b')
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        """Percorre o log sequencialmente, reconstruindo o índice e truncando um final corrompido."""
+        self.index = {}
+        self.total_records = 0
+        self.dead_records = 0
+        self._fh.seek(0)
+        offset = 0
+        while True:
+            header = self._fh.read(self.HEADER.size)
+            if not header:
+                break
+            if len(header) < self.HEADER.size:
+                self._truncate_tail(offset, "cabeçalho incompleto")
+                break
+            op, key_len, value_len, crc = self.HEADER.unpack(header)
+            body = self._fh.read(key_len + value_len)
+            if len(body) < key_len + value_len or zlib.crc32(body) != crc or op not in (OP_SET, OP_DELETE):
+                self._truncate_tail(offset, "registro corrompido")
+                break
+            key = body[:key_len].decode('utf-8')
+            frame_size = self.HEADER.size + key_len + value_len
+            self._apply(op, key, offset, frame_size)
+            offset += frame_size
+        self._fh.seek(0, os.SEEK_END)
+        logger.info(f"Log de cache {self.log_file} carregado. Entradas vivas: {len(self.index)}, registros: {self.total_records}")
+
+    def reload(self):
+        """Reconstrói o índice a partir do arquivo (ex: verificação de integridade)."""
+        with self._lock:
+            self._rebuild_index()
+
+    def truncate(self):
+        """Descarta todos os registros do log."""
+        with self._lock:
+            self._fh.truncate(0)
+            self._fh.seek(0)
+            self.index = {}
+            self.total_records = 0
+            self.dead_records = 0
+
+    def _truncate_tail(self, offset: int, reason: str):
+        """Descarta registros incompletos no final do log (ex: crash durante a escrita)."""
+        logger.warning(f"Log de cache {self.log_file}: {reason} no offset {offset}. Truncando o final do log.")
+        self._fh.truncate(offset)
+
+    def _apply(self, op: int, key: str, offset: int, frame_size: int):
+        """Atualiza o índice e os contadores de registros mortos para um registro."""
+        self.total_records += 1
+        if key in self.index:
+            self.dead_records += 1 # O registro anterior da chave foi substituído
+        if op == OP_SET:
+            self.index[key] = (offset, frame_size)
+        else:
+            self.index.pop(key, None)
+            self.dead_records += 1 # Registros de remoção não sobrevivem à compactação
+
+    def _encode(self, op: int, key: str, entry: Optional[Dict[str, Any]] = None) -> bytes:
+        """Serializa um registro no formato de frame do log."""
+        key_bytes = key.encode('utf-8')
+        value_bytes = json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8') if entry is not None else b''
+        body = key_bytes + value_bytes
+        return self.HEADER.pack(op, len(key_bytes), len(value_bytes), zlib.crc32(body)) + body
+
+    def append_batch(self, records: List[Tuple[str, Optional[Dict[str, Any]]]]):
+        """
+        Anexa vários registros com uma única escrita.
+        Cada registro é (chave, entrada); entrada None representa uma remoção.
+        """
+        if not records:
+            return
+        with self._lock:
+            self._fh.seek(0, os.SEEK_END)
+            offset = self._fh.tell()
+            frames = []
+            for key, entry in records:
+                op = OP_SET if entry is not None else OP_DELETE
+                if op == OP_DELETE and key not in self.index:
+                    continue # Nada a remover
+                frame = self._encode(op, key, entry)
+                frames.append(frame)
+                self._apply(op, key, offset, len(frame))
+                offset += len(frame)
+            self._fh.write(b''.join(frames))
+            self._fh.flush()
+        self.maybe_compact()
+
+    def append_set(self, key: str, entry: Dict[str, Any]):
+        """Anexa um registro de escrita para a chave."""
+        self.append_batch([(key, entry)])
+
+    def append_delete(self, key: str):
+        """Anexa um registro de remoção para a chave."""
+        self.append_batch([(key, None)])
+
+    def read(self, key: str) -> Optional[Dict[str, Any]]:
+        """Lê a entrada viva de uma chave usando o índice de offsets."""
+        with self._lock:
+            location = self.index.get(key)
+            if location is None:
+                return None
+            offset, frame_size = location
+            frame = os.pread(self._fh.fileno(), frame_size, offset)
+        _, key_len, value_len, _ = self.HEADER.unpack_from(frame)
+        value_start = self.HEADER.size + key_len
+        return json.loads(frame[value_start:value_start + value_len].decode('utf-8'))
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Itera sobre as entradas vivas, lendo cada registro sob demanda."""
+        for key in list(self.index.keys()):
+            entry = self.read(key)
+            if entry is not None:
+                yield key, entry
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def dead_ratio(self) -> float:
+        """Fração de registros do log que não pertencem mais a nenhuma entrada viva."""
+        return (self.dead_records / self.total_records) if self.total_records > 0 else 0.0
+
+    def needs_compaction(self) -> bool:
+        return self.total_records >= self.min_compaction_records and self.dead_ratio >= self.compaction_ratio
+
+    def maybe_compact(self):
+        """Dispara a compactação em background se a fração de registros mortos passou do limite."""
+        if not self.needs_compaction():
+            return
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(target=self.compact, name="cache-log-compaction", daemon=True)
+            self._compaction_thread.start()
+
+    def compact(self):
+        """Reescreve o log mantendo apenas o último registro de cada entrada viva."""
+        with self._lock:
+            before = self.total_records
+            temp_file = self.log_file + ".compact"
+            fd = self._fh.fileno()
+            with open(temp_file, 'wb') as out:
+                for offset, frame_size in self.index.values():
+                    out.write(os.pread(fd, frame_size, offset)) # Copia o frame sem re-serializar
+                out.flush()
+                os.fsync(out.fileno())
+            self._fh.close()
+            os.replace(temp_file, self.log_file)
+            self._fh = open(self.log_file, 'a+b')
+            self._rebuild_index()
+            self.compactions += 1
+        logger.info(f"Log de cache compactado: {before} -> {self.total_records} registros.")
+
+    def close(self):
+        """Aguarda uma compactação em andamento e fecha o arquivo do log."""
+        thread = self._compaction_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self._lock:
+            if self._fh is not None and not self._fh.closed:
+                self._fh.flush()
+                self._fh.close()
@@ -0,0 +1,61 @@
+import hashlib
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+_HALVE = bytes(value >> 1 for value in range(256)) # Tabela de tradução que divide cada contador por dois
+
+class FrequencySketch:
+    """
+    Count-min sketch com contadores saturando em 15 (como os de 4 bits do TinyLFU) e envelhecimento periódico,
+    usado pela política de admissão TinyLFU do cache.
+
+    Estima quantas vezes cada chave foi acessada recentemente em espaço fixo,
+    independentemente do número de chaves distintas. A cada `sample_size`
+    incrementos todos os contadores são divididos por dois, para que a popularidade
+    antiga não impeça a admissão de perguntas que se tornaram frequentes.
+    """
+
+    MAX_COUNT = 15
+
+    def __init__(self, capacity: int, depth: int = 4, sample_multiplier: int = 10):
+        # Potência de dois >= 4 contadores por entrada (mínimo 256), para manter as colisões raras
+        self.width = 1 << (max(4 * capacity, 256) - 1).bit_length()
+        self.depth = depth
+        self.sample_size = sample_multiplier * max(capacity, 1) # Incrementos entre envelhecimentos
+        self.table: List[bytearray] = [bytearray(self.width) for _ in range(depth)]
+        self.additions = 0
+        self.resets = 0
+
+    def _indexes(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4 * self.depth).digest()
+        mask = self.width - 1
+        return [int.from_bytes(digest[4 * row:4 * row + 4], 'little') & mask for row in range(self.depth)]
+
+    def increment(self, key: str):
+        """Registra um acesso à chave."""
+        added = False
+        for row, index in zip(self.table, self._indexes(key)):
+            if row[index] < self.MAX_COUNT:
+                row[index] += 1
+                added = True
+        if added:
+            self.additions += 1
+            if self.additions >= self.sample_size:
+                self._age()
+
+    def estimate(self, key: str) -> int:
+        """Frequência estimada da chave (nunca menor que a real, descontado o envelhecimento)."""
+        return min(row[index] for row, index in zip(self.table, self._indexes(key)))
+
+    def _age(self):
+        """Divide todos os contadores por dois."""
+        self.table = [bytearray(row.translate(_HALVE)) for row in self.table]
+        self.additions //= 2
+        self.resets += 1
+        logger.debug(f"Sketch de frequência envelhecido ({self.resets}º envelhecimento).")
+
+    def clear(self):
+        self.table = [bytearray(self.width) for _ in range(self.depth)]
+        self.additions = 0
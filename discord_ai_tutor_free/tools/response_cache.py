@@ -3,156 +3,1148 @@ import os
 import hashlib
 import re
 import time
-from typing import Optional, Dict, Any
+import unicodedata
+import atexit
+import threading
+import heapq
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterable, Tuple, List, NamedTuple
 import logging
 import zlib
+import glob
+from collections import Counter, OrderedDict
+from tools.cache_backends import CacheBackend, create_backend
+from tools.similarity_index import MinHashLSH
+from tools.blob_store import BlobStore
+from tools.frequency_sketch import FrequencySketch
 
 # Configuração de logging (pode ser movida para um módulo de utilidades de logging)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class CacheLookup(NamedTuple):
+    """
+    Resultado de uma consulta ao cache. `stale` indica uma entrada além do TTL, dentro da janela
+    de tolerância, ou vinda de um namespace anterior (`fallback`).
+    """
+    response: str
+    stale: bool = False
+    fallback: bool = False
+
+class Codec:
+    """Codec de compressão das respostas. O nome (e a versão do dicionário, se houver) é gravado em cada entrada."""
+    name = "base"
+    dict_version: Optional[int] = None
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    @property
+    def label(self) -> str:
+        return self.name if self.dict_version is None else f"{self.name} v{self.dict_version}"
+
+class ZlibCodec(Codec):
+    """zlib simples: cada resposta comprimida de forma independente."""
+    name = "zlib"
+
+    def __init__(self, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+class ZlibDictCodec(Codec):
+    """
+    zlib com dicionário pré-definido (zdict), treinado no corpus do cache. Os trechos
+    recorrentes das respostas (frases do template, perguntas de fechamento) passam a
+    ser referências ao dicionário já na primeira ocorrência de cada resposta.
+    """
+    name = "zlib-dict"
+
+    def __init__(self, dictionary: bytes, dict_version: int, level: int = 9):
+        self.dictionary = dictionary
+        self.dict_version = dict_version
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=self.dictionary)
+        return decompressor.decompress(data) + decompressor.flush()
+
+def train_zlib_dictionary(samples: Iterable[str], max_size: int = 32 * 1024, min_occurrences: int = 2) -> bytes:
+    """
+    Treina um dicionário zlib a partir de respostas de exemplo.
+
+    Conta em quantas respostas aparece cada sequência de 3, 5 e 8 palavras e seleciona as
+    de maior pontuação (ocorrências x tamanho), descartando as já contidas em um trecho
+    escolhido. Os trechos mais valiosos ficam no final do dicionário, onde as referências
+    do deflate são mais curtas. O tamanho é limitado à janela do zlib (32 KB).
+    """
+    document_frequency: Counter = Counter()
+    for text in samples:
+        words = text.split()
+        segments = set()
+        for n in (8, 5, 3):
+            for i in range(len(words) - n + 1):
+                segments.add(" ".join(words[i:i + n]))
+        document_frequency.update(segments)
+
+    candidates = sorted(
+        ((count * len(segment.encode('utf-8')), segment) for segment, count in document_frequency.items() if count >= min_occurrences),
+        reverse=True
+    )
+    chosen: List[str] = []
+    size = 0
+    for _, segment in candidates[:5000]:
+        if any(segment in existing for existing in chosen):
+            continue
+        segment_size = len(segment.encode('utf-8')) + 1
+        if size + segment_size > max_size:
+            continue
+        chosen.append(segment)
+        size += segment_size
+    return "\n".join(reversed(chosen)).encode('utf-8')
+
+class CachePolicy(NamedTuple):
+    """Política de cache de uma categoria do classificador."""
+    ttl_seconds: float
+    compression_threshold: int
+    cacheable: bool = True
+
 class ResponseCache:
-    def __init__(self, cache_file: str = 'response_cache.json', ttl_hours: int = 24, compression_threshold: int = 1024):
+    def __init__(self, cache_file: str = 'response_cache.json', ttl_hours: int = 24, compression_threshold: int = 1024,
+                 write_behind: bool = False, flush_interval: float = 5.0, flush_threshold: int = 50,
+                 storage: str = "json", compaction_ratio: float = 0.5, backend: Optional[CacheBackend] = None,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 similarity_categories: Optional[Iterable[str]] = None, similarity_threshold: float = 0.75,
+                 stale_grace_hours: float = 0, policies: Optional[Dict[str, Dict[str, Any]]] = None,
+                 codec: str = "zlib", sync_interval: float = 1.0, admission: str = "lru", window_ratio: float = 0.01):
         self.cache_file = cache_file
         self.ttl_seconds = ttl_hours * 3600
+        # Stale-while-revalidate: entradas além do TTL ainda são servidas (como obsoletas) por esta janela
+        self.stale_grace_seconds = stale_grace_hours * 3600
         self.compression_threshold = compression_threshold
-        self.cache: Dict[str, Dict[str, Any]] = {}
+        # Políticas por categoria ('ttl' em segundos, 'compression_threshold', 'cacheable'); categorias sem
+        # política usam o TTL e o limiar de compressão globais. O TTL efetivo é gravado em cada entrada.
+        self.default_policy = CachePolicy(self.ttl_seconds, compression_threshold)
+        self.policies: Dict[str, CachePolicy] = {
+            category: CachePolicy(
+                policy.get('ttl', self.ttl_seconds),
+                policy.get('compression_threshold', compression_threshold),
+                policy.get('cacheable', True)
+            )
+            for category, policy in (policies or {}).items()
+        }
+        self.uncacheable_skips = 0
+        # 'json' reescreve o arquivo inteiro; 'log' anexa registros a um log append-only; 'sqlite' consulta sob demanda.
+        # O backend grava o instante de remoção de cada entrada (TTL da entrada + janela de tolerância) para a remoção por faixa.
+        self.backend = backend if backend is not None else create_backend(
+            storage, cache_file, compaction_ratio=compaction_ratio, removal_time=self._removal_time
+        )
+        self.storage = self.backend.name
+        # Codecs de compressão: 'zlib' ou 'zlib-dict' (dicionário treinado, versionado em <cache_file>.zdict.<versão>).
+        # Entradas antigas são decodificadas pelo codec/versão gravados nelas, então dicionários antigos são mantidos.
+        self.codec_name = codec
+        self.codecs: Dict[Tuple[str, Optional[int]], Codec] = {(ZlibCodec.name, None): ZlibCodec()}
+        self._load_dictionaries()
+        self.active_codec = self._select_codec()
+
+        # Respostas comprimidas ficam em um arquivo binário ao lado do cache; as entradas guardam só [offset, tamanho, crc32]
+        self.blob_store = BlobStore(cache_file + ".blobs", compaction_ratio=compaction_ratio)
+        # Com backends pré-carregados, contém todas as entradas; com backends sob demanda, as entradas já consultadas.
+        # A ordem do OrderedDict é a ordem LRU (menos recente primeiro).
+        self.cache: Dict[str, Dict[str, Any]] = OrderedDict()
         self.hits = 0
         self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.fallback_hits = 0 # Hits servidos por um namespace anterior (ex: versão antiga do template)
+        self.access_counts: Counter = Counter() # Acessos por chave, para o re-aquecimento das mais usadas
+
+        # Limites de memória: número de entradas e bytes (tamanho comprimido para respostas comprimidas)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entry_sizes: Dict[str, int] = {}
+        self.current_bytes = 0
+        self.evictions = 0
+
+        # Política de admissão/remoção ao atingir os limites: 'lru' ou 'tinylfu' (W-TinyLFU). No TinyLFU, entradas
+        # novas entram em uma janela LRU pequena; ao sair dela, só tomam o lugar da entrada menos recente da
+        # região principal se forem mais frequentes, segundo um sketch de frequência dos acessos.
+        if admission not in ("lru", "tinylfu"):
+            raise ValueError(f"Política de admissão desconhecida: '{admission}'. Use 'lru' ou 'tinylfu'.")
+        self.admission = admission
+        self.window_ratio = window_ratio
+        self._window: Dict[str, None] = OrderedDict() # Chaves na janela de admissão, em ordem LRU
+        self.frequency_sketch = FrequencySketch(max_entries or 10000) if admission == "tinylfu" else None
+        self.admission_rejections = 0 # Entradas novas descartadas por serem menos frequentes que a vítima
+
+        # Expiração: min-heap de (instante de expiração, chave) das entradas em memória.
+        # Itens obsoletos (entrada regravada ou removida) são descartados ao sair do heap.
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self.expired_entries = 0
+
+        # Camada de similaridade (MinHash/LSH) consultada após um miss exato, apenas para as categorias habilitadas
+        self.similarity_categories = set(similarity_categories or ())
+        self.similarity_threshold = similarity_threshold
+        self.similarity_index: Optional[MinHashLSH] = MinHashLSH() if self.similarity_categories else None
+        self.exact_hits = 0
+        self.similar_hits = 0
+
+        # Write-behind: mutações vão para o conjunto "sujo" e são persistidas em lote
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval # Segundos entre flushes em background
+        self.flush_threshold = flush_threshold # Número de chaves sujas que antecipa o flush
+        self._dirty: Dict[str, Optional[Dict[str, Any]]] = {} # chave -> entrada pendente (None = remoção)
+        self._lock = threading.RLock() # Protege self.cache e self._dirty
+        self._flush_lock = threading.Lock() # Serializa as escritas em disco
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.flush_count = 0
+        self.total_flush_time = 0.0
+        self.last_flush_time = 0.0
+
+        # API assíncrona (aget/aset): o I/O roda em um executor dedicado, fora do loop de eventos,
+        # e os escritores são serializados por um asyncio.Lock. Ambos são criados sob demanda.
+        self._io_executor: Optional[ThreadPoolExecutor] = None
+        self._async_write_lock: Optional[asyncio.Lock] = None
+
+        # Backend compartilhado entre processos (L2): a memória é um L1 por processo, mantido coerente
+        # pelos avisos de invalidação publicados pelos outros processos, consultados a cada `sync_interval` segundos
+        self.sync_interval = sync_interval
+        self._invalidation_seq = self.backend.latest_invalidation()
+        self._last_sync = time.monotonic()
+        self.invalidations_received = 0
+
         self._load_cache()
         self.cleanup_expired() # Limpa o cache na inicialização
 
+        if self.write_behind:
+            self._start_flusher()
+            atexit.register(self.close) # Garante o flush final no encerramento do processo
+
     def _load_cache(self):
-        """Carrega o cache do arquivo JSON."""
-        if os.path.exists(self.cache_file):
+        """Carrega as entradas do backend (apenas para backends pré-carregados)."""
+        with self._lock:
+            self.cache = OrderedDict()
+            self._window = OrderedDict()
+            self._entry_sizes = {}
+            self.current_bytes = 0
+            self._expiry_heap = []
+            if self.backend.preload:
+                for key, entry in self.backend.load_all():
+                    self._memory_put(key, entry)
+                logger.info(f"Cache carregado ({self.storage}) de {self.cache_file}. Total de entradas: {len(self.cache)}")
+            else:
+                logger.info(f"Cache ({self.storage}) em {self.cache_file}. Total de entradas: {self.backend.count()}")
+        if self.backend.preload:
+            self._enforce_limits() # Fora de self._lock: pode persistir as remoções com flush()
+        self._rebuild_similarity_index()
+        self._reconcile_blobs()
+
+    def sync(self, force: bool = False) -> int:
+        """
+        Aplica os avisos de invalidação publicados por outros processos no backend compartilhado,
+        descartando as cópias desatualizadas do cache em memória. Escritas pendentes deste processo
+        são mantidas (a última escrita persistida prevalece). Retorna o número de entradas descartadas.
+        """
+        if not self.backend.shared:
+            return 0
+        now = time.monotonic()
+        if not force and now - self._last_sync < self.sync_interval:
+            return 0
+        self._last_sync = now
+        seq, keys = self.backend.invalidations_since(self._invalidation_seq)
+        if seq == self._invalidation_seq:
+            return 0
+        with self._lock:
+            self._invalidation_seq = seq
+            changed = list(self.cache) if keys is None else list(set(keys))
+            changed = [key for key in changed if key not in self._dirty]
+            invalidated = [key for key in changed if key in self.cache]
+            for key in invalidated:
+                self._memory_pop(key) # O blob antigo é contabilizado por quem o substituiu
+            self._unindex_entries(changed)
+        if keys is None:
+            self._rebuild_similarity_index()
+        elif self.similarity_index is not None:
+            for key in changed:
+                entry = self.backend.get(key) # Indexa perguntas novas gravadas por outros processos
+                if entry is not None:
+                    with self._lock:
+                        self._index_entry(key, entry)
+        self.invalidations_received += len(invalidated)
+        if invalidated:
+            logger.debug(f"Cache compartilhado: {len(invalidated)} entradas invalidadas por outros processos.")
+        return len(invalidated)
+
+    def _reconcile_blobs(self):
+        """Recalcula os bytes mortos do arquivo de blobs a partir das entradas persistidas (só offsets, sem ler respostas)."""
+        with self._lock:
+            entries = self.cache.values() if self.backend.preload else (entry for _, entry in self.backend.load_all())
+            live_bytes = sum(entry['blob'][1] for entry in entries if 'blob' in entry)
+            self.blob_store.dead_bytes = max(self.blob_store.size - live_bytes, 0)
+        self.maybe_compact_blobs()
+
+    def _release_blob(self, entry: Optional[Dict[str, Any]]):
+        """Contabiliza o blob de uma entrada removida ou substituída como espaço morto."""
+        if entry is not None and 'blob' in entry:
+            self.blob_store.release(entry['blob'][1])
+
+    def maybe_compact_blobs(self):
+        """Compacta o arquivo de blobs se a fração de bytes mortos passou do limite."""
+        if self.blob_store.needs_compaction():
+            self.compact_blobs()
+
+    def compact_blobs(self):
+        """
+        Reescreve o arquivo de blobs só com os blobs vivos e persiste os novos offsets.
+        Uma queda entre as duas etapas deixa offsets antigos, que o CRC32 de cada entrada detecta como miss.
+        """
+        self.flush()
+        with self._flush_lock, self._lock:
+            live: Dict[str, Dict[str, Any]] = {}
+
+            def collect_live():
+                # Lido com o arquivo de blobs bloqueado: inclui os blobs que outros processos acabaram de indexar
+                if self.backend.preload:
+                    live.update((key, entry) for key, entry in self.cache.items() if 'blob' in entry)
+                else:
+                    live.update((key, entry) for key, entry in self.backend.load_all() if 'blob' in entry)
+                    for key, entry in self._dirty.items(): # Mutações que chegaram depois do flush
+                        if entry is not None and 'blob' in entry:
+                            live[key] = entry
+                        else:
+                            live.pop(key, None)
+                return [(entry['blob'][0], entry['blob'][1]) for entry in live.values()]
+
+            relocations = self.blob_store.rewrite(collect_live)
+            if relocations is None:
+                return # Outro processo tem blobs ainda fora do índice: tenta na próxima drenagem
+            updated = []
+            for key, entry in live.items():
+                offset, length, crc = entry['blob']
+                relocated = dict(entry, blob=[relocations[offset], length, crc])
+                if key in self.cache:
+                    self.cache[key] = relocated
+                if key in self._dirty:
+                    self._dirty[key] = relocated
+                else:
+                    updated.append((key, relocated))
+            self.backend.write_batch(updated)
+
+    def _rebuild_similarity_index(self):
+        """Indexa as perguntas das categorias habilitadas para a busca por similaridade."""
+        if self.similarity_index is None:
+            return
+        with self._lock:
+            self.similarity_index.clear()
+            entries = list(self.cache.items()) if self.backend.preload else self.backend.load_all()
+            for key, entry in entries:
+                self._index_entry(key, entry)
+        logger.info(f"Índice de similaridade reconstruído. Perguntas indexadas: {len(self.similarity_index)}")
+
+    def _index_entry(self, key: str, entry: Dict[str, Any]):
+        if self.similarity_index is not None and entry.get('category') in self.similarity_categories and entry.get('question'):
+            self.similarity_index.add(key, entry['question'])
+
+    def _unindex_entries(self, keys: Iterable[str]):
+        if self.similarity_index is not None:
+            for key in keys:
+                self.similarity_index.remove(key)
+
+    def _entry_size(self, entry: Dict[str, Any]) -> int:
+        """Bytes ocupados pela resposta armazenada (o tamanho comprimido, se a entrada for comprimida)."""
+        if 'blob' in entry:
+            return entry['blob'][1]
+        if entry.get('compressed', False):
+            return len(entry['response']) // 2 # Hex: 2 caracteres por byte comprimido
+        return len(entry['response'].encode('utf-8'))
+
+    def _memory_put(self, key: str, entry: Dict[str, Any]):
+        """Insere/atualiza a entrada em memória como a mais recente, mantendo a contagem de bytes."""
+        size = self._entry_size(entry)
+        self.current_bytes += size - self._entry_sizes.get(key, 0)
+        self._entry_sizes[key] = size
+        if self.frequency_sketch is not None and (key in self._window or key not in self.cache):
+            self._window[key] = None
+            self._window.move_to_end(key) # Entradas novas começam na janela de admissão
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+        heapq.heappush(self._expiry_heap, (self._removal_time(entry), key))
+
+    def _memory_pop(self, key: str) -> Optional[Dict[str, Any]]:
+        self.current_bytes -= self._entry_sizes.pop(key, 0)
+        self._window.pop(key, None)
+        return self.cache.pop(key, None)
+
+    def _over_limits(self) -> bool:
+        if self.max_entries is not None and len(self.cache) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.current_bytes > self.max_bytes
+
+    def _enforce_limits(self):
+        """
+        Remove as entradas menos recentemente usadas até respeitar max_entries/max_bytes.
+        Com backends pré-carregados a memória é a fonte da verdade, então a remoção é persistida;
+        com backends sob demanda, a entrada apenas deixa a memória.
+        """
+        evicted = []
+        evicted_entries = []
+        with self._lock:
+            while self.cache and (self._over_limits() or len(self._window) > self._window_capacity()):
+                key = next(iter(self.cache)) if self.frequency_sketch is None else self._select_victim()
+                if key is None:
+                    continue # A janela só cedeu uma entrada à região principal, sem remoção
+                evicted_entries.append(self._memory_pop(key))
+                evicted.append(key)
+            self.evictions += len(evicted)
+            if self.backend.preload:
+                self._unindex_entries(evicted)
+                for entry in evicted_entries:
+                    self._release_blob(entry)
+        if evicted:
+            logger.debug(f"Cache LRU: {len(evicted)} entradas removidas por limite de memória.")
+            if self.backend.preload:
+                self._mark_dirty({key: None for key in evicted})
+
+    def _window_capacity(self) -> int:
+        if self.frequency_sketch is None:
+            return len(self._window)
+        return max(1, int((self.max_entries or len(self.cache)) * self.window_ratio))
+
+    def _select_victim(self) -> Optional[str]:
+        """
+        Escolhe a entrada a remover pela política W-TinyLFU. A entrada menos recente da janela
+        (candidata) disputa com a menos recente da região principal (vítima): fica a mais frequente.
+        Retorna None se a candidata apenas passou para a região principal, sem exceder os limites.
+        """
+        if len(self._window) > self._window_capacity():
+            candidate = next(iter(self._window))
+            del self._window[candidate] # Passa para a região principal
+            if not self._over_limits():
+                return None
+            victim = self._main_lru(exclude=candidate)
+            if victim is None:
+                return candidate
+            if self.frequency_sketch.estimate(candidate) > self.frequency_sketch.estimate(victim):
+                return victim
+            self.admission_rejections += 1
+            return candidate
+        return self._main_lru() or next(iter(self._window))
+
+    def _main_lru(self, exclude: Optional[str] = None) -> Optional[str]:
+        """Entrada menos recentemente usada fora da janela de admissão."""
+        for key in self.cache:
+            if key not in self._window and key != exclude:
+                return key
+        return None
+
+    def _get_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        """Busca a entrada em memória e, para backends sob demanda, no backend."""
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key) # Marca como usada recentemente
+                if key in self._window:
+                    self._window.move_to_end(key)
+                return entry
+            if self.backend.preload:
+                return None
+            if key in self._dirty:
+                return self._dirty[key] # Escrita ou remoção ainda não persistida
+        entry = self.backend.get(key)
+        if entry is not None:
+            with self._lock:
+                self._memory_put(key, entry)
+            self._enforce_limits()
+        return entry
+
+    def _set_entry(self, key: str, entry: Dict[str, Any]):
+        self._put_entry(key, entry)
+        self._mark_dirty({key: entry})
+        self._enforce_limits()
+
+    def _put_entry(self, key: str, entry: Dict[str, Any]):
+        """Registra a entrada na memória, sem persistir (quem chama persiste com _mark_dirty fora de self._lock)."""
+        with self._lock:
+            self._release_blob(self._dirty[key] if key in self._dirty else self.cache.get(key))
+            self._memory_put(key, entry)
+            self._index_entry(key, entry)
+
+    def _delete_entries(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                pending = self._dirty.get(key)
+                self._release_blob(self._memory_pop(key) or pending)
+            self._unindex_entries(keys)
+        self._mark_dirty({key: None for key in keys})
+
+    def _mark_dirty(self, records: Dict[str, Optional[Dict[str, Any]]]):
+        """
+        Registra mutações pendentes. Sem write-behind, persiste imediatamente;
+        com write-behind, apenas acorda o flusher quando o limite de chaves sujas é atingido.
+        """
+        with self._lock:
+            self._dirty.update(records)
+            pending = len(self._dirty)
+        if not self.write_behind or self._stop_event.is_set():
+            self.flush() # Sem flusher ativo, persiste de forma síncrona
+        elif pending >= self.flush_threshold:
+            self._flush_event.set()
+
+    def flush(self):
+        """Persiste as mutações pendentes no backend, registrando a latência do flush."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    self.blob_store.release_pending()
+                    return
+                records = list(self._dirty.items())
+                self._dirty = {}
+
+            start_time = time.perf_counter()
             try:
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    self.cache = json.load(f)
-                logger.info(f"Cache carregado de {self.cache_file}. Total de entradas: {len(self.cache)}")
-            except json.JSONDecodeError as e:
-                logger.error(f"Erro ao decodificar JSON do cache: {e}. Iniciando com cache vazio.")
-                self.cache = {}
+                self.backend.write_batch(records)
             except Exception as e:
-                logger.error(f"Erro ao carregar cache: {e}. Iniciando com cache vazio.")
-                self.cache = {}
-        else:
-            logger.info(f"Arquivo de cache {self.cache_file} não encontrado. Iniciando com cache vazio.")
+                logger.error(f"Erro ao persistir cache ({self.storage}) em {self.cache_file}: {e}")
+                with self._lock:
+                    for key, entry in records:
+                        self._dirty.setdefault(key, entry) # Tenta novamente no próximo flush
+                return
+            with self._lock:
+                if not self._dirty:
+                    self.blob_store.release_pending() # Todos os blobs anexados já estão no índice persistido
+            elapsed = time.perf_counter() - start_time
+            self.flush_count += 1
+            self.total_flush_time += elapsed
+            self.last_flush_time = elapsed
+            logger.debug(f"Flush do cache: {len(records)} chaves em {elapsed * 1000:.2f}ms")
 
-    def _save_cache(self):
-        """Salva o cache no arquivo JSON."""
-        try:
-            # Criar um backup antes de salvar
-            if os.path.exists(self.cache_file):
-                import shutil # Importa shutil para copiar arquivos
-                shutil.copyfile(self.cache_file, self.cache_file + ".bak")
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache, f, ensure_ascii=False, indent=4)
-            logger.debug(f"Cache salvo em {self.cache_file}. Total de entradas: {len(self.cache)}")
-        except Exception as e:
-            logger.error(f"Erro ao salvar cache em {self.cache_file}: {e}")
+    def _start_flusher(self):
+        """Inicia a thread de flush em background."""
+        self._flusher = threading.Thread(target=self._flush_loop, name="response-cache-flusher", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        """Persiste o cache a cada `flush_interval` segundos ou quando o limite de chaves sujas é atingido."""
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
+    def close(self):
+        """Encerra o flusher em background, persiste qualquer mutação pendente e fecha o backend."""
+        if self._stop_event.is_set() and self._flusher is None and not self._dirty:
+            return
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=self.flush_interval + 1)
+        self._flusher = None
+        if self._io_executor is not None:
+            self._io_executor.shutdown(wait=True) # Aguarda operações assíncronas em andamento
+            self._io_executor = None
+        self.flush()
+        self.backend.close()
+        self.blob_store.close()
+
+    async def aclose(self):
+        """
+        Versão assíncrona de close: aguardar o flusher, o executor de I/O e o flush final
+        bloquearia o loop de eventos. Roda no executor padrão, pois o de I/O é encerrado por close.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.close)
+
+    def import_entries(self, entries: Iterable[Tuple[str, Dict[str, Any]]], batch_size: int = 500) -> int:
+        """
+        Grava entradas já no formato do cache diretamente no backend, em lotes.
+        Usado para migrar um response_cache.json para outro armazenamento.
+        """
+        imported = 0
+        batch = []
+        for key, entry in entries:
+            batch.append((key, self._externalize_legacy_entry(entry)))
+            if len(batch) >= batch_size:
+                self.backend.write_batch(batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            self.backend.write_batch(batch)
+            imported += len(batch)
+        with self._lock:
+            if not self._dirty:
+                self.blob_store.release_pending()
+        if self.backend.preload:
+            self._load_cache()
+        logger.info(f"{imported} entradas importadas para o cache ({self.storage}).")
+        return imported
+
+    def _externalize_legacy_entry(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Converte uma entrada antiga (resposta comprimida em hex no JSON) para o formato com blob."""
+        if entry.get('compressed', False) and 'response' in entry:
+            entry = dict(entry)
+            entry['blob'] = list(self.blob_store.append(bytes.fromhex(entry.pop('response'))))
+        return entry
 
     def _normalize_question(self, question: str) -> str:
         """Normaliza a pergunta para uso como chave de cache."""
-        question = question.lower().strip()
+        question = unicodedata.normalize('NFKD', question.lower().strip())
+        question = ''.join(char for char in question if not unicodedata.combining(char)) # "é" -> "e", "ç" -> "c"
         question = re.sub(r'[^a-z0-9\s]', '', question) # Remove caracteres especiais
-        question = re.sub(r'\s+', ' ', question) # Normaliza múltiplos espaços
+        question = re.sub(r'\s+', ' ', question).strip() # Normaliza múltiplos espaços
         return question
 
     def _generate_hash(self, text: str) -> str:
         """Gera um hash MD5 para o texto."""
         return hashlib.md5(text.encode('utf-8')).hexdigest()
 
+    def key_for(self, question: str, namespace: Optional[str] = None) -> str:
+        """Chave do cache de uma pergunta (após normalização) no namespace informado."""
+        return self._make_key(self._normalize_question(question), namespace)
+
+    def _make_key(self, normalized_question: str, namespace: Optional[str] = None) -> str:
+        """Chave do cache: hash da pergunta normalizada, prefixada pelo namespace (sem namespace, a chave original)."""
+        if namespace is None:
+            return self._generate_hash(normalized_question)
+        return self._generate_hash(f"{namespace}|{normalized_question}")
+
+    def _dictionary_path(self, version: int) -> str:
+        return f"{self.cache_file}.zdict.{version}"
+
+    def _load_dictionaries(self):
+        """Registra um codec para cada versão de dicionário persistida ao lado do cache."""
+        for path in glob.glob(glob.escape(self.cache_file) + ".zdict.*"):
+            suffix = path.rsplit('.', 1)[-1]
+            if not suffix.isdigit():
+                continue
+            with open(path, 'rb') as f:
+                codec = ZlibDictCodec(f.read(), int(suffix))
+            self.codecs[(codec.name, codec.dict_version)] = codec
+
+    def _latest_dictionary_version(self) -> Optional[int]:
+        versions = [version for name, version in self.codecs if name == ZlibDictCodec.name]
+        return max(versions) if versions else None
+
+    def _select_codec(self) -> Codec:
+        """Escolhe o codec das novas entradas: o dicionário mais recente, se configurado e disponível."""
+        if self.codec_name == ZlibDictCodec.name:
+            version = self._latest_dictionary_version()
+            if version is not None:
+                return self.codecs[(ZlibDictCodec.name, version)]
+            logger.info("Nenhum dicionário de compressão treinado. Usando zlib até o primeiro treinamento.")
+        elif self.codec_name != ZlibCodec.name:
+            raise ValueError(f"Codec de compressão desconhecido: '{self.codec_name}'. Use 'zlib' ou 'zlib-dict'.")
+        return self.codecs[(ZlibCodec.name, None)]
+
+    def iter_responses(self, limit: Optional[int] = None) -> Iterable[str]:
+        """Itera sobre as respostas armazenadas (decodificadas), para treino e benchmark dos codecs."""
+        count = 0
+        if self.backend.preload:
+            with self._lock:
+                entries = list(self.cache.values())
+        else:
+            self.flush()
+            entries = (entry for _, entry in self.backend.load_all())
+        for entry in entries:
+            if limit is not None and count >= limit:
+                return
+            response = self._decode_entry(entry)
+            if response:
+                count += 1
+                yield response
+
+    def train_dictionary(self, max_size: int = 32 * 1024, max_samples: int = 2000, min_samples: int = 10) -> Optional[int]:
+        """
+        Treina um novo dicionário de compressão com as respostas do cache e o persiste como
+        uma nova versão. Novas entradas passam a usá-lo se o codec configurado for 'zlib-dict'.
+        Retorna a versão criada, ou None se o corpus for pequeno demais.
+        """
+        samples = list(self.iter_responses(limit=max_samples))
+        if len(samples) < min_samples:
+            logger.warning(f"Corpus insuficiente para treinar o dicionário: {len(samples)} respostas (mínimo {min_samples}).")
+            return None
+        dictionary = train_zlib_dictionary(samples, max_size=max_size)
+        version = (self._latest_dictionary_version() or 0) + 1
+        path = self._dictionary_path(version)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(dictionary)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        codec = ZlibDictCodec(dictionary, version)
+        self.codecs[(codec.name, version)] = codec
+        self.active_codec = self._select_codec()
+        logger.info(f"Dicionário de compressão v{version} treinado com {len(samples)} respostas ({len(dictionary)} bytes).")
+        return version
+
     def _compress_response(self, response: str) -> bytes:
-        """Comprime a resposta usando zlib."""
-        return zlib.compress(response.encode('utf-8'))
+        """Comprime a resposta com o codec ativo."""
+        return self.active_codec.compress(response.encode('utf-8'))
+
+    def _decompress_response(self, compressed_response: bytes, codec_name: str = ZlibCodec.name, dict_version: Optional[int] = None) -> Optional[str]:
+        """Descomprime a resposta com o codec registrado na entrada. Retorna None se o codec não estiver disponível."""
+        codec = self.codecs.get((codec_name, dict_version))
+        if codec is None:
+            logger.warning(f"Codec '{codec_name}' (dicionário v{dict_version}) indisponível.")
+            return None
+        try:
+            return codec.decompress(compressed_response).decode('utf-8')
+        except zlib.error as e:
+            logger.warning(f"Erro ao descomprimir entrada com o codec '{codec.label}': {e}. Entrada descartada.")
+            return None
 
-    def _decompress_response(self, compressed_response: bytes) -> str:
-        """Descomprime a resposta usando zlib."""
-        return zlib.decompress(compressed_response).decode('utf-8')
+    def _has_codec(self, entry: Dict[str, Any]) -> bool:
+        """
+        Indica se há codec para decodificar a entrada. Um dicionário desconhecido pode ter sido treinado
+        por outro processo depois desta instância iniciar: os dicionários são recarregados do disco antes de desistir.
+        """
+        if 'blob' not in entry:
+            return True
+        codec_key = (entry.get('codec', ZlibCodec.name), entry.get('dict_version'))
+        if codec_key in self.codecs:
+            return True
+        with self._lock: # Os workers do executor de I/O podem recarregar ao mesmo tempo
+            if codec_key not in self.codecs:
+                self._load_dictionaries()
+                self.active_codec = self._select_codec() # Novas entradas passam a usar o dicionário mais recente
+            return codec_key in self.codecs
+
+    def _decode_entry(self, entry: Dict[str, Any]) -> Optional[str]:
+        """
+        Retorna o texto da resposta armazenada, descomprimindo se necessário.
+        Retorna None se o blob da entrada não puder ser lido (ex: arquivo de blobs truncado).
+        """
+        if 'blob' in entry:
+            offset, length, crc = entry['blob']
+            data = self.blob_store.read(offset, length, crc)
+            if data is None:
+                logger.warning(f"Blob inválido no offset {offset} de {self.blob_store.blob_file}. Entrada descartada.")
+                return None
+            return self._decompress_response(data, entry.get('codec', ZlibCodec.name), entry.get('dict_version'))
+        response = entry['response']
+        if entry.get('compressed', False):
+            response = self._decompress_response(bytes.fromhex(response)) # Formato antigo: hex no JSON
+        return response
+
+    def _is_expired(self, entry: Dict[str, Any], now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.time()) >= entry['timestamp'] + entry.get('ttl', self.ttl_seconds)
+
+    def _is_within_grace(self, entry: Dict[str, Any], now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.time()) < self._removal_time(entry)
+
+    def _removal_time(self, entry: Dict[str, Any]) -> float:
+        """Instante em que a entrada deixa de poder ser servida, mesmo como obsoleta."""
+        return entry['timestamp'] + entry.get('ttl', self.ttl_seconds) + self.stale_grace_seconds
+
+    def get_policy(self, category: Optional[str]) -> CachePolicy:
+        """Retorna a política da categoria, ou a política global."""
+        return self.policies.get(category, self.default_policy)
 
-    def get_cached_response(self, question: str) -> Optional[str]:
+    def get_cached_response(self, question: str, category: Optional[str] = None, namespace: Optional[str] = None,
+                            fallback_namespaces: Iterable[Optional[str]] = ()) -> Optional[str]:
         """
         Busca uma resposta no cache.
         Retorna a resposta se encontrada e não expirada, caso contrário, None.
+        Se a categoria tiver a busca por similaridade habilitada, um miss exato
+        ainda pode ser atendido por uma pergunta parecida já respondida.
         """
+        result = self.lookup(question, category=category, namespace=namespace, fallback_namespaces=fallback_namespaces)
+        return result.response if result is not None else None
+
+    def lookup(self, question: str, category: Optional[str] = None, namespace: Optional[str] = None,
+               fallback_namespaces: Iterable[Optional[str]] = ()) -> Optional[CacheLookup]:
+        """
+        Como get_cached_response, mas também retorna entradas além do TTL que ainda estão
+        na janela de tolerância, marcadas como obsoletas para que o chamador as revalide.
+
+        As chaves são separadas por `namespace` (ex: agente + versão do template). Em um miss,
+        os `fallback_namespaces` (versões anteriores) são consultados em ordem; uma resposta
+        encontrada neles é retornada como obsoleta, para ser regenerada no namespace atual.
+        """
+        if not self.get_policy(category).cacheable:
+            return None # Categoria fora do cache: nem hit nem miss
+        self.sync()
         normalized_question = self._normalize_question(question)
-        question_hash = self._generate_hash(normalized_question)
+        question_hash = self._make_key(normalized_question, namespace)
+        if self.frequency_sketch is not None:
+            with self._lock:
+                self.frequency_sketch.increment(question_hash) # Hits e misses contam para a admissão
 
-        entry = self.cache.get(question_hash)
-        if entry:
-            if time.time() < entry['timestamp'] + self.ttl_seconds:
+        result = self._lookup_key(question_hash)
+        if result is not None:
+            self._record_access(question_hash)
+            with self._lock: # Contadores atualizados pelos dois workers do executor de I/O
                 self.hits += 1
+                self.exact_hits += 1
+                if result.stale:
+                    self.stale_hits += 1
+            if result.stale:
+                logger.debug(f"Cache HIT (obsoleto) para a pergunta: '{question}'")
+            else:
                 logger.debug(f"Cache HIT para a pergunta: '{question}'")
-                response = entry['response']
-                if entry.get('compressed', False):
-                    response = self._decompress_response(bytes.fromhex(response))
+            return result
+
+        for old_namespace in fallback_namespaces:
+            old_key = self._make_key(normalized_question, old_namespace)
+            result = self._lookup_key(old_key)
+            if result is not None:
+                self._record_access(old_key)
+                with self._lock:
+                    self.hits += 1
+                    self.exact_hits += 1
+                    self.stale_hits += 1
+                    self.fallback_hits += 1
+                logger.debug(f"Cache HIT (namespace anterior '{old_namespace}') para a pergunta: '{question}'")
+                return CacheLookup(result.response, stale=True, fallback=True)
+
+        if category in self.similarity_categories:
+            similar_response = self._get_similar_response(normalized_question, category, namespace)
+            if similar_response is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.similar_hits += 1
+                logger.debug(f"Cache HIT (similar) para a pergunta: '{question}'")
+                return CacheLookup(similar_response)
+
+        with self._lock:
+            self.misses += 1 # Incrementa miss se não encontrado ou expirado
+        logger.debug(f"Cache MISS para a pergunta: '{question}'")
+        return None
+
+    def _lookup_key(self, key: str) -> Optional[CacheLookup]:
+        """Busca uma chave, retornando a resposta se estiver válida ou dentro da janela de tolerância."""
+        entry = self._get_entry(key)
+        if not entry:
+            return None
+        now = time.time()
+        stale = self._is_expired(entry, now)
+        if stale and not self._is_within_grace(entry, now):
+            # A remoção fica para a próxima drenagem do heap de expiração, em lote com as demais
+            logger.debug(f"Entrada de cache expirada: '{entry.get('question')}'")
+            return None
+        if not self._has_codec(entry):
+            # Miss sem remover: a entrada é válida para os processos que têm o dicionário
+            logger.warning(f"Dicionário de compressão v{entry.get('dict_version')} indisponível para '{entry.get('question')}'. Tratando como miss.")
+            return None
+        response = self._decode_entry(entry)
+        if response is None:
+            self._delete_entries(key) # Blob corrompido (CRC32) ou dados inválidos para o codec
+            return None
+        return CacheLookup(response, stale)
+
+    def contains(self, question: str, namespace: Optional[str] = None) -> bool:
+        """Indica se há uma entrada válida para a pergunta no namespace, sem afetar as estatísticas."""
+        entry = self._get_entry(self._make_key(self._normalize_question(question), namespace))
+        return entry is not None and not self._is_expired(entry)
+
+    def _record_access(self, key: str):
+        """Conta os acessos por chave (desde o início do processo), mantendo apenas as mais acessadas."""
+        with self._lock:
+            self.access_counts[key] += 1
+            if len(self.access_counts) > 10000:
+                self.access_counts = Counter(dict(self.access_counts.most_common(5000)))
+
+    def hottest_entries(self, namespaces: Iterable[Optional[str]], limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Retorna as entradas mais acessadas dos namespaces informados, da mais para a menos acessada,
+        com a pergunta original, a categoria e o namespace de cada uma.
+        """
+        wanted = set(namespaces)
+        with self._lock:
+            ranked = self.access_counts.most_common()
+        hottest = []
+        for key, accesses in ranked:
+            entry = self._get_entry(key)
+            if entry is None or 'prompt' not in entry or entry.get('namespace') not in wanted:
+                continue
+            hottest.append({
+                "prompt": entry['prompt'],
+                "category": entry.get('category'),
+                "namespace": entry.get('namespace'),
+                "accesses": accesses
+            })
+            if len(hottest) >= limit:
+                break
+        return hottest
+
+    def _get_similar_response(self, normalized_question: str, category: str, namespace: Optional[str] = None) -> Optional[str]:
+        """Busca no índice LSH a pergunta mais parecida da mesma categoria e namespace, ainda válida."""
+        with self._lock:
+            candidates: List[Tuple[str, float]] = self.similarity_index.query(normalized_question, self.similarity_threshold)
+        for key, similarity in candidates:
+            entry = self._get_entry(key)
+            if entry is None:
+                with self._lock:
+                    self._unindex_entries([key]) # Removida do backend (ex: expiração por faixa)
+                continue
+            if entry.get('category') != category or entry.get('namespace') != namespace or self._is_expired(entry):
+                continue
+            response = self._decode_entry(entry) if self._has_codec(entry) else None
+            if response is not None:
+                logger.debug(f"Pergunta similar encontrada (similaridade estimada {similarity:.2f}): '{entry.get('question')}'")
                 return response
-            else:
-                logger.debug(f"Entrada de cache expirada para a pergunta: '{question}'")
-                self.misses += 1 # Incrementa miss apenas se expirado
-                self.cache.pop(question_hash, None) # Remove a entrada expirada
-                self._save_cache() # Salva para remover a entrada expirada
-        else: # Se a entrada não existe
-            self.misses += 1 # Incrementa miss apenas se não encontrado
-            logger.debug(f"Cache MISS para a pergunta: '{question}'")
         return None
 
-    def cache_response(self, question: str, response: str):
+    def cache_response(self, question: str, response: str, category: Optional[str] = None, refresh: bool = False,
+                       namespace: Optional[str] = None):
         """
-        Armazena uma resposta no cache.
+        Armazena uma resposta no cache, sob o `namespace` informado.
+        `refresh` indica a revalidação em background de uma entrada obsoleta (contabilizada nas estatísticas).
         """
+        policy = self.get_policy(category)
+        if not policy.cacheable:
+            with self._lock:
+                self.uncacheable_skips += 1
+            logger.debug(f"Categoria '{category}' não é cacheável. Resposta não armazenada.")
+            return
+
         normalized_question = self._normalize_question(question)
-        question_hash = self._generate_hash(normalized_question)
+        question_hash = self._make_key(normalized_question, namespace)
 
         entry = {
             'response': response,
             'timestamp': time.time(),
-            'compressed': False
+            'compressed': False,
+            'question': normalized_question,
+            'prompt': question # Pergunta original, usada para regenerar a resposta no re-aquecimento
         }
+        if category is not None:
+            entry['category'] = category
+        if namespace is not None:
+            entry['namespace'] = namespace
+        if policy.ttl_seconds != self.ttl_seconds:
+            entry['ttl'] = policy.ttl_seconds
 
-        if len(response.encode('utf-8')) > self.compression_threshold:
-            entry['response'] = self._compress_response(response).hex() # Armazena como hex string
+        compressed = None
+        if len(response.encode('utf-8')) > policy.compression_threshold:
+            codec = self.active_codec
+            compressed = codec.compress(response.encode('utf-8'))
+            del entry['response']
             entry['compressed'] = True
+            entry['codec'] = codec.name
+            if codec.dict_version is not None:
+                entry['dict_version'] = codec.dict_version
             logger.debug(f"Resposta comprimida para a pergunta: '{question}'")
 
-        self.cache[question_hash] = entry
-        self._save_cache()
+        with self._lock: # A compactação dos blobs não pode ocorrer entre o append e o registro da entrada
+            if compressed is not None:
+                entry['blob'] = list(self.blob_store.append(compressed)) # [offset, tamanho, crc32] no arquivo de blobs
+            self._put_entry(question_hash, entry)
+            self._dirty[question_hash] = entry # Já pendente: um flush concorrente não libera o lock de blobs pendentes antes dela
+        # Fora de self._lock: o flush síncrono toma _flush_lock antes de self._lock, como flush() e compact_blobs()
+        self._mark_dirty({question_hash: entry})
+        self._enforce_limits()
+        if refresh:
+            with self._lock:
+                self.refreshes += 1
         logger.debug(f"Resposta armazenada em cache para a pergunta: '{question}'")
 
-    def cleanup_expired(self):
+    def _get_io_executor(self) -> ThreadPoolExecutor:
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="response-cache-io")
+        return self._io_executor
+
+    def _get_async_write_lock(self) -> asyncio.Lock:
+        if self._async_write_lock is None:
+            self._async_write_lock = asyncio.Lock()
+        return self._async_write_lock
+
+    async def _run_io(self, func, *args, **kwargs):
+        """Executa uma operação síncrona do cache no executor de I/O, sem bloquear o loop de eventos."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_io_executor(), functools.partial(func, *args, **kwargs))
+
+    async def aget(self, question: str, category: Optional[str] = None, namespace: Optional[str] = None,
+                   fallback_namespaces: Iterable[Optional[str]] = ()) -> Optional[str]:
+        """Versão assíncrona de get_cached_response: leitura do backend e descompressão fora do loop."""
+        return await self._run_io(self.get_cached_response, question, category=category, namespace=namespace,
+                                  fallback_namespaces=tuple(fallback_namespaces))
+
+    async def alookup(self, question: str, category: Optional[str] = None, namespace: Optional[str] = None,
+                      fallback_namespaces: Iterable[Optional[str]] = ()) -> Optional[CacheLookup]:
+        """Versão assíncrona de lookup."""
+        return await self._run_io(self.lookup, question, category=category, namespace=namespace,
+                                  fallback_namespaces=tuple(fallback_namespaces))
+
+    async def ahottest_entries(self, namespaces: Iterable[Optional[str]], limit: int = 50) -> List[Dict[str, Any]]:
+        """Versão assíncrona de hottest_entries."""
+        return await self._run_io(self.hottest_entries, tuple(namespaces), limit)
+
+    async def acontains(self, question: str, namespace: Optional[str] = None) -> bool:
+        """Versão assíncrona de contains."""
+        return await self._run_io(self.contains, question, namespace=namespace)
+
+    async def aset(self, question: str, response: str, category: Optional[str] = None, refresh: bool = False,
+                   namespace: Optional[str] = None):
+        """Versão assíncrona de cache_response. Escritores concorrentes são serializados."""
+        async with self._get_async_write_lock():
+            await self._run_io(self.cache_response, question, response, category=category, refresh=refresh, namespace=namespace)
+
+    async def aclear(self) -> int:
+        """Versão assíncrona de clear."""
+        async with self._get_async_write_lock():
+            return await self._run_io(self.clear)
+
+    async def aflush(self):
+        """Versão assíncrona de flush."""
+        async with self._get_async_write_lock():
+            await self._run_io(self.flush)
+
+    def expire_due(self, now: Optional[float] = None) -> int:
+        """
+        Remove as entradas cujo instante de expiração já passou, drenando o heap de expiração.
+        O custo é proporcional ao número de entradas expirando, não ao tamanho do cache, e as
+        remoções são persistidas em uma única operação. Retorna o número de entradas removidas.
+        """
+        now = now if now is not None else time.time()
+        self.sync(force=True) # Não remover por chave uma entrada que outro processo acabou de regravar
+        expired = []
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, key = heapq.heappop(self._expiry_heap)
+                entry = self.cache.get(key)
+                if entry is not None and self._removal_time(entry) == expires_at:
+                    expired.append(key)
+            if len(self._expiry_heap) > 2 * len(self.cache) + 64:
+                self._rebuild_expiry_heap() # Muitos itens obsoletos acumulados por regravações
+
+            if not self.backend.preload:
+                # A memória é só uma cópia: a remoção no backend é uma faixa do instante de remoção gravado,
+                # e escritas pendentes de entradas expiradas são descartadas em vez de persistidas.
+                for key in expired:
+                    self._release_blob(self._memory_pop(key))
+                    self._dirty.pop(key, None)
+                self._unindex_entries(expired)
+
+        if self.backend.preload:
+            removed_count = len(expired)
+            if expired:
+                self._delete_entries(*expired)
+        else:
+            # A faixa alcança também entradas fora da memória (removidas pelo LRU, gravadas por outros processos
+            # ou antes de uma reinicialização), com o mesmo critério do heap: instante de remoção <= now
+            removed_count = self.backend.delete_expired(now, keys=expired)
+
+        self.expired_entries += removed_count
+        if removed_count > 0:
+            logger.debug(f"Expiração do cache: {removed_count} entradas removidas.")
+        return removed_count
+
+    def _rebuild_expiry_heap(self):
+        self._expiry_heap = [(self._removal_time(entry), key) for key, entry in self.cache.items()]
+        heapq.heapify(self._expiry_heap)
+
+    async def run_expiry_loop(self, interval: float = 30.0):
+        """
+        Tarefa periódica (no loop do bot) que drena o heap de expiração a cada `interval` segundos
+        e compacta o arquivo de blobs quando necessário.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with self._get_async_write_lock():
+                    await self._run_io(self.expire_due)
+                    await self._run_io(self.maybe_compact_blobs)
+            except Exception as e:
+                logger.error(f"Erro ao expirar entradas do cache: {e}")
+
+    def cleanup_expired(self) -> int:
         """
         Remove entradas expiradas do cache.
+        Em backends sob demanda, a remoção é uma única operação por faixa do instante de remoção no backend.
         """
-        initial_count = len(self.cache)
-        keys_to_remove = [
-            key for key, entry in self.cache.items()
-            if time.time() >= entry['timestamp'] + self.ttl_seconds
-        ]
-        for key in keys_to_remove:
-            self.cache.pop(key, None)
-        if len(keys_to_remove) > 0:
-            logger.info(f"Limpeza de cache: {len(keys_to_remove)} entradas expiradas removidas.")
-            self._save_cache()
+        initial_count = self._entry_count()
+        removed_count = self.expire_due()
+
+        if removed_count > 0:
+            logger.info(f"Limpeza de cache: {removed_count} entradas expiradas removidas.")
         else:
             logger.info("Limpeza de cache: Nenhuma entrada expirada encontrada.")
-        logger.info(f"Cache atualizado. Total de entradas: {len(self.cache)} (antes: {initial_count})")
+        logger.info(f"Cache atualizado. Total de entradas: {self._entry_count()} (antes: {initial_count})")
+        return removed_count
+
+    def _entry_count(self) -> int:
+        return len(self.cache) if self.backend.preload else self.backend.count()
+
+    def clear(self) -> int:
+        """Remove todas as entradas do cache e do backend. Retorna o número de entradas removidas."""
+        with self._flush_lock, self._lock:
+            removed_count = self._entry_count()
+            self.cache = OrderedDict()
+            self._window = OrderedDict()
+            self._entry_sizes = {}
+            self.current_bytes = 0
+            self._expiry_heap = []
+            self._dirty = {}
+            self.access_counts = Counter()
+            self.blob_store.truncate()
+            self.blob_store.release_pending()
+            if self.similarity_index is not None:
+                self.similarity_index.clear()
+            self.backend.clear()
+        return removed_count
 
-    def get_stats(self) -> Dict[str, int]:
-        """Retorna estatísticas de hit/miss do cache."""
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna estatísticas de hit/miss do cache e do flush em background."""
         total_requests = self.hits + self.misses
         hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
-        return {
+        avg_flush_time = (self.total_flush_time / self.flush_count) if self.flush_count > 0 else 0
+        stats = {
             "hits": self.hits,
             "misses": self.misses,
             "total_requests": total_requests,
             "hit_rate_percent": round(hit_rate, 2),
-            "current_entries": len(self.cache)
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "fresh_hits": self.hits - self.stale_hits,
+            "stale_hits": self.stale_hits,
+            "refreshes": self.refreshes,
+            "fallback_hits": self.fallback_hits,
+            "invalidations_received": self.invalidations_received,
+            "uncacheable_skips": self.uncacheable_skips,
+            "similarity_index_size": len(self.similarity_index) if self.similarity_index is not None else 0,
+            "current_entries": self._entry_count(),
+            "current_bytes": self.current_bytes,
+            "evictions": self.evictions,
+            "admission": self.admission,
+            "admission_rejections": self.admission_rejections,
+            "expired_entries": self.expired_entries,
+            "blob_bytes": self.blob_store.size,
+            "blob_dead_ratio": round(self.blob_store.dead_ratio, 2),
+            "blob_compactions": self.blob_store.compactions,
+            "pending_writes": len(self._dirty),
+            "flush_count": self.flush_count,
+            "last_flush_ms": round(self.last_flush_time * 1000, 2),
+            "avg_flush_ms": round(avg_flush_time * 1000, 2),
+            "storage": self.storage,
+            "codec": self.active_codec.label
         }
+        stats.update(self.backend.stats())
+        return stats
 
     def reset_stats(self):
         """Reseta as estatísticas de hit/miss."""
         self.hits = 0
         self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.fallback_hits = 0
         logger.info("Estatísticas de cache resetadas.")
 
 # Exemplo de uso (para testes internos, pode ser removido em produção)
@@ -216,6 +1208,6 @@ if __name__ == "__main__":
     # Limpeza do arquivo de teste
     if os.path.exists('test_cache.json'):
         os.remove('test_cache.json')
-    if os.path.exists('test_cache.json.bak'):
-        os.remove('test_cache.json.bak')
+    if os.path.exists('test_cache.json.lock'):
+        os.remove('test_cache.json.lock')
     print("\nTestes concluídos. Arquivo de cache de teste removido.")
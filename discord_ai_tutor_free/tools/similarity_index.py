@@ -0,0 +1,115 @@
+import random
+import zlib
+from array import array
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+# Palavras que não distinguem uma pergunta de outra ("o que é", "me explica", "por favor", artigos e preposições),
+# já normalizadas como as perguntas do cache (minúsculas, sem acentos). Paráfrases da mesma pergunta
+# ficam com o mesmo conjunto de palavras de conteúdo.
+QUESTION_FILLER_WORDS: FrozenSet[str] = frozenset(
+    # Português
+    "o a os as um uma uns umas que e eh de da do das dos em no na nos nas para pra pro com por favor "
+    "me explica explique explicar pode poderia voce seria significa sao sobre fala falar conte qual quais "
+    "afinal exatamente define defina "
+    # Inglês
+    "what is are the an of to explain tell about please define".split()
+)
+
+class MinHashLSH:
+    """
+    Índice de similaridade para perguntas usando assinaturas MinHash de
+    shingles de palavras, agrupadas em buckets LSH (banding).
+
+    Os shingles são as palavras de conteúdo da pergunta (sem as de `stop_words`) e os
+    pares de palavras consecutivas, então "o que é deep learning?" e "me explica deep
+    learning" têm o mesmo conjunto, enquanto "deep learning" e "machine learning" ou
+    "aprendizado supervisionado" e "aprendizado não supervisionado" ficam distantes.
+
+    Duas perguntas caem no mesmo bucket quando todas as linhas de pelo menos
+    uma banda coincidem; a similaridade de Jaccard é então estimada pela
+    fração de posições iguais nas assinaturas.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 42,
+                 stop_words: FrozenSet[str] = QUESTION_FILLER_WORDS):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm deve ser múltiplo de bands.")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.stop_words = stop_words
+        rng = random.Random(seed) # Permutações determinísticas: assinaturas estáveis entre reinicializações
+        self._permutations = [
+            (rng.randint(1, _MERSENNE_PRIME - 1), rng.randint(0, _MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+        self.signatures: Dict[str, array] = {}
+        self.buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+
+    def _shingles(self, text: str) -> Set[int]:
+        """Gera os hashes das palavras de conteúdo do texto e dos pares de palavras consecutivas."""
+        words = text.split()
+        content = [word for word in words if word not in self.stop_words] or words # Só palavras comuns: usa todas
+        shingles = set(content) | {f"{first} {second}" for first, second in zip(content, content[1:])}
+        return {zlib.crc32(shingle.encode('utf-8')) for shingle in shingles} or {zlib.crc32(b"")}
+
+    def signature(self, text: str) -> array:
+        """Calcula a assinatura MinHash do texto (já normalizado)."""
+        shingles = self._shingles(text)
+        return array('I', (
+            min((a * shingle + b) % _MERSENNE_PRIME for shingle in shingles)
+            for a, b in self._permutations
+        ))
+
+    def _band_keys(self, signature: array) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def add(self, key: str, text: str):
+        """Indexa o texto sob a chave (substituindo uma assinatura anterior)."""
+        self.remove(key)
+        signature = self.signature(text)
+        self.signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self.buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band_key in self._band_keys(signature):
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band_key]
+
+    def estimate_similarity(self, sig1: array, sig2: array) -> float:
+        """Estima a similaridade de Jaccard pela fração de posições iguais."""
+        return sum(1 for x, y in zip(sig1, sig2) if x == y) / self.num_perm
+
+    def query(self, text: str, threshold: float) -> List[Tuple[str, float]]:
+        """
+        Retorna as chaves candidatas com similaridade estimada >= threshold,
+        da mais para a menos similar.
+        """
+        signature = self.signature(text)
+        candidates: Set[str] = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self.buckets.get(band_key, ()))
+        scored = [(key, self.estimate_similarity(signature, self.signatures[key])) for key in candidates]
+        return sorted([item for item in scored if item[1] >= threshold], key=lambda item: item[1], reverse=True)
+
+    def clear(self):
+        self.signatures = {}
+        self.buckets = {}
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.signatures
@@ -0,0 +1,39 @@
+import logging
+from typing import Any
+
+from config import (
+    CACHE_EXPIRATION_TIME, CACHE_STALE_GRACE_PERIOD, CACHE_POLICIES, CACHE_WRITE_BEHIND, CACHE_FLUSH_INTERVAL, CACHE_FLUSH_THRESHOLD,
+    CACHE_STORAGE, CACHE_PATHS, CACHE_SYNC_INTERVAL, CACHE_COMPACTION_RATIO, CACHE_CODEC, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES,
+    CACHE_ADMISSION_POLICY, CACHE_WINDOW_RATIO, CACHE_SIMILARITY_CATEGORIES, CACHE_SIMILARITY_THRESHOLD
+)
+from tools.response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+def create_response_cache(**overrides: Any) -> ResponseCache:
+    """
+    Cria o ResponseCache com a configuração do config.py. O bot, a CLI e os benchmarks usam esta
+    função, então todos gravam no armazenamento compartilhado os mesmos TTLs, políticas e janela
+    de tolerância. `overrides` substitui argumentos específicos (ex: write_behind=False na CLI).
+    """
+    options = dict(
+        cache_file=CACHE_PATHS[CACHE_STORAGE],
+        ttl_hours=CACHE_EXPIRATION_TIME / 3600,
+        stale_grace_hours=CACHE_STALE_GRACE_PERIOD / 3600,
+        policies=CACHE_POLICIES,
+        codec=CACHE_CODEC,
+        write_behind=CACHE_WRITE_BEHIND,
+        flush_interval=CACHE_FLUSH_INTERVAL,
+        flush_threshold=CACHE_FLUSH_THRESHOLD,
+        storage=CACHE_STORAGE,
+        sync_interval=CACHE_SYNC_INTERVAL,
+        compaction_ratio=CACHE_COMPACTION_RATIO,
+        max_entries=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+        admission=CACHE_ADMISSION_POLICY,
+        window_ratio=CACHE_WINDOW_RATIO,
+        similarity_categories=CACHE_SIMILARITY_CATEGORIES,
+        similarity_threshold=CACHE_SIMILARITY_THRESHOLD
+    )
+    options.update(overrides)
+    return ResponseCache(**options)
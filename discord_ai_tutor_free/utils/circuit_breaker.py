@@ -0,0 +1,104 @@
+import logging
+import random
+import time
+from typing import Optional, Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """O circuito do modelo está aberto: a chamada à API nem é tentada."""
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Circuito do modelo '{model}' aberto. Nova tentativa em {retry_after:.1f}s.")
+        self.model = model
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Circuit breaker de um modelo da API.
+
+    - closed: as chamadas passam; `failure_threshold` falhas consecutivas abrem o circuito.
+    - open: as chamadas falham na hora (sem gastar cota nem esperar retries) por `recovery_timeout` segundos.
+    - half_open: uma chamada de teste passa; sucesso fecha o circuito, falha o abre de novo.
+
+    `on_state_change(model, old_state, new_state)` é chamado a cada transição.
+    """
+
+    def __init__(self, model: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 on_state_change: Optional[Callable[[str, str, str], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.on_state_change = on_state_change
+        self._clock = clock
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _transition(self, new_state: str):
+        old_state, self.state = self.state, new_state
+        if new_state == OPEN:
+            self.opened_at = self._clock()
+            self.times_opened += 1
+        log = logger.warning if new_state == OPEN else logger.info
+        log(f"Circuito do modelo '{self.model}': {old_state} -> {new_state}.")
+        if self.on_state_change:
+            self.on_state_change(self.model, old_state, new_state)
+
+    def retry_after(self) -> float:
+        """Segundos até o circuito aberto aceitar uma chamada de teste (0 se não estiver aberto)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.recovery_timeout - self._clock())
+
+    def allow_request(self) -> bool:
+        """Indica se uma chamada pode ser feita agora; no half_open, reserva a chamada de teste."""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            now = self._clock()
+            # Uma chamada de teste por vez; se ela nunca terminar (ex: cancelada), outra pode testar depois do timeout
+            if self._probe_started_at is not None and now - self._probe_started_at < self.recovery_timeout:
+                self.rejected += 1
+                return False
+            self._probe_started_at = now
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._probe_started_at = None
+        if self.state != CLOSED:
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_started_at = None
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self._transition(OPEN)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_after_seconds": round(self.retry_after(), 1),
+        }
+
+def decorrelated_jitter(previous: float, base: float, cap: float, rng: random.Random = random) -> float:
+    """
+    Próximo intervalo de backoff com "decorrelated jitter": aleatório entre `base` e três vezes o
+    intervalo anterior, limitado a `cap`. Evita que chamadas que falharam juntas retentem juntas.
+    """
+    return min(cap, rng.uniform(base, max(base, previous * 3)))
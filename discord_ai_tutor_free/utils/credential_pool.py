@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any, Callable
+import google.ai.generativelanguage as glm
+
+from utils.rate_limiter import RateLimiter, RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# Chave concedida pela última reserva de cota da tarefa atual (cada requisição roda na própria tarefa)
+_granted: ContextVar[Optional["ApiCredential"]] = ContextVar("granted_credential", default=None)
+
+def is_quota_error(error: Exception) -> bool:
+    """Indica se o erro da API é um 429 (cota da chave esgotada: ResourceExhausted/TooManyRequests do google-api-core)."""
+    return getattr(error, "code", None) == 429
+
+class ApiCredential:
+    """Uma chave da API com o próprio rate limiter e contadores de uso."""
+
+    def __init__(self, key: str, index: int, rate_limiter: RateLimiter):
+        self.key = key
+        self.label = f"chave-{index + 1}" # Identifica a chave em logs e estatísticas sem expô-la
+        self.index = index
+        self.rate_limiter = rate_limiter
+        self.rate_limited = 0 # Respostas 429 recebidas
+        self.consecutive_rate_limits = 0
+        self.disabled_until = 0.0 # Fora do rodízio até este instante (time.monotonic())
+
+class CredentialPool:
+    """
+    Pool de chaves da API, cada uma com o próprio RateLimiter (cotas de API_RATE_LIMITS por chave).
+
+    Tem a mesma interface de reserva do RateLimiter (try_acquire, acquire, record_usage, get_stats),
+    então pode ficar atrás do RequestScheduler: cada reserva vai para a chave com mais folga no
+    modelo, e `granted()` informa, à requisição que acabou de reservar, qual chave usar na chamada.
+    Uma chave que recebe 429 sai do rodízio por `cooldown` segundos, tempo que dobra a cada 429
+    seguido (até `max_cooldown`) e volta ao normal com a primeira chamada bem-sucedida.
+    """
+
+    def __init__(self, keys: List[str], quotas: Dict[str, Dict[str, float]], cooldown: float = 60.0,
+                 max_cooldown: float = 3600.0, client_factory: Optional[Callable[[str], Any]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if not keys:
+            raise ValueError("O pool de chaves precisa de pelo menos uma chave da API.")
+        self._clock = clock
+        self.credentials = [ApiCredential(key, index, RateLimiter(quotas, clock)) for index, key in enumerate(keys)]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._client_factory = client_factory
+        self._clients: Dict[str, Any] = {}
+
+    @property
+    def default(self) -> ApiCredential:
+        """A primeira chave, configurada globalmente com genai.configure."""
+        return self.credentials[0]
+
+    def available(self) -> List[ApiCredential]:
+        now = self._clock()
+        return [credential for credential in self.credentials if credential.disabled_until <= now]
+
+    def granted(self) -> Optional[ApiCredential]:
+        """Chave da última reserva de cota feita pela tarefa atual."""
+        return _granted.get()
+
+    def try_acquire(self, model: str, tokens: int = 0, waited: float = 0.0) -> float:
+        """
+        Reserva a cota na chave com mais folga no modelo, sem aguardar. Retorna 0.0 se reservou;
+        senão, os segundos até alguma chave ter cota (ou voltar ao rodízio), sem consumir nada.
+        """
+        candidates = sorted(self.available(), key=lambda credential: credential.rate_limiter.headroom(model), reverse=True)
+        if not candidates:
+            return max(0.01, min(credential.disabled_until for credential in self.credentials) - self._clock())
+        waits = []
+        for credential in candidates:
+            wait = credential.rate_limiter.try_acquire(model, tokens, waited)
+            if wait <= 0:
+                _granted.set(credential)
+                return 0.0
+            waits.append(wait)
+        return min(waits)
+
+    async def acquire(self, model: str, tokens: int = 0, deadline: Optional[float] = None) -> float:
+        """Reserva a cota aguardando se necessário (uso direto, sem o RequestScheduler)."""
+        start = self._clock()
+        while True:
+            wait = self.try_acquire(model, tokens, self._clock() - start)
+            if wait <= 0:
+                return self._clock() - start
+            if deadline is not None and self._clock() + wait > deadline:
+                raise RateLimitExceeded(model, self._clock() + wait - deadline)
+            await asyncio.sleep(wait)
+
+    def record_usage(self, model: str, reserved_tokens: int, actual_tokens: int):
+        """Ajusta o consumo real de tokens na chave usada pela chamada da tarefa atual."""
+        (self.granted() or self.default).rate_limiter.record_usage(model, reserved_tokens, actual_tokens)
+
+    def report_rate_limited(self, credential: ApiCredential):
+        """Tira do rodízio uma chave que recebeu 429."""
+        credential.rate_limited += 1
+        credential.consecutive_rate_limits += 1
+        cooldown = min(self.max_cooldown, self.cooldown * 2 ** (credential.consecutive_rate_limits - 1))
+        credential.disabled_until = self._clock() + cooldown
+        logger.warning(f"Chave '{credential.label}' recebeu 429. Fora do rodízio por {cooldown:.0f}s ({len(self.available())} chave(s) disponível(is)).")
+
+    def report_success(self, credential: ApiCredential):
+        credential.consecutive_rate_limits = 0
+
+    def client_for(self, credential: ApiCredential) -> Optional[Any]:
+        """
+        Cliente assíncrono da API autenticado com a chave, criado uma vez por chave.
+        None para a chave padrão, que usa o cliente global de genai.configure.
+        """
+        if credential is self.default and self._client_factory is None:
+            return None
+        if credential.key not in self._clients:
+            factory = self._client_factory or _default_client_factory
+            self._clients[credential.key] = factory(credential.key)
+        return self._clients[credential.key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Saldo dos baldes por modelo somado entre as chaves, no formato de RateLimiter.get_stats."""
+        totals: Dict[str, Dict[str, Any]] = {}
+        for credential in self.credentials:
+            for model, stats in credential.rate_limiter.get_stats().items():
+                total = totals.setdefault(model, {"rpm_available": 0, "tpm_available": 0, "rpd_available": 0,
+                                                  "granted": 0, "rejected": 0, "total_wait": 0.0})
+                for field in ("rpm_available", "tpm_available", "rpd_available", "granted", "rejected"):
+                    total[field] += stats[field]
+                total["total_wait"] += stats["avg_wait_seconds"] * stats["granted"]
+        for total in totals.values():
+            total_wait = total.pop("total_wait")
+            total["rpm_available"] = round(total["rpm_available"], 2)
+            total["rpd_available"] = round(total["rpd_available"], 2)
+            total["avg_wait_seconds"] = round(total_wait / total["granted"], 3) if total["granted"] else 0.0
+        return totals
+
+    def get_key_stats(self) -> Dict[str, Any]:
+        """Uso e estado de cada chave (sem expor as chaves)."""
+        now = self._clock()
+        return {
+            credential.label: {
+                "available": credential.disabled_until <= now,
+                "disabled_seconds": round(max(0.0, credential.disabled_until - now), 1),
+                "rate_limited": credential.rate_limited,
+                "granted": sum(limiter.granted for limiter in credential.rate_limiter.limiters.values()),
+            }
+            for credential in self.credentials
+        }
+
+def _default_client_factory(key: str) -> Any:
+    return glm.GenerativeServiceAsyncClient(client_options={"api_key": key})
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Optional, Dict, Awaitable, Callable, Iterator, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class DeadlineExceeded(Exception):
+    """O orçamento de tempo da requisição acabou durante uma etapa."""
+
+    def __init__(self, stage: str, budget: float):
+        super().__init__(f"Prazo de {budget:.1f}s esgotado na etapa '{stage}'.")
+        self.stage = stage
+        self.budget = budget
+
+class Deadline:
+    """
+    Orçamento de tempo de uma requisição, criado quando a mensagem chega e repassado
+    por todas as etapas (cache, fila do rate limit, chamada à API...).
+
+    - `remaining()`/`expired()` consultam o tempo restante.
+    - `stage(nome)` mede o tempo gasto em uma etapa (acumulado em `stages`).
+    - `run(awaitable, nome)` executa a etapa cancelando-a se o prazo acabar (DeadlineExceeded).
+    """
+
+    def __init__(self, budget: float, clock: Callable[[], float] = time.monotonic):
+        self.budget = budget
+        self._clock = clock
+        self.started_at = clock()
+        self.expires_at = self.started_at + budget # Instante de time.monotonic(), como o deadline do RequestScheduler
+        self.stages: Dict[str, float] = {} # Etapa -> segundos gastos
+        self.exceeded_stage: Optional[str] = None # Etapa em que o prazo acabou, se acabou
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self) -> bool:
+        return self._clock() >= self.expires_at
+
+    def elapsed(self) -> float:
+        return self._clock() - self.started_at
+
+    def exceeded(self, stage: str) -> DeadlineExceeded:
+        """Registra que o prazo acabou na etapa e retorna a exceção correspondente."""
+        if self.exceeded_stage is None:
+            self.exceeded_stage = stage
+        logger.warning(f"Prazo de {self.budget:.1f}s esgotado na etapa '{stage}' (etapas: {self.format_stages()}).")
+        return DeadlineExceeded(stage, self.budget)
+
+    def check(self, stage: str):
+        """Levanta DeadlineExceeded se o prazo já acabou antes de iniciar a etapa."""
+        if self.expired():
+            raise self.exceeded(stage)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + self._clock() - start
+
+    async def run(self, awaitable: Awaitable[T], stage: str) -> T:
+        """Aguarda a etapa por no máximo o tempo restante; depois disso ela é cancelada."""
+        with self.stage(stage):
+            try:
+                return await asyncio.wait_for(awaitable, self.remaining())
+            except asyncio.TimeoutError:
+                raise self.exceeded(stage) from None
+
+    def format_stages(self) -> str:
+        return ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.stages.items()) or "nenhuma"
+
+def timed(deadline: Optional[Deadline], stage: str):
+    """Mede a etapa no prazo, se houver um (sem prazo, não mede nada)."""
+    return deadline.stage(stage) if deadline is not None else nullcontext()
+
+async def within(deadline: Optional[Deadline], awaitable: Awaitable[T], stage: str) -> T:
+    """Aguarda a etapa limitada pelo prazo, se houver um."""
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable, stage)
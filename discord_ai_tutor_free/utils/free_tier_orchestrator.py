@@ -1,55 +1,132 @@
 import google.generativeai as genai
 import logging
 import asyncio
+import inspect
+import re
 import time
-from typing import Optional, List, Dict, Any, NamedTuple
-from tools.response_cache import ResponseCache
-from config import GOOGLE_API_KEY, CACHE_FILE, CACHE_EXPIRATION_TIME
+from typing import Optional, List, Dict, Any, NamedTuple, Tuple, AsyncIterator
+from tools.simple_classifier import SimpleClassifier
+from config import (
+    GOOGLE_API_KEY, GOOGLE_API_KEYS, CACHE_EXPIRY_INTERVAL, CACHE_REWARM_LIMIT, CACHE_REWARM_INTERVAL,
+    API_RATE_LIMITS, API_OUTPUT_TOKENS_ESTIMATE, API_PRIORITY_AGING_SECONDS, API_BATCHING_ENABLED, API_BATCH_WINDOW, API_BATCH_MAX_SIZE,
+    API_CIRCUIT_FAILURE_THRESHOLD, API_CIRCUIT_RECOVERY_TIMEOUT, API_RETRY_MAX_BACKOFF,
+    API_CASCADE_ENABLED, API_CASCADE_LIGHT_MODEL, API_CASCADE_LIGHT_CATEGORIES, API_CASCADE_LIGHT_MAX_WORDS,
+    API_KEY_COOLDOWN, API_KEY_MAX_COOLDOWN
+)
 from utils.prompt_builder import PromptBuilder
+from utils.cache_factory import create_response_cache
+from utils.rate_limiter import RateLimitExceeded, estimate_tokens
+from utils.request_scheduler import RequestScheduler, Priority
+from utils.micro_batcher import MicroBatcher, build_batch_prompt, split_batch_response
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, OPEN, CLOSED, decorrelated_jitter
+from utils.deadline import Deadline, DeadlineExceeded, timed, within
+from utils.model_router import ModelRouter
+from utils.credential_pool import CredentialPool, ApiCredential, is_quota_error
 from tools.metrics import ProductionMetrics
 from tools.alert_system import AlertSystem # Importa AlertSystem
 
 logger = logging.getLogger(__name__)
 
+# Versões antigas do google-generativeai não aceitam system_instruction; nelas a instrução vai no início do prompt
+_SUPPORTS_SYSTEM_INSTRUCTION = "system_instruction" in inspect.signature(genai.GenerativeModel.__init__).parameters
+
+def _version_key(version: str) -> Tuple[Tuple[int, ...], str]:
+    """Chave de ordenação numérica de versões de template ("v1.10" vem depois de "v1.9" e "v10" depois de "v9")."""
+    return tuple(int(number) for number in re.findall(r"\d+", version)), version
+
+async def _stream_chunks(response: Any) -> AsyncIterator[Any]:
+    """
+    Produz os trechos de uma resposta em streaming assim que chegam. O __aiter__ de
+    AsyncGenerateContentResponse (google-generativeai 0.3.x) lê o trecho seguinte antes de entregar o
+    atual, atrasando cada trecho em um; por isso o iterador da API é consumido diretamente, depois do
+    primeiro trecho, já lido pela própria biblioteca.
+    """
+    iterator = getattr(response, "_iterator", None)
+    if iterator is None or getattr(response, "_done", True):
+        async for chunk in response:
+            yield chunk
+        return
+    for chunk in list(response._chunks):
+        yield chunk
+    async for chunk in iterator:
+        yield chunk
+
+BLOCKED_RESPONSE = "Desculpe, sua pergunta foi bloqueada pelo filtro de segurança da IA. Por favor, tente reformular."
+
+# Resultado de uma chamada à API: respostas vazias ou bloqueadas sobem na cascata de modelos, falhas não
+_OK, _EMPTY, _BLOCKED, _FAILED = "ok", "empty", "blocked", "failed"
+
 class Agent(NamedTuple):
     """Representa um agente especializado com suas configurações."""
     name: str
     model: str
     instruction: str
+    generation_config: Optional[Dict[str, Any]] = None
 
 class FreeTierOrchestrator:
     def __init__(self, default_model_name: str = "gemini-pro"):
         if not GOOGLE_API_KEY:
             raise ValueError("GOOGLE_API_KEY não está configurada nas variáveis de ambiente.")
-        genai.configure(api_key=GOOGLE_API_KEY)
+        genai.configure(api_key=GOOGLE_API_KEYS[0]) # Chave padrão; as demais chaves do pool têm cliente próprio
         
         self.default_model_name = default_model_name
-        self.cache = ResponseCache(cache_file=CACHE_FILE, ttl_hours=CACHE_EXPIRATION_TIME / 3600)
+        self.cache = create_response_cache()
         self.prompt_builder = PromptBuilder() # Instancia o PromptBuilder
         
         self._agent_configs = self._define_agent_configs() # Define as configurações dos agentes
         self.agents: Dict[str, Agent] = {} # Agentes serão carregados sob demanda
+        self.models: Dict[Tuple[str, str, str], Any] = {} # GenerativeModel configurado de cada agente, modelo e chave da API ((agente, modelo, chave) -> instância), criado no primeiro uso
         self.metrics_collector = ProductionMetrics() # Instancia o coletor de métricas
         self.alert_system = AlertSystem(self.metrics_collector) # Instancia o sistema de alertas
         self.api_calls_made = 0 # Manter para compatibilidade e transição
         self.cache_hits_saved = 0 # Manter para compatibilidade e transição
         self.agent_metrics: Dict[str, Dict[str, int]] = {} # Métricas por agente, inicializadas no lazy load
 
-        # Rate Limiting: 10 requests por minuto (60 segundos / 10 requests = 6 segundos por request)
-        self.rate_limit_interval = 60 / 10 # Segundos entre requests
-        self.last_request_time = 0.0
-        self.rate_limit_semaphore = asyncio.Semaphore(1) # Garante que apenas 1 request por vez respeite o intervalo
+        # Rate Limiting: baldes de tokens por modelo (RPM, TPM e RPD) configurados em API_RATE_LIMITS, um conjunto
+        # por chave da API (pool de chaves): cada chamada usa a chave com mais folga e chaves com 429 saem do rodízio
+        self.credentials = CredentialPool(GOOGLE_API_KEYS, API_RATE_LIMITS, API_KEY_COOLDOWN, API_KEY_MAX_COOLDOWN)
+        self.rate_limiter = self.credentials
+        # Fila por prioridade na frente do rate limit: usuários antes de comandos administrativos e do background
+        self.scheduler = RequestScheduler(self.rate_limiter, aging_seconds=API_PRIORITY_AGING_SECONDS)
+        # Cascata de modelos: perguntas simples usam primeiro o modelo leve, com cota própria no rate limiter
+        self.router = ModelRouter(API_CASCADE_LIGHT_MODEL, API_CASCADE_LIGHT_CATEGORIES, API_CASCADE_LIGHT_MAX_WORDS) if API_CASCADE_ENABLED else None
+        # Reclassifica as perguntas re-aquecidas (o cache guarda só a pergunta), para roteá-las como uma pergunta nova
+        self.classifier = SimpleClassifier()
+        # Circuit breaker por modelo: durante uma instabilidade da API, as chamadas falham na hora e vão para o fallback
+        self.circuit_breakers: Dict[str, CircuitBreaker] = {}
+        self._refreshing: set = set() # Prompts com revalidação em andamento
+        self._refresh_tasks: set = set()
+        self.rewarmed_entries = 0 # Respostas regeneradas sob uma nova versão do template
+        # Singleflight: chave do cache -> resposta em andamento. Perguntas idênticas simultâneas
+        # aguardam a mesma chamada à API em vez de enfileirar chamadas próprias no rate limit.
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.deduplicated_calls = 0
+        self.streamed_responses = 0 # Respostas da API entregues em streaming
+        self.total_first_chunk_time = 0.0 # Soma do tempo até o primeiro trecho das respostas em streaming
+        # Micro-batching (opt-in): perguntas distintas do mesmo agente e prioridade que chegam juntas
+        # viram uma única chamada à API, com uma resposta delimitada por pergunta
+        self.batcher = MicroBatcher(self._call_gemini_batch, API_BATCH_WINDOW, API_BATCH_MAX_SIZE) if API_BATCHING_ENABLED else None
+        self.batched_api_calls = 0 # Chamadas à API que responderam mais de uma pergunta
+        self.batched_questions = 0 # Perguntas respondidas por chamadas em lote
+        self.batch_fallbacks = 0 # Perguntas de um lote refeitas individualmente (resposta não separada)
+        # Prazos (deadlines): tempo gasto por etapa nas requisições com prazo e etapas em que ele acabou
+        self.deadline_requests = 0
+        self.stage_time_totals: Dict[str, float] = {}
+        self.deadlines_exceeded: Dict[str, int] = {}
         self.total_response_time = 0
         self.successful_api_calls = 0
+        self._background_tasks: List[asyncio.Task] = []
 
         logger.info(f"FreeTierOrchestrator inicializado. Agentes serão carregados sob demanda.")
 
-    def _define_agent_configs(self) -> Dict[str, Dict[str, str]]:
+    @staticmethod
+    def _define_agent_configs() -> Dict[str, Dict[str, Any]]:
         """Define as configurações dos agentes especializados."""
         return {
             "concept": {
                 "name": "ConceptExplainer",
                 "model": "gemini-pro",
+                "generation_config": {"temperature": 0.7, "max_output_tokens": 600}, # ~300 palavras
                 "instruction": """
 Você é um tutor especialista em IA que explica conceitos de forma clara e didática.
 REGRAS: Respostas CONCISAS (máximo 300 palavras), use analogias simples,
@@ -59,6 +136,7 @@ termine com uma pergunta para verificar a compreensão do usuário.
             "code": {
                 "name": "CodeHelper",
                 "model": "gemini-pro",
+                "generation_config": {"temperature": 0.2, "max_output_tokens": 1024}, # Código mais determinístico e mais longo
                 "instruction": """
 Você é um assistente de programação especializado em IA. Forneça exemplos de código,
 ajude a depurar e explique implementações.
@@ -69,6 +147,7 @@ seja direto e objetivo.
             "resource": {
                 "name": "ResourceRecommender",
                 "model": "gemini-pro",
+                "generation_config": {"temperature": 0.5, "max_output_tokens": 600},
                 "instruction": """
 Você é um recomendador de recursos de aprendizado de IA. Recomende materiais
 gratuitos como cursos, livros, tutoriais e artigos.
@@ -79,6 +158,7 @@ forneça links se possível (mesmo que placeholders), seja encorajador.
             "general": { # Agente de fallback para perguntas gerais
                 "name": "GeneralResponder",
                 "model": "gemini-pro",
+                "generation_config": {"temperature": 0.7, "max_output_tokens": 400},
                 "instruction": """
 Você é um assistente de IA amigável e prestativo. Responda a perguntas gerais
 de forma educada e concisa.
@@ -98,29 +178,110 @@ de forma educada e concisa.
             self.agents[agent_key] = Agent(
                 name=config["name"],
                 model=config["model"],
-                instruction=config["instruction"]
+                instruction=config["instruction"],
+                generation_config=config.get("generation_config")
             )
             # Inicializa as métricas para o agente se ainda não existirem
             if self.agents[agent_key].name not in self.agent_metrics:
-                self.agent_metrics[self.agents[agent_key].name] = {"api_calls": 0, "cache_hits": 0}
+                self.agent_metrics[self.agents[agent_key].name] = self._new_agent_metrics()
             logger.info(f"Agente '{self.agents[agent_key].name}' carregado sob demanda.")
         return self.agents[agent_key]
 
-    async def _apply_rate_limit(self):
-        """Aplica o rate limiting para chamadas à API."""
-        async with self.rate_limit_semaphore:
-            elapsed = time.time() - self.last_request_time
-            if elapsed < self.rate_limit_interval:
-                wait_time = self.rate_limit_interval - elapsed
-                logger.warning(f"Rate limit atingido. Aguardando {wait_time:.2f} segundos.")
-                await asyncio.sleep(wait_time)
-            self.last_request_time = time.time()
-
-    async def _call_gemini_api(self, agent: Agent, user_question: str, max_retries: int = 3, initial_backoff: int = 1, user_level: str = "iniciante", language: str = "pt") -> Optional[str]:
+    @staticmethod
+    def _new_agent_metrics() -> Dict[str, Any]:
+        """Métricas de um agente: chamadas, hits, escaladas na cascata e chamadas/latência por modelo."""
+        return {"api_calls": 0, "cache_hits": 0, "escalations": 0, "models": {}}
+
+    def _build_model(self, agent: Agent) -> Any:
+        """Cria o GenerativeModel do agente, com a instrução do agente como system instruction e a sua generation config."""
+        kwargs: Dict[str, Any] = {"generation_config": agent.generation_config}
+        if _SUPPORTS_SYSTEM_INSTRUCTION:
+            kwargs["system_instruction"] = agent.instruction.strip()
+        return genai.GenerativeModel(agent.model, **kwargs)
+
+    def _get_model(self, agent: Agent, credential: Optional[ApiCredential] = None) -> Any:
         """
-        Faz uma chamada à API do Google Gemini com retries e backoff exponencial,
-        usando o PromptBuilder para construir o prompt.
+        Retorna o GenerativeModel do agente (no modelo escolhido) autenticado com a chave da API,
+        reutilizado entre requisições e tentativas. Sem `credential`, usa a chave padrão.
         """
+        credential = credential or self.credentials.default
+        key = (agent.name, agent.model, credential.label)
+        model_instance = self.models.get(key)
+        if model_instance is None:
+            model_instance = self.models[key] = self._build_model(agent)
+            client = self.credentials.client_for(credential)
+            if client is not None:
+                # O google-generativeai só configura a chave globalmente: o cliente da chave é atribuído ao modelo
+                model_instance._async_client = client
+        return model_instance
+
+    def _route_model(self, agent_key: str, agent: Agent, classification_result: Dict[str, Any], question: str) -> str:
+        """Modelo da primeira tentativa da pergunta: o leve para perguntas simples (cascata ativa) ou o do agente."""
+        if self.router is None:
+            return agent.model
+        return self.router.choose_model(agent_key, agent.model, classification_result, question)
+
+    @staticmethod
+    def _agent_on_model(agent: Agent, model: str) -> Agent:
+        """O agente com a mesma instrução e generation config, mas chamando outro modelo."""
+        return agent if agent.model == model else agent._replace(model=model)
+
+    def _record_escalation(self, agent: Agent, model: str, reason: str):
+        self.agent_metrics[agent.name]["escalations"] += 1
+        logger.info(f"Resposta {reason} do modelo '{model}' para o agente '{agent.name}'. Escalando para '{agent.model}'.")
+
+    def _resolve_agent_key(self, classification_result: Dict[str, Any]) -> str:
+        """Mapeia a categoria principal do classificador para a chave do agente ('general' como fallback)."""
+        main_category = classification_result['categories'][0] if classification_result['categories'] else "general"
+        return main_category if main_category in ("concept", "code", "resource") else "general"
+
+    def _cache_namespace(self, agent_key: str, version: Optional[str] = None) -> str:
+        """Namespace do cache de um agente: as respostas dependem do agente e da versão do template."""
+        return f"{agent_key}@{version or self.prompt_builder.current_version}"
+
+    def _fallback_namespaces(self, agent_key: str) -> List[Optional[str]]:
+        """
+        Namespaces consultados em um miss: as demais versões do template (mais recentes primeiro)
+        e, por último, as chaves sem namespace gravadas antes do versionamento.
+        """
+        versions = sorted((v for v in self.prompt_builder.templates if v != self.prompt_builder.current_version),
+                          key=_version_key, reverse=True)
+        return [self._cache_namespace(agent_key, version) for version in versions] + [None]
+
+    def _get_breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.circuit_breakers:
+            self.circuit_breakers[model] = CircuitBreaker(
+                model, API_CIRCUIT_FAILURE_THRESHOLD, API_CIRCUIT_RECOVERY_TIMEOUT, on_state_change=self._on_circuit_state_change
+            )
+        return self.circuit_breakers[model]
+
+    def _on_circuit_state_change(self, model: str, old_state: str, new_state: str):
+        """Os alertas de falhas consecutivas da API acompanham as aberturas e o fechamento do circuito."""
+        if new_state == OPEN:
+            self.alert_system.increment_api_failure()
+        elif new_state == CLOSED:
+            self.alert_system.reset_api_failures()
+
+    async def _apply_rate_limit(self, model: str, tokens: int = 0, priority: Priority = Priority.INTERACTIVE,
+                                deadline: Optional[Deadline] = None) -> ApiCredential:
+        """
+        Aplica o rate limiting para chamadas à API, reservando uma requisição e `tokens` tokens da cota do modelo.
+        Com a cota esgotada, as requisições são atendidas pelo escalonador na ordem de prioridade (com envelhecimento).
+        Com `deadline`, levanta DeadlineExceeded (sem consumir a cota) se a vez não chegar dentro do prazo.
+        Retorna a chave da API em que a cota foi reservada.
+        """
+        if deadline is None:
+            await self.scheduler.acquire(model, tokens, priority)
+        else:
+            with deadline.stage("queue"):
+                try:
+                    await self.scheduler.acquire(model, tokens, priority, deadline=deadline.expires_at)
+                except RateLimitExceeded:
+                    raise deadline.exceeded("queue") from None
+        return self.credentials.granted() or self.credentials.default
+
+    def _build_prompt(self, agent: Agent, user_question: str, user_level: str = "iniciante", language: str = "pt") -> Optional[str]:
+        """Constrói o prompt de uma pergunta para o agente usando o PromptBuilder."""
         # Prepara os dados para o PromptBuilder
         prompt_data = {
             "question": user_question,
@@ -131,137 +292,626 @@ de forma educada e concisa.
         
         # Constrói o prompt otimizado usando o PromptBuilder
         # Define um limite de tokens para o prompt de entrada (ex: 1000 tokens)
-        full_prompt = self.prompt_builder.optimize_prompt(agent.name.lower().replace("explainer", "").replace("helper", "").replace("recommender", "").replace("responder", ""), prompt_data, max_tokens=1000)
-        
+        return self.prompt_builder.optimize_prompt(agent.name.lower().replace("explainer", "").replace("helper", "").replace("recommender", "").replace("responder", ""), prompt_data, max_tokens=1000)
+
+    async def _call_gemini_api(self, agent: Agent, user_question: str, max_retries: int = 3, initial_backoff: int = 1, user_level: str = "iniciante", language: str = "pt", priority: Priority = Priority.INTERACTIVE,
+                               deadline: Optional[Deadline] = None, model: Optional[str] = None) -> Optional[str]:
+        """
+        Faz uma chamada à API do Google Gemini com retries e backoff exponencial,
+        usando o PromptBuilder para construir o prompt. `model` é o modelo da primeira
+        tentativa (padrão: o do agente); se a resposta dele vier vazia ou bloqueada, a
+        pergunta sobe para o modelo do agente.
+        """
+        full_prompt = self._build_prompt(agent, user_question, user_level, language)
         if not full_prompt:
             logger.error(f"Falha ao construir o prompt para o agente '{agent.name}'.")
             return None
+        model = model or agent.model
+        response, outcome = await self._send_prompt_with_outcome(
+            self._agent_on_model(agent, model), full_prompt, max_retries, initial_backoff, priority, deadline=deadline
+        )
+        if outcome in (_EMPTY, _BLOCKED) and model != agent.model:
+            self._record_escalation(agent, model, "vazia" if outcome == _EMPTY else "bloqueada")
+            response = await self._send_prompt(agent, full_prompt, max_retries, initial_backoff, priority, deadline=deadline)
+        return response
 
+    async def _send_prompt(self, agent: Agent, full_prompt: str, max_retries: int = 3, initial_backoff: int = 1,
+                           priority: Priority = Priority.INTERACTIVE, output_tokens: int = API_OUTPUT_TOKENS_ESTIMATE,
+                           generation_config: Optional[Dict[str, Any]] = None, deadline: Optional[Deadline] = None) -> Optional[str]:
+        """
+        Envia um prompt já construído à API, com rate limiting, retries e backoff com jitter.
+        Com o circuito do modelo aberto, retorna None na hora (o chamador usa o fallback).
+        `generation_config` sobrescreve, só nesta chamada, a generation config do agente.
+        Com `deadline`, a espera na fila, a chamada e os retries respeitam o prazo: a chamada em andamento
+        é cancelada e DeadlineExceeded é levantada quando ele acaba (sem contar como falha da API).
+        """
+        response, _ = await self._send_prompt_with_outcome(
+            agent, full_prompt, max_retries, initial_backoff, priority, output_tokens, generation_config, deadline
+        )
+        return response
+
+    async def _send_prompt_with_outcome(self, agent: Agent, full_prompt: str, max_retries: int = 3, initial_backoff: int = 1,
+                                        priority: Priority = Priority.INTERACTIVE, output_tokens: int = API_OUTPUT_TOKENS_ESTIMATE,
+                                        generation_config: Optional[Dict[str, Any]] = None,
+                                        deadline: Optional[Deadline] = None) -> Tuple[Optional[str], str]:
+        """Como _send_prompt, mas retorna também o resultado da chamada (ok, vazia, bloqueada ou falha)."""
+        if not _SUPPORTS_SYSTEM_INSTRUCTION:
+            full_prompt = f"{agent.instruction.strip()}\n\n{full_prompt}"
+        breaker = self._get_breaker(agent.model)
+        request_options = {"generation_config": generation_config} if generation_config else {}
+        reserved_tokens = estimate_tokens(full_prompt) + output_tokens
+        backoff = initial_backoff
         for attempt in range(max_retries):
-            await self._apply_rate_limit() # Aplica rate limit antes de cada tentativa
+            if deadline is not None:
+                deadline.check("queue") # Antes do circuit breaker, para não ocupar a chamada de teste do half-open
+            if not breaker.allow_request():
+                logger.warning(f"Circuito do modelo '{agent.model}' aberto. Chamada para o agente '{agent.name}' não realizada.")
+                return None, _FAILED
+            credential = await self._apply_rate_limit(agent.model, reserved_tokens, priority, deadline) # Aplica rate limit antes de cada tentativa
+            model_instance = self._get_model(agent, credential)
             start_time = time.time() # Inicia a contagem do tempo de resposta
             try:
-                model_instance = genai.GenerativeModel(agent.model)
-                
                 logger.info(f"Chamando API para agente '{agent.name}' (tentativa {attempt + 1}/{max_retries}). Prompt: '{full_prompt[:50]}...'")
-                response = await model_instance.generate_content_async(full_prompt)
+                response = await within(deadline, model_instance.generate_content_async(full_prompt, **request_options), "api")
                 
                 end_time = time.time()
                 response_time = end_time - start_time
-                self.total_response_time += response_time
-                self.successful_api_calls += 1
-                self.metrics_collector.update_metric('response_time_avg', self.total_response_time / self.successful_api_calls)
-                self.metrics_collector.update_metric('api_quota_usage', self.api_calls_made + 1) # Incrementa o uso da cota
-                
-                self.api_calls_made += 1 # Manter para compatibilidade
-                self.agent_metrics[agent.name]["api_calls"] += 1
+                self._record_api_call(agent, response_time)
                 
                 if response and response.candidates and response.candidates[0].content.parts:
                     generated_text = response.candidates[0].content.parts[0].text
+                    self.rate_limiter.record_usage(agent.model, reserved_tokens, self._count_tokens(response, full_prompt, generated_text))
                     logger.info(f"Resposta da API recebida para agente '{agent.name}'. Tempo: {response_time:.2f}s")
-                    self.metrics_collector.update_metric('error_rate', 0) # Reseta a taxa de erro se a chamada for bem-sucedida
-                    self.alert_system.reset_api_failures() # Reseta o contador de falhas consecutivas
-                    return generated_text
+                    self._record_api_success(agent.model)
+                    self.credentials.report_success(credential)
+                    return generated_text, _OK
                 else:
                     logger.warning(f"Resposta da API vazia ou em formato inesperado para agente '{agent.name}'.")
-                    self.metrics_collector.update_metric('error_rate', self.metrics_collector.get_metric('error_rate') + 1) # Incrementa erro
-                    self.alert_system.increment_api_failure() # Incrementa falha consecutiva
-                    return None
+                    self._record_api_failure(agent.model, api_reachable=True)
+                    return None, _EMPTY
             except genai.types.BlockedPromptException as e:
                 logger.error(f"Prompt bloqueado pela API para agente '{agent.name}': {e}")
-                self.metrics_collector.update_metric('error_rate', self.metrics_collector.get_metric('error_rate') + 1) # Incrementa erro
-                self.alert_system.increment_api_failure() # Incrementa falha consecutiva
-                return "Desculpe, sua pergunta foi bloqueada pelo filtro de segurança da IA. Por favor, tente reformular."
+                self._record_api_failure(agent.model, api_reachable=True)
+                return BLOCKED_RESPONSE, _BLOCKED
+            except DeadlineExceeded:
+                raise # A chamada foi cancelada pelo prazo da requisição, não por falha da API
             except Exception as e:
                 logger.error(f"Erro na chamada da API para agente '{agent.name}' (tentativa {attempt + 1}/{max_retries}): {e}")
-                self.metrics_collector.update_metric('error_rate', self.metrics_collector.get_metric('error_rate') + 1) # Incrementa erro
-                self.alert_system.increment_api_failure() # Incrementa falha consecutiva
+                if is_quota_error(e):
+                    # 429: a cota desta chave acabou, mas a API está no ar. A chave sai do rodízio e,
+                    # havendo outra disponível, a próxima tentativa vai para ela sem backoff.
+                    self.credentials.report_rate_limited(credential)
+                    self._record_api_failure(agent.model, api_reachable=True)
+                    if attempt < max_retries - 1 and self.credentials.available():
+                        continue
+                else:
+                    self._record_api_failure(agent.model)
                 if attempt < max_retries - 1:
-                    wait_time = initial_backoff * (2 ** attempt)
-                    logger.info(f"Retentando em {wait_time} segundos...")
-                    await asyncio.sleep(wait_time)
+                    backoff = decorrelated_jitter(backoff, initial_backoff, API_RETRY_MAX_BACKOFF)
+                    if deadline is not None and backoff >= deadline.remaining():
+                        raise deadline.exceeded("backoff") # Não há tempo para outra tentativa
+                    logger.info(f"Retentando em {backoff:.2f} segundos...")
+                    with timed(deadline, "backoff"):
+                        await asyncio.sleep(backoff)
                 else:
                     logger.error(f"Todas as {max_retries} tentativas falharam para agente '{agent.name}'.")
-        return None
+        return None, _FAILED
+
+    def _record_api_call(self, agent: Agent, response_time: float):
+        """Contabiliza uma chamada à API respondida (tempo de resposta, uso da cota e chamadas do agente)."""
+        self.total_response_time += response_time
+        self.successful_api_calls += 1
+        self.metrics_collector.update_metric('response_time_avg', self.total_response_time / self.successful_api_calls)
+        self.metrics_collector.update_metric('api_quota_usage', self.api_calls_made + 1) # Incrementa o uso da cota
+        
+        self.api_calls_made += 1 # Manter para compatibilidade
+        metrics = self.agent_metrics[agent.name]
+        metrics["api_calls"] += 1
+        # Chamadas e latência média por modelo: medem o ganho da cascata (modelo leve x modelo do agente)
+        model_metrics = metrics["models"].setdefault(agent.model, {"api_calls": 0, "avg_response_time": 0.0})
+        model_metrics["api_calls"] += 1
+        model_metrics["avg_response_time"] += (response_time - model_metrics["avg_response_time"]) / model_metrics["api_calls"]
 
-    async def generate_response(self, prompt: str, classification_result: Dict[str, Any], use_cache: bool = True) -> Optional[str]:
+    def _record_api_success(self, model: str):
+        self.metrics_collector.update_metric('error_rate', 0) # Reseta a taxa de erro se a chamada for bem-sucedida
+        self._get_breaker(model).record_success()
+
+    def _record_api_failure(self, model: str, api_reachable: bool = False):
+        """
+        Registra uma falha. Com `api_reachable` (resposta vazia ou bloqueada), a API respondeu
+        e a falha não conta para o circuit breaker.
+        """
+        self.metrics_collector.update_metric('error_rate', self.metrics_collector.get_metric('error_rate') + 1) # Incrementa erro
+        breaker = self._get_breaker(model)
+        if api_reachable:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+    async def _stream_prompt(self, agent: Agent, full_prompt: str, priority: Priority = Priority.INTERACTIVE,
+                             deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
+        """
+        Envia um prompt à API em modo streaming e produz os trechos do texto à medida que chegam.
+        Sem retries: a exceção da API (inclusive a de prompt bloqueado) é propagada, e o chamador decide
+        se refaz a chamada sem streaming ou em outro modelo. Com `deadline`, a espera por cada trecho é
+        limitada ao tempo restante (DeadlineExceeded).
+        """
+        if not _SUPPORTS_SYSTEM_INSTRUCTION:
+            full_prompt = f"{agent.instruction.strip()}\n\n{full_prompt}"
+        breaker = self._get_breaker(agent.model)
+        if deadline is not None:
+            deadline.check("queue")
+        if not breaker.allow_request():
+            raise CircuitOpenError(agent.model, breaker.retry_after())
+        reserved_tokens = estimate_tokens(full_prompt) + API_OUTPUT_TOKENS_ESTIMATE
+        credential = await self._apply_rate_limit(agent.model, reserved_tokens, priority, deadline)
+        model_instance = self._get_model(agent, credential)
+        start_time = time.time()
+        parts: List[str] = []
+        last_chunk = None
+        try:
+            logger.info(f"Chamando API em streaming para agente '{agent.name}'. Prompt: '{full_prompt[:50]}...'")
+            response = await within(deadline, model_instance.generate_content_async(full_prompt, stream=True), "api")
+            chunks = _stream_chunks(response).__aiter__()
+            while True:
+                try:
+                    chunk = await within(deadline, chunks.__anext__(), "api")
+                except StopAsyncIteration:
+                    break
+                last_chunk = chunk
+                if chunk.candidates and chunk.candidates[0].content.parts:
+                    text = chunk.candidates[0].content.parts[0].text
+                    if text:
+                        parts.append(text)
+                        yield text
+        except genai.types.BlockedPromptException as e:
+            logger.error(f"Prompt bloqueado pela API para agente '{agent.name}': {e}")
+            self._record_api_failure(agent.model, api_reachable=True)
+            raise
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if is_quota_error(e):
+                self.credentials.report_rate_limited(credential)
+                self._record_api_failure(agent.model, api_reachable=True)
+            else:
+                self._record_api_failure(agent.model)
+            raise
+        response_time = time.time() - start_time
+        self._record_api_call(agent, response_time)
+        if not parts:
+            logger.warning(f"Resposta da API vazia ou em formato inesperado para agente '{agent.name}'.")
+            self._record_api_failure(agent.model, api_reachable=True)
+            return
+        generated_text = "".join(parts)
+        self.rate_limiter.record_usage(agent.model, reserved_tokens, self._count_tokens(last_chunk, full_prompt, generated_text))
+        logger.info(f"Resposta da API recebida em streaming para agente '{agent.name}'. Tempo: {response_time:.2f}s")
+        self._record_api_success(agent.model)
+        self.credentials.report_success(credential)
+
+    def _count_tokens(self, response: Any, prompt: str, generated_text: str) -> int:
+        """Tokens consumidos pela chamada: informados pela API quando disponíveis, senão estimados."""
+        usage = getattr(response, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", None)
+        if isinstance(total, int):
+            return total
+        return estimate_tokens(prompt) + estimate_tokens(generated_text)
+
+    async def generate_response(self, prompt: str, classification_result: Dict[str, Any], use_cache: bool = True,
+                                priority: Priority = Priority.INTERACTIVE, deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         Gera uma resposta usando o modelo Gemini, roteando para o agente apropriado.
-        Integra cache, rate limiting, retries e fallbacks.
+        Integra cache, rate limiting, retries e fallbacks. `priority` define a vez da
+        chamada à API na fila do rate limit (padrão: pergunta de usuário). Com `deadline`,
+        o trabalho que passar do prazo é cancelado e a resposta vem do cache ou é degradada.
         """
-        # 1. Tenta buscar no cache primeiro
-        if use_cache:
-            cached_response = self.cache.get_cached_response(prompt)
-            if cached_response:
-                self.cache_hits_saved += 1 # Manter para compatibilidade
-                # Atribui o hit ao agente principal da classificação, se houver
-                main_category = classification_result['categories'][0] if classification_result['categories'] else "general"
-                # Ajusta o nome da categoria para corresponder às chaves do self.agents
-                if main_category == "concept": agent_key = "concept"
-                elif main_category == "code": agent_key = "code"
-                elif main_category == "resource": agent_key = "resource"
-                else: agent_key = "general"
-
-                if agent_key in self.agents:
-                    self.agent_metrics[self.agents[agent_key].name]["cache_hits"] += 1
-                
-                # Atualiza a métrica de eficiência do cache
-                total_requests = self.api_calls_made + self.cache_hits_saved + 1 # +1 para a requisição atual
-                cache_efficiency = (self.cache_hits_saved + 1) / total_requests if total_requests > 0 else 0
-                self.metrics_collector.update_metric('cache_efficiency', cache_efficiency)
+        try:
+            # A categoria do agente também define se o cache aceita perguntas similares (não só idênticas)
+            agent_key = self._resolve_agent_key(classification_result)
+
+            # 1. Tenta buscar no cache primeiro
+            if use_cache:
+                with timed(deadline, "cache"):
+                    cached_response = await self._lookup_cached(prompt, classification_result, agent_key)
+                if cached_response is not None:
+                    return cached_response
+
+            # 2. Perguntas idênticas já em andamento reutilizam a mesma chamada à API (singleflight)
+            namespace = self._cache_namespace(agent_key) # Versão do template usada para construir este prompt
+            flight_key = self.cache.key_for(prompt, namespace)
+            try:
+                joined, response = await self._join_inflight(flight_key, prompt, deadline)
+            except DeadlineExceeded:
+                return await self._fallback_response(prompt, agent_key, namespace, deadline)
+            if joined:
+                return response
 
-                logger.info(f"Resposta recuperada do cache para o prompt: '{prompt[:50]}...'")
-                return cached_response
+            flight = asyncio.get_running_loop().create_future()
+            self._inflight[flight_key] = flight
+            try:
+                response = await self._generate_uncached(prompt, classification_result, agent_key, namespace, use_cache, priority, deadline)
+            except DeadlineExceeded:
+                flight.cancel() # Quem aguardava esta chamada segue com uma chamada própria, dentro do próprio prazo
+                response = None
+            except asyncio.CancelledError:
+                flight.cancel()
+                raise
+            except Exception as e:
+                flight.set_exception(e)
+                flight.exception() # Marca a exceção como consumida quando ninguém está aguardando
+                raise
+            else:
+                flight.set_result(response)
+            finally:
+                if self._inflight.get(flight_key) is flight:
+                    del self._inflight[flight_key]
+            if flight.cancelled():
+                return await self._fallback_response(prompt, agent_key, namespace, deadline)
+            return response
+        finally:
+            self._record_deadline(deadline)
+
+    async def generate_response_stream(self, prompt: str, classification_result: Dict[str, Any], use_cache: bool = True,
+                                       priority: Priority = Priority.INTERACTIVE, deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
+        """
+        Versão em streaming de generate_response: produz a resposta em trechos, à medida que a API os gera,
+        para que o usuário veja o início da resposta antes do fim da geração. Respostas do cache, compartilhadas
+        com uma chamada idêntica em andamento ou obtidas sem streaming (falha antes do primeiro trecho) saem em um
+        único trecho. Uma falha no meio do stream (inclusive o fim do prazo) encerra a resposta com um aviso,
+        sem armazená-la no cache.
+        """
+        try:
+            start_time = time.time()
+            agent_key = self._resolve_agent_key(classification_result)
+            if use_cache:
+                with timed(deadline, "cache"):
+                    cached_response = await self._lookup_cached(prompt, classification_result, agent_key)
+                if cached_response is not None:
+                    yield cached_response
+                    return
+
+            namespace = self._cache_namespace(agent_key)
+            flight_key = self.cache.key_for(prompt, namespace)
+            try:
+                joined, response = await self._join_inflight(flight_key, prompt, deadline)
+            except DeadlineExceeded:
+                yield await self._fallback_response(prompt, agent_key, namespace, deadline)
+                return
+            if joined:
+                if response:
+                    yield response
+                return
+
+            flight = asyncio.get_running_loop().create_future()
+            self._inflight[flight_key] = flight
+            parts: List[str] = []
+            try:
+                agent = self._get_agent(agent_key)
+                model = self._route_model(agent_key, agent, classification_result, prompt)
+                full_prompt = self._build_prompt(agent, prompt, language=classification_result.get('language', 'pt'))
+                try:
+                    if not full_prompt:
+                        raise ValueError(f"Falha ao construir o prompt para o agente '{agent.name}'.")
+                    async for text in self._stream_prompt(self._agent_on_model(agent, model), full_prompt, priority, deadline):
+                        if not parts:
+                            self.streamed_responses += 1
+                            self.total_first_chunk_time += time.time() - start_time
+                        parts.append(text)
+                        yield text
+                except Exception as e:
+                    if not parts:
+                        if isinstance(e, genai.types.BlockedPromptException):
+                            if model == agent.model:
+                                flight.set_result(BLOCKED_RESPONSE)
+                                yield BLOCKED_RESPONSE
+                                return
+                            self._record_escalation(agent, model, "bloqueada")
+                            model = agent.model
+                        elif not isinstance(e, DeadlineExceeded):
+                            logger.warning(f"Streaming falhou antes do primeiro trecho ({e}). Usando a chamada sem streaming.")
+                        try:
+                            # Com o prazo esgotado, a chamada sem streaming desiste na hora e a resposta vem do fallback
+                            response = await self._generate_uncached(prompt, classification_result, agent_key, namespace, use_cache, priority, deadline, model)
+                        except DeadlineExceeded:
+                            flight.cancel() # Quem aguardava segue com uma chamada própria, dentro do próprio prazo
+                            response = await self._fallback_response(prompt, agent_key, namespace, deadline)
+                        else:
+                            flight.set_result(response)
+                        if response:
+                            yield response
+                        return
+                    logger.error(f"Streaming interrompido para o agente '{agent.name}': {e}")
+                    notice = "\n\n(Resposta interrompida. Por favor, tente novamente.)"
+                    flight.set_result("".join(parts) + notice)
+                    yield notice
+                    return
+
+                response = "".join(parts)
+                if not response:
+                    if model != agent.model:
+                        # Resposta vazia do modelo leve: sobe para o modelo do agente, sem streaming
+                        self._record_escalation(agent, model, "vazia")
+                        try:
+                            response = await self._generate_uncached(prompt, classification_result, agent_key, namespace, use_cache, priority, deadline, agent.model)
+                        except DeadlineExceeded:
+                            flight.cancel()
+                            response = await self._fallback_response(prompt, agent_key, namespace, deadline)
+                        else:
+                            flight.set_result(response)
+                    else:
+                        response = await self._fallback_response(prompt, agent_key, namespace)
+                        flight.set_result(response)
+                    if response:
+                        yield response
+                    return
+                if use_cache:
+                    await self.cache.aset(prompt, response, category=agent_key, namespace=namespace)
+                flight.set_result(response)
+            except BaseException as e:
+                # Consumidor cancelado ou que parou de ler o stream (GeneratorExit): libera quem aguardava
+                if not flight.done():
+                    if isinstance(e, Exception):
+                        flight.set_exception(e)
+                        flight.exception()
+                    else:
+                        flight.cancel()
+                raise
+            finally:
+                if self._inflight.get(flight_key) is flight:
+                    del self._inflight[flight_key]
+        finally:
+            self._record_deadline(deadline)
 
-        # 2. Roteamento para o agente apropriado
-        # Prioriza a primeira categoria classificada, ou usa 'general' como fallback
-        target_category = classification_result['categories'][0] if classification_result['categories'] else "general"
+    async def _lookup_cached(self, prompt: str, classification_result: Dict[str, Any], agent_key: str) -> Optional[str]:
+        """Busca a resposta no cache (agendando a revalidação se obsoleta) e atualiza as métricas de hit."""
+        cached = await self.cache.alookup(
+            prompt, category=agent_key,
+            namespace=self._cache_namespace(agent_key),
+            fallback_namespaces=self._fallback_namespaces(agent_key)
+        )
+        if not cached:
+            return None
+        if cached.stale:
+            # Stale-while-revalidate: responde já e atualiza a entrada em background
+            self._schedule_refresh(prompt, classification_result, agent_key)
+        self.cache_hits_saved += 1 # Manter para compatibilidade
+        # Atribui o hit ao agente principal da classificação, se houver
+        if agent_key in self.agents:
+            self.agent_metrics[self.agents[agent_key].name]["cache_hits"] += 1
         
-        # Mapeia a categoria do classificador para a chave do agente
-        if target_category == "concept": agent_key = "concept"
-        elif target_category == "code": agent_key = "code"
-        elif target_category == "resource": agent_key = "resource"
-        else: agent_key = "general" # Fallback para 'general' se a categoria não for mapeada
+        # Atualiza a métrica de eficiência do cache
+        total_requests = self.api_calls_made + self.cache_hits_saved + 1 # +1 para a requisição atual
+        cache_efficiency = (self.cache_hits_saved + 1) / total_requests if total_requests > 0 else 0
+        self.metrics_collector.update_metric('cache_efficiency', cache_efficiency)
+
+        logger.info(f"Resposta recuperada do cache para o prompt: '{prompt[:50]}...'")
+        return cached.response
 
+    async def _join_inflight(self, flight_key: str, prompt: str, deadline: Optional[Deadline] = None) -> Tuple[bool, Optional[str]]:
+        """
+        Aguarda uma chamada idêntica já em andamento (singleflight). Retorna (True, resposta)
+        se a resposta foi compartilhada, ou (False, None) se não havia chamada ou ela foi cancelada.
+        Com `deadline`, para de aguardar (DeadlineExceeded) quando o prazo acaba; a chamada continua para os demais.
+        """
+        inflight = self._inflight.get(flight_key)
+        if inflight is None:
+            return False, None
+        try:
+            response = await within(deadline, asyncio.shield(inflight), "inflight")
+        except asyncio.CancelledError:
+            if not inflight.cancelled():
+                raise # Esta requisição foi cancelada, não a que estava em andamento
+            logger.info(f"Chamada em andamento cancelada. Seguindo com chamada própria para o prompt: '{prompt[:50]}...'")
+            return False, None
+        self.deduplicated_calls += 1
+        logger.info(f"Resposta compartilhada com uma chamada em andamento para o prompt: '{prompt[:50]}...'")
+        return True, response
+
+    async def _generate_uncached(self, prompt: str, classification_result: Dict[str, Any], agent_key: str,
+                                 namespace: str, use_cache: bool, priority: Priority = Priority.INTERACTIVE,
+                                 deadline: Optional[Deadline] = None, model: Optional[str] = None) -> Optional[str]:
+        """
+        Chama a API para uma pergunta sem resposta em cache, com fallback para o cache e armazenamento do resultado.
+        Se o prazo acabar, levanta DeadlineExceeded (o chamador responde com o fallback). `model` fixa o modelo
+        da primeira tentativa; sem ele, o modelo é escolhido pela cascata.
+        """
+        # 3. Roteamento para o agente apropriado e, na cascata, para o modelo leve ou o do agente
         agent = self._get_agent(agent_key) # Usa o método de lazy loading
+        model = model or self._route_model(agent_key, agent, classification_result, prompt)
 
-        logger.info(f"Roteando para o agente: {agent.name} (Classificação: {classification_result['categories']})")
+        logger.info(f"Roteando para o agente: {agent.name} no modelo '{model}' (Classificação: {classification_result['categories']})")
 
-        # 3. Chama a API com retries e rate limiting, passando dados para o PromptBuilder
-        response = await self._call_gemini_api(
-            agent, 
-            prompt, 
-            user_level="iniciante", # Placeholder, idealmente viria do contexto do usuário
-            language=classification_result.get('language', 'pt') # Usa idioma detectado
-        )
+        # 4. Chama a API com retries e rate limiting, passando dados para o PromptBuilder
+        if self.batcher is not None:
+            # Com micro-batching, a pergunta pode dividir a chamada com outras do mesmo agente
+            # O lote segue para as demais perguntas mesmo que esta desista pelo prazo
+            response = await within(deadline, self.batcher.submit(
+                (agent_key, priority, model), {"prompt": prompt, "language": classification_result.get('language', 'pt')}
+            ), "batch")
+        else:
+            response = await self._call_gemini_api(
+                agent, 
+                prompt, 
+                user_level="iniciante", # Placeholder, idealmente viria do contexto do usuário
+                language=classification_result.get('language', 'pt'), # Usa idioma detectado
+                priority=priority,
+                deadline=deadline,
+                model=model
+            )
 
-        # 4. Fallback para cache em caso de falha da API
+        # 5. Fallback para cache em caso de falha da API
         if response is None:
-            logger.warning(f"Falha na API para o agente '{agent.name}'. Tentando fallback para cache (se houver).")
-            cached_response_fallback = self.cache.get_cached_response(prompt)
-            if cached_response_fallback:
-                self.cache_hits_saved += 1 # Manter para compatibilidade
-                if agent_key in self.agents:
-                    self.agent_metrics[self.agents[agent_key].name]["cache_hits"] += 1
-                
-                # Atualiza a métrica de eficiência do cache
-                total_requests = self.api_calls_made + self.cache_hits_saved + 1 # +1 para a requisição atual
-                cache_efficiency = (self.cache_hits_saved + 1) / total_requests if total_requests > 0 else 0
-                self.metrics_collector.update_metric('cache_efficiency', cache_efficiency)
-
-                logger.info(f"Resposta recuperada do cache como fallback para o prompt: '{prompt[:50]}...'")
-                return cached_response_fallback
-            else:
-                logger.error(f"Nenhuma resposta da API e nenhum fallback de cache para o prompt: '{prompt[:50]}...'")
-                return "Desculpe, não consegui processar sua solicitação no momento. Por favor, tente novamente mais tarde."
+            return await self._fallback_response(prompt, agent_key, namespace)
         
-        # 5. Armazena a resposta da API no cache
+        # 6. Armazena a resposta da API no cache (uma vez, mesmo com várias requisições aguardando)
         if use_cache and response:
-            self.cache.cache_response(prompt, response)
+            await self.cache.aset(prompt, response, category=agent_key, namespace=namespace)
             logger.debug(f"Resposta da API armazenada em cache para o prompt: '{prompt[:50]}...'")
         
         return response
 
+    async def _fallback_response(self, prompt: str, agent_key: str, namespace: str, deadline: Optional[Deadline] = None) -> str:
+        """
+        Resposta quando a API falha ou o prazo da requisição acaba: a do cache (de qualquer versão
+        do template), se houver, ou uma mensagem de erro.
+        """
+        logger.warning(f"Falha na API para o agente '{agent_key}'. Tentando fallback para cache (se houver).")
+        with timed(deadline, "fallback"):
+            cached_response_fallback = await self.cache.aget(
+                prompt, category=agent_key, namespace=namespace, fallback_namespaces=self._fallback_namespaces(agent_key)
+            )
+        if cached_response_fallback:
+            self.cache_hits_saved += 1 # Manter para compatibilidade
+            if agent_key in self.agents:
+                self.agent_metrics[self.agents[agent_key].name]["cache_hits"] += 1
+            
+            # Atualiza a métrica de eficiência do cache
+            total_requests = self.api_calls_made + self.cache_hits_saved + 1 # +1 para a requisição atual
+            cache_efficiency = (self.cache_hits_saved + 1) / total_requests if total_requests > 0 else 0
+            self.metrics_collector.update_metric('cache_efficiency', cache_efficiency)
+
+            logger.info(f"Resposta recuperada do cache como fallback para o prompt: '{prompt[:50]}...'")
+            return cached_response_fallback
+        logger.error(f"Nenhuma resposta da API e nenhum fallback de cache para o prompt: '{prompt[:50]}...'")
+        if deadline is not None and deadline.exceeded_stage is not None:
+            return "A resposta está demorando mais que o esperado. Por favor, tente novamente em instantes."
+        breaker = self._get_breaker(self._get_agent(agent_key).model)
+        if breaker.state == OPEN:
+            # Resposta degradada: a API está instável e o circuito impede novas chamadas por enquanto
+            minutes = max(1, round(breaker.retry_after() / 60))
+            return f"O serviço de IA está instável no momento. Por favor, tente novamente em cerca de {minutes} minuto(s)."
+        return "Desculpe, não consegui processar sua solicitação no momento. Por favor, tente novamente mais tarde."
+
+    async def _call_gemini_batch(self, batch_key: tuple, items: List[Dict[str, str]]) -> List[Optional[str]]:
+        """
+        Responde um lote de perguntas do mesmo agente com uma única chamada à API e separa as respostas.
+        Perguntas cuja resposta não pôde ser separada são refeitas com chamadas individuais,
+        que sobem na cascata se o modelo do lote for o leve.
+        """
+        agent_key, priority, model = batch_key
+        agent = self._get_agent(agent_key)
+        prompts = [self._build_prompt(agent, item['prompt'], language=item['language']) for item in items]
+        answers: List[Optional[str]] = [None] * len(items)
+        if len(items) > 1 and all(prompts):
+            logger.info(f"Enviando lote de {len(items)} perguntas em uma chamada para o agente '{agent.name}'.")
+            # O limite de saída do agente vale por resposta: o lote precisa de espaço para todas
+            max_output_tokens = (agent.generation_config or {}).get("max_output_tokens")
+            text = await self._send_prompt(
+                self._agent_on_model(agent, model), build_batch_prompt(prompts), priority=priority, output_tokens=API_OUTPUT_TOKENS_ESTIMATE * len(items),
+                generation_config={"max_output_tokens": max_output_tokens * len(items)} if max_output_tokens else None
+            )
+            answers = split_batch_response(text, len(items))
+            parsed = sum(1 for answer in answers if answer is not None)
+            if parsed:
+                self.batched_api_calls += 1
+                self.batched_questions += parsed
+            self.batch_fallbacks += len(items) - parsed
+            if parsed < len(items):
+                logger.warning(f"{len(items) - parsed} de {len(items)} respostas do lote não puderam ser separadas. Refazendo individualmente.")
+
+        missing = [index for index, answer in enumerate(answers) if answer is None]
+        individual = await asyncio.gather(*(
+            self._call_gemini_api(agent, items[index]['prompt'], language=items[index]['language'], priority=priority, model=model)
+            for index in missing
+        ))
+        for index, response in zip(missing, individual):
+            answers[index] = response
+        return answers
+
+    def _record_deadline(self, deadline: Optional[Deadline]):
+        """Acumula o tempo gasto por etapa de uma requisição com prazo e a etapa em que ele acabou, se acabou."""
+        if deadline is None:
+            return
+        self.deadline_requests += 1
+        for stage, seconds in deadline.stages.items():
+            self.stage_time_totals[stage] = self.stage_time_totals.get(stage, 0.0) + seconds
+        if deadline.exceeded_stage is not None:
+            self.deadlines_exceeded[deadline.exceeded_stage] = self.deadlines_exceeded.get(deadline.exceeded_stage, 0) + 1
+        logger.debug(f"Requisição concluída em {deadline.elapsed():.2f}s de {deadline.budget:.1f}s. Etapas: {deadline.format_stages()}")
+
+    def _schedule_refresh(self, prompt: str, classification_result: Dict[str, Any], agent_key: str):
+        """Agenda a revalidação de uma entrada obsoleta do cache, uma por prompt."""
+        if prompt in self._refreshing:
+            return
+        self._refreshing.add(prompt)
+        task = asyncio.get_running_loop().create_task(self._refresh_cached_response(prompt, classification_result, agent_key))
+        self._refresh_tasks.add(task)
+
+        def _done(finished: asyncio.Task):
+            self._refresh_tasks.discard(finished)
+            self._refreshing.discard(prompt)
+        task.add_done_callback(_done)
+
+    async def _refresh_cached_response(self, prompt: str, classification_result: Dict[str, Any], agent_key: str):
+        """Busca uma resposta nova com prioridade de background no rate limit e substitui a entrada obsoleta."""
+        namespace = self._cache_namespace(agent_key)
+        logger.info(f"Revalidando em background a resposta em cache para o prompt: '{prompt[:50]}...'")
+        response = await self._regenerate_response(prompt, classification_result, agent_key)
+        if response:
+            await self.cache.aset(prompt, response, category=agent_key, refresh=True, namespace=namespace)
+        else:
+            logger.warning(f"Falha ao revalidar a resposta em cache para o prompt: '{prompt[:50]}...'. Entrada obsoleta mantida.")
+
+    async def _regenerate_response(self, prompt: str, classification_result: Dict[str, Any], agent_key: str) -> Optional[str]:
+        """Gera em background (revalidação e re-aquecimento) a resposta que uma pergunta nova receberia, no mesmo modelo da cascata."""
+        agent = self._get_agent(agent_key)
+        return await self._call_gemini_api(
+            agent,
+            prompt,
+            user_level="iniciante",
+            language=classification_result.get('language', 'pt'),
+            priority=Priority.BACKGROUND,
+            model=self._route_model(agent_key, agent, classification_result, prompt)
+        )
+
+    def set_prompt_version(self, version: str) -> bool:
+        """
+        Troca a versão dos templates de prompt. As chaves da versão anterior continuam servindo
+        como fallback (obsoleto) e as mais acessadas são regeneradas em background na nova versão.
+        Retorna False se a versão não existir.
+        """
+        previous_version = self.prompt_builder.current_version
+        if version not in self.prompt_builder.templates:
+            logger.warning(f"Versão de template '{version}' não encontrada. Mantendo a versão {previous_version}.")
+            return False
+        if version == previous_version:
+            return True
+        self.prompt_builder.set_current_version(version)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.info("Sem loop de eventos em execução: re-aquecimento do cache não agendado (o fallback lazy continua ativo).")
+            return True
+        task = loop.create_task(self._rewarm_hot_keys(previous_version))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+        return True
+
+    async def _rewarm_hot_keys(self, previous_version: str):
+        """
+        Regenera, sob a versão atual do template, as respostas mais acessadas da versão anterior.
+        As chamadas usam prioridade de background no rate limit e são espaçadas por CACHE_REWARM_INTERVAL.
+        """
+        target_version = self.prompt_builder.current_version
+        previous_namespaces = [self._cache_namespace(agent_key, previous_version) for agent_key in self._agent_configs]
+        hottest = await self.cache.ahottest_entries(previous_namespaces, CACHE_REWARM_LIMIT)
+        logger.info(f"Re-aquecendo {len(hottest)} chaves do cache de {previous_version} para {target_version}.")
+        for item in hottest:
+            if self.prompt_builder.current_version != target_version:
+                logger.info("Versão do template alterada durante o re-aquecimento. Interrompendo.")
+                return
+            agent_key = item['category'] if item['category'] in self._agent_configs else "general"
+            namespace = self._cache_namespace(agent_key)
+            if await self.cache.acontains(item['prompt'], namespace=namespace):
+                continue # Já regenerada por uma requisição ou revalidação
+            classification_result = self.classifier.classify_question(item['prompt'])
+            response = await self._regenerate_response(item['prompt'], classification_result, agent_key)
+            if response:
+                await self.cache.aset(item['prompt'], response, category=agent_key, refresh=True, namespace=namespace)
+                self.rewarmed_entries += 1
+            await asyncio.sleep(CACHE_REWARM_INTERVAL)
+        logger.info(f"Re-aquecimento do cache concluído: {self.rewarmed_entries} respostas regeneradas até agora.")
+
     def get_usage_stats(self) -> Dict[str, Any]:
         """Retorna estatísticas de uso da API e do cache, incluindo por agente."""
         cache_stats = self.cache.get_stats()
@@ -276,23 +926,80 @@ de forma educada e concisa.
         return {
             "api_calls_total": self.api_calls_made,
             "cache_hits_total": self.cache_hits_saved,
-            "total_requests_processed": self.api_calls_made + self.cache_hits_saved,
+            "deduplicated_calls_total": self.deduplicated_calls,
+            "total_requests_processed": self.api_calls_made + self.cache_hits_saved + self.deduplicated_calls,
             "cache_stats": cache_stats,
             "agent_metrics": self.agent_metrics,
             "production_metrics": self.metrics_collector.metrics, # Inclui as métricas avançadas
+            "rate_limits": self.rate_limiter.get_stats(), # Saldo das cotas por modelo
+            "api_keys": self.credentials.get_key_stats(), # Uso e rodízio de cada chave da API
+            "request_queue": self.scheduler.get_stats(), # Fila e espera por classe de prioridade
+            "circuit_breakers": {model: breaker.get_stats() for model, breaker in self.circuit_breakers.items()},
+            "streaming": {
+                "streamed_responses": self.streamed_responses,
+                "avg_first_chunk_seconds": round(self.total_first_chunk_time / self.streamed_responses, 3) if self.streamed_responses else 0.0,
+            },
+            "deadlines": {
+                "requests": self.deadline_requests,
+                "exceeded_total": sum(self.deadlines_exceeded.values()),
+                "exceeded_by_stage": dict(self.deadlines_exceeded),
+                "avg_stage_seconds": {
+                    stage: round(total / self.deadline_requests, 3) for stage, total in self.stage_time_totals.items()
+                } if self.deadline_requests else {},
+            },
+            "batching": {
+                "enabled": self.batcher is not None,
+                "batched_api_calls": self.batched_api_calls,
+                "batched_questions": self.batched_questions,
+                "batch_fallbacks": self.batch_fallbacks,
+            },
             "active_alerts": self.alert_system.check_alerts() # Inclui os alertas ativos
         }
 
+    def start_background_tasks(self):
+        """Inicia as tarefas periódicas do orquestrador no loop de eventos em execução (ex: expiração do cache)."""
+        loop = asyncio.get_running_loop()
+        self._background_tasks.append(loop.create_task(self.cache.run_expiry_loop(CACHE_EXPIRY_INTERVAL)))
+        logger.info(f"Expiração do cache agendada a cada {CACHE_EXPIRY_INTERVAL}s.")
+
+    def _cancel_background_work(self):
+        for task in self._background_tasks + list(self._refresh_tasks):
+            task.cancel()
+        self._background_tasks = []
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def shutdown(self):
+        """Libera recursos do orquestrador, persistindo as escritas pendentes do cache."""
+        self._cancel_background_work()
+        self.cache.close()
+        logger.info("FreeTierOrchestrator encerrado. Cache persistido.")
+
+    async def ashutdown(self):
+        """Versão assíncrona de shutdown: o flush final do cache roda fora do loop de eventos."""
+        self._cancel_background_work()
+        await self.cache.aclose()
+        logger.info("FreeTierOrchestrator encerrado. Cache persistido.")
+
     def reset_stats(self):
         """Reseta as estatísticas de uso."""
         self.api_calls_made = 0
         self.cache_hits_saved = 0
+        self.deduplicated_calls = 0
+        self.streamed_responses = 0
+        self.total_first_chunk_time = 0.0
+        self.batched_api_calls = 0
+        self.batched_questions = 0
+        self.batch_fallbacks = 0
+        self.deadline_requests = 0
+        self.stage_time_totals = {}
+        self.deadlines_exceeded = {}
         self.total_response_time = 0
         self.successful_api_calls = 0
         self.cache.reset_stats()
         # Resetar agent_metrics para apenas os agentes que foram carregados
         for agent_name in self.agent_metrics:
-            self.agent_metrics[agent_name] = {"api_calls": 0, "cache_hits": 0}
+            self.agent_metrics[agent_name] = self._new_agent_metrics()
         self.metrics_collector = ProductionMetrics() # Reseta o coletor de métricas também
         self.alert_system = AlertSystem(self.metrics_collector) # Reseta o sistema de alertas
         logger.info("Estatísticas de uso do orquestrador resetadas.")
@@ -300,7 +1007,6 @@ de forma educada e concisa.
 # Exemplo de uso (para testes internos, pode ser removido em produção)
 if __name__ == "__main__":
     import sys
-    from tools.simple_classifier import SimpleClassifier # Importa o classificador
 
     # Adiciona um manipulador de console para ver os logs
     console_handler = logging.StreamHandler(sys.stdout)
@@ -318,9 +1024,9 @@ if __name__ == "__main__":
         # Para permitir que o teste continue sem uma chave real, vamos mockar a resposta da API
         # Isso é apenas para o bloco __main__ e não afeta o comportamento real da classe.
         class MockGenerativeModel:
-            def __init__(self, model_name):
+            def __init__(self, model_name, **kwargs):
                 self.model_name = model_name
-            async def generate_content_async(self, prompt):
+            async def generate_content_async(self, prompt, **kwargs):
                 class MockCandidate:
                     class MockContent:
                         parts = [type('obj', (object,), {'text': f"Mocked response from {self.model_name} for: {prompt}"})()]
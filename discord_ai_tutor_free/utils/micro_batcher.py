@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import re
+from typing import Optional, List, Dict, Any, Callable, Awaitable, Hashable
+
+logger = logging.getLogger(__name__)
+
+BATCH_END_MARKER = "[[FIM]]"
+_ANSWER_HEADER = re.compile(r"^[ \t]*\[\[RESPOSTA (\d+)\]\][ \t]*$", re.MULTILINE)
+
+def build_batch_prompt(prompts: List[str]) -> str:
+    """
+    Junta os prompts de várias perguntas em um único prompt, pedindo uma resposta
+    delimitada por pergunta para que o resultado possa ser separado depois.
+    """
+    header = (
+        f"Responda às {len(prompts)} solicitações independentes abaixo, cada uma seguindo as próprias instruções.\n"
+        "Comece cada resposta com uma linha contendo apenas [[RESPOSTA N]], onde N é o número da solicitação, "
+        f"responda na mesma ordem e termine com uma linha contendo apenas {BATCH_END_MARKER}.\n"
+    )
+    sections = [f"=== SOLICITAÇÃO {number} ===\n{prompt.strip()}" for number, prompt in enumerate(prompts, start=1)]
+    return header + "\n" + "\n\n".join(sections)
+
+def split_batch_response(text: str, count: int) -> List[Optional[str]]:
+    """
+    Separa a resposta de um prompt em lote por pergunta. Respostas ausentes, vazias
+    ou repetidas viram None, assim como a última se o marcador de fim não vier
+    (a geração pode ter sido truncada).
+    """
+    answers: List[Optional[str]] = [None] * count
+    seen: Dict[int, int] = {}
+    headers = list(_ANSWER_HEADER.finditer(text or ""))
+    for position, header in enumerate(headers):
+        number = int(header.group(1))
+        end = headers[position + 1].start() if position + 1 < len(headers) else len(text)
+        body = text[header.end():end]
+        if position + 1 == len(headers):
+            marker = body.rfind(BATCH_END_MARKER)
+            if marker == -1:
+                continue
+            body = body[:marker]
+        seen[number] = seen.get(number, 0) + 1
+        if 1 <= number <= count:
+            answers[number - 1] = body.strip() or None
+    for number, occurrences in seen.items():
+        if occurrences > 1 and 1 <= number <= count:
+            answers[number - 1] = None # Ambígua
+    return answers
+
+class MicroBatcher:
+    """
+    Agrupa itens enviados com a mesma chave dentro de uma janela curta e os
+    processa juntos com `flush(key, items)`, que devolve um resultado por item.
+
+    O primeiro item de uma chave abre o lote; o lote é processado quando a janela
+    (`window` segundos) termina ou quando atinge `max_size` itens. Se `flush`
+    falhar, todos os itens do lote recebem a exceção.
+    """
+
+    def __init__(self, flush: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+                 window: float = 0.5, max_size: int = 4):
+        self._flush = flush
+        self.window = window
+        self.max_size = max_size
+        self._pending: Dict[Hashable, List[Any]] = {} # chave -> [(item, future)]
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        self.batches_flushed = 0
+        self.items_batched = 0
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """Adiciona o item ao lote aberto da chave e aguarda o seu resultado."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((item, future))
+        if len(batch) >= self.max_size:
+            self._dispatch(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._dispatch, key)
+        return await asyncio.shield(future)
+
+    def _dispatch(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, batch: List[Any]):
+        items = [item for item, _ in batch]
+        self.batches_flushed += 1
+        self.items_batched += len(items)
+        logger.debug(f"Processando lote de {len(items)} itens para a chave {key}.")
+        try:
+            results = await self._flush(key, items)
+            if len(results) != len(items):
+                raise ValueError(f"Lote de {len(items)} itens retornou {len(results)} resultados.")
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Falha ao processar o lote da chave {key}: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def close(self):
+        """Cancela os lotes abertos e os em processamento."""
+        for timer in self._timers.values():
+            timer.cancel()
+        for batch in self._pending.values():
+            for _, future in batch:
+                future.cancel()
+        self._timers.clear()
+        self._pending.clear()
+        for task in list(self._tasks):
+            task.cancel()
@@ -0,0 +1,32 @@
+import logging
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+class ModelRouter:
+    """
+    Escolhe o modelo de cada pergunta em uma cascata de dois níveis: o modelo leve
+    (mais rápido e com cota própria) e o modelo do agente.
+
+    Uma pergunta vai para o modelo leve quando a sua categoria aceita o modelo leve,
+    a confiança do classificador atinge o mínimo da categoria e a pergunta tem no máximo
+    `light_max_words` palavras. O resto (ex: código, perguntas longas ou ambíguas) usa o
+    modelo do agente. Quem chama sobe para o modelo do agente se a resposta do leve
+    vier vazia ou bloqueada.
+    """
+
+    def __init__(self, light_model: str, light_categories: Dict[str, float], light_max_words: int = 25):
+        self.light_model = light_model
+        self.light_categories = light_categories # Categoria -> confiança mínima do classificador
+        self.light_max_words = light_max_words
+
+    def choose_model(self, agent_key: str, agent_model: str, classification_result: Dict[str, Any], question: str) -> str:
+        """Modelo da primeira tentativa: o leve, se a pergunta for simples, ou o do agente."""
+        min_confidence = self.light_categories.get(agent_key)
+        if min_confidence is None:
+            return agent_model
+        if classification_result.get('confidence_score', 0.0) < min_confidence:
+            return agent_model
+        if len(question.split()) > self.light_max_words:
+            return agent_model
+        return self.light_model
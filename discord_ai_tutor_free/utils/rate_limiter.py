@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+class RateLimitExceeded(Exception):
+    """A cota não terá capacidade suficiente antes do prazo (deadline) informado."""
+
+    def __init__(self, model: str, wait_seconds: float):
+        super().__init__(f"Cota do modelo '{model}' indisponível por {wait_seconds:.2f}s além do prazo.")
+        self.model = model
+        self.wait_seconds = wait_seconds
+
+class TokenBucket:
+    """
+    Balde de tokens: acumula até `capacity` tokens, repostos continuamente a
+    `refill_per_second`. Permite rajadas até a capacidade e limita a taxa média.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos até haver `amount` tokens disponíveis (0 se já houver)."""
+        self._refill()
+        amount = min(amount, self.capacity) # Pedidos maiores que o balde esperam apenas o balde cheio
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def take(self, amount: float):
+        """Consome tokens. O saldo pode ficar negativo (ex: correção do consumo real de tokens da API)."""
+        self._refill()
+        self.tokens -= amount
+
+class ModelLimiter:
+    """Baldes de requisições/minuto, tokens/minuto e requisições/dia de um modelo."""
+
+    def __init__(self, rpm: float, tpm: float, rpd: float, burst: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.requests_per_minute = TokenBucket(burst or rpm, rpm / 60, clock)
+        self.tokens_per_minute = TokenBucket(tpm, tpm / 60, clock)
+        # Aproximação contínua da cota diária (janela deslizante), sem depender do fuso do reset do provedor
+        self.requests_per_day = TokenBucket(rpd, rpd / 86400, clock)
+        self.lock = asyncio.Lock() # Atende quem espera por cota em ordem de chegada
+        self.granted = 0
+        self.total_wait = 0.0
+        self.rejected = 0
+
+    def wait_time(self, tokens: float) -> float:
+        return max(
+            self.requests_per_minute.wait_time(1),
+            self.tokens_per_minute.wait_time(tokens),
+            self.requests_per_day.wait_time(1)
+        )
+
+    def take(self, tokens: float):
+        self.requests_per_minute.take(1)
+        self.tokens_per_minute.take(tokens)
+        self.requests_per_day.take(1)
+
+class RateLimiter:
+    """
+    Limitador de chamadas à API com baldes de tokens por modelo para requisições
+    por minuto (RPM), tokens por minuto (TPM) e requisições por dia (RPD).
+
+    Chamadas dentro da cota saem imediatamente (rajadas até a capacidade dos
+    baldes); quando a cota acaba, os chamadores aguardam em ordem de chegada
+    apenas o tempo necessário para a reposição. As cotas vêm de
+    `API_RATE_LIMITS` em config.py: um dicionário por modelo com 'rpm', 'tpm',
+    'rpd' e, opcionalmente, 'burst' (capacidade do balde de RPM; padrão: rpm).
+    A entrada 'default' vale para modelos não listados.
+    """
+
+    def __init__(self, quotas: Dict[str, Dict[str, float]], clock: Callable[[], float] = time.monotonic):
+        self.quotas = quotas
+        self._clock = clock
+        self.limiters: Dict[str, ModelLimiter] = {}
+
+    def _get_limiter(self, model: str) -> ModelLimiter:
+        if model not in self.limiters:
+            quota = self.quotas.get(model, self.quotas.get("default"))
+            if quota is None:
+                raise ValueError(f"Nenhuma cota configurada para o modelo '{model}' e nenhuma cota 'default'.")
+            self.limiters[model] = ModelLimiter(quota['rpm'], quota['tpm'], quota['rpd'], quota.get('burst'), self._clock)
+        return self.limiters[model]
+
+    async def acquire(self, model: str, tokens: int = 0, deadline: Optional[float] = None) -> float:
+        """
+        Reserva uma requisição e `tokens` tokens da cota do modelo, aguardando se necessário.
+        `deadline` é um instante de time.monotonic(); se a cota não estiver disponível até lá,
+        levanta RateLimitExceeded sem consumir a cota. Retorna o tempo aguardado em segundos.
+        """
+        limiter = self._get_limiter(model)
+        start = self._clock()
+        try:
+            if deadline is None:
+                await limiter.lock.acquire()
+            else:
+                await asyncio.wait_for(limiter.lock.acquire(), timeout=max(deadline - self._clock(), 0))
+        except asyncio.TimeoutError:
+            limiter.rejected += 1
+            raise RateLimitExceeded(model, self._clock() - deadline) from None
+        try:
+            while True:
+                wait = limiter.wait_time(tokens)
+                if wait <= 0:
+                    limiter.take(tokens)
+                    break
+                if deadline is not None and self._clock() + wait > deadline:
+                    limiter.rejected += 1
+                    raise RateLimitExceeded(model, self._clock() + wait - deadline)
+                logger.warning(f"Cota do modelo '{model}' esgotada. Aguardando {wait:.2f} segundos.")
+                await asyncio.sleep(wait)
+        finally:
+            limiter.lock.release()
+        waited = self._clock() - start
+        limiter.granted += 1
+        limiter.total_wait += waited
+        return waited
+
+    def try_acquire(self, model: str, tokens: int = 0, waited: float = 0.0) -> float:
+        """
+        Reserva a cota sem aguardar, para quem controla a própria fila (ex: RequestScheduler).
+        Retorna 0.0 se a cota foi reservada; senão, os segundos até haver cota, sem consumi-la.
+        `waited` é o tempo que o chamador já aguardou, contabilizado na espera média.
+        """
+        limiter = self._get_limiter(model)
+        wait = limiter.wait_time(tokens)
+        if wait > 0:
+            return wait
+        limiter.take(tokens)
+        limiter.granted += 1
+        limiter.total_wait += waited
+        return 0.0
+
+    def headroom(self, model: str) -> float:
+        """Fração livre do balde mais apertado do modelo (1.0: cota cheia; 0 ou menos: esgotada)."""
+        limiter = self._get_limiter(model)
+        buckets = (limiter.requests_per_minute, limiter.tokens_per_minute, limiter.requests_per_day)
+        for bucket in buckets:
+            bucket._refill()
+        return min(bucket.tokens / bucket.capacity for bucket in buckets)
+
+    def record_usage(self, model: str, reserved_tokens: int, actual_tokens: int):
+        """Ajusta o balde de TPM pela diferença entre os tokens reservados e os realmente consumidos."""
+        self._get_limiter(model).tokens_per_minute.take(actual_tokens - reserved_tokens)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Saldo atual dos baldes e tempo médio de espera por modelo."""
+        stats = {}
+        for model, limiter in self.limiters.items():
+            for bucket in (limiter.requests_per_minute, limiter.tokens_per_minute, limiter.requests_per_day):
+                bucket._refill()
+            stats[model] = {
+                "rpm_available": round(limiter.requests_per_minute.tokens, 2),
+                "tpm_available": round(limiter.tokens_per_minute.tokens),
+                "rpd_available": round(limiter.requests_per_day.tokens, 2),
+                "granted": limiter.granted,
+                "rejected": limiter.rejected,
+                "avg_wait_seconds": round(limiter.total_wait / limiter.granted, 3) if limiter.granted else 0.0,
+            }
+        return stats
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa de tokens de um texto (~4 caracteres por token), usada antes da resposta da API."""
+    return max(1, len(text) // 4)
@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Optional, Dict, Any, List, Callable
+
+from utils.rate_limiter import RateLimiter, RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    """Classes de prioridade das chamadas à API (menor valor = atendida primeiro)."""
+    INTERACTIVE = 0 # Perguntas de usuários (menções e DMs)
+    ADMIN = 1 # Comandos administrativos e diagnósticos (ex: test-api)
+    BACKGROUND = 2 # Revalidação e re-aquecimento do cache
+
+class _Ticket:
+    """Uma requisição aguardando cota na fila de um modelo."""
+    __slots__ = ("priority", "tokens", "enqueued_at", "sequence")
+
+    def __init__(self, priority: Priority, tokens: int, enqueued_at: float, sequence: int):
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued_at = enqueued_at
+        self.sequence = sequence
+
+class _ClassStats:
+    """Profundidade da fila e tempos de espera de uma classe de prioridade."""
+
+    def __init__(self):
+        self.queued = 0
+        self.max_queued = 0
+        self.dispatched = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+class RequestScheduler:
+    """
+    Escalonador das chamadas à API na frente do RateLimiter.
+
+    Cada modelo tem uma fila; quando a cota acaba, a próxima requisição a
+    receber cota é a de menor prioridade efetiva: a classe (Priority) menos
+    um ponto a cada `aging_seconds` de espera, com empate resolvido por ordem
+    de chegada. Assim perguntas de usuários passam na frente do trabalho em
+    background, e o envelhecimento impede que o background espere para sempre
+    sob pressão contínua. Dentro da cota, as requisições saem imediatamente.
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, aging_seconds: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate_limiter = rate_limiter
+        self.aging_seconds = aging_seconds
+        self._clock = clock
+        self._queues: Dict[str, List[_Ticket]] = {}
+        self._conditions: Dict[str, asyncio.Condition] = {}
+        self._sequence = itertools.count()
+        self.stats: Dict[Priority, _ClassStats] = {priority: _ClassStats() for priority in Priority}
+
+    def _effective_priority(self, ticket: _Ticket, now: float) -> float:
+        if self.aging_seconds <= 0:
+            return ticket.priority
+        return ticket.priority - (now - ticket.enqueued_at) / self.aging_seconds
+
+    def _head(self, queue: List[_Ticket], now: float) -> _Ticket:
+        """Próxima requisição a receber cota."""
+        return min(queue, key=lambda ticket: (self._effective_priority(ticket, now), ticket.sequence))
+
+    async def acquire(self, model: str, tokens: int = 0, priority: Priority = Priority.INTERACTIVE,
+                      deadline: Optional[float] = None) -> float:
+        """
+        Aguarda a vez da requisição na fila do modelo e reserva a cota no RateLimiter.
+        `deadline` é um instante de time.monotonic(); se a cota não for concedida até lá,
+        levanta RateLimitExceeded sem consumi-la. Retorna o tempo aguardado em segundos.
+        """
+        queue = self._queues.setdefault(model, [])
+        condition = self._conditions.setdefault(model, asyncio.Condition())
+        stats = self.stats[priority]
+        ticket = _Ticket(priority, tokens, self._clock(), next(self._sequence))
+
+        async with condition:
+            queue.append(ticket)
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+            timed_out = False
+            try:
+                while True:
+                    now = self._clock()
+                    timeout = None if deadline is None else deadline - now
+                    if self._head(queue, now) is ticket:
+                        wait = self.rate_limiter.try_acquire(model, tokens, waited=now - ticket.enqueued_at)
+                        if wait <= 0:
+                            break
+                        if deadline is not None and now + wait > deadline:
+                            raise RateLimitExceeded(model, now + wait - deadline)
+                        logger.warning(f"Cota do modelo '{model}' esgotada. Requisição {priority.name} aguardando {wait:.2f} segundos ({len(queue)} na fila).")
+                        timeout = wait
+                    else:
+                        if timeout is not None and timeout <= 0:
+                            raise RateLimitExceeded(model, now - deadline)
+                        if timed_out:
+                            # O envelhecimento pode ter mudado a vez enquanto só esta requisição estava acordada
+                            condition.notify_all()
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout)
+                        timed_out = False
+                    except asyncio.TimeoutError:
+                        timed_out = True
+            except RateLimitExceeded:
+                stats.rejected += 1
+                raise
+            finally:
+                queue.remove(ticket)
+                stats.queued -= 1
+                condition.notify_all() # A próxima da fila reavalia a cota
+
+        waited = self._clock() - ticket.enqueued_at
+        stats.dispatched += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        return waited
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Profundidade da fila e tempos de espera por classe de prioridade."""
+        return {
+            priority.name.lower(): {
+                "queued": stats.queued,
+                "max_queued": stats.max_queued,
+                "dispatched": stats.dispatched,
+                "rejected": stats.rejected,
+                "avg_wait_seconds": round(stats.total_wait / stats.dispatched, 3) if stats.dispatched else 0.0,
+                "max_wait_seconds": round(stats.max_wait, 3),
+            }
+            for priority, stats in self.stats.items()
+        }